@@ -438,6 +438,74 @@ def AngleBetweenNormals(HKL1s, HKL2s, Gstar):
     return GT.AngleBetweenVectors(HKL1r, HKL2r, metrics=Gstar)
 
 
+def getHarmonicsIndices(hkl, merge_antiparallel=False):
+    r"""
+    sort a set of hkl 3d vectors into fundamentals and harmonics in O(n)
+
+    Each integer vector (h,k,l) is reduced to its primitive direction
+    (h,k,l)/n with n = gcd(|h|,|k|,|l|) (harmonic order). Vectors sharing the same
+    primitive direction are harmonics of each other and only the one of lowest
+    order n is kept (first occurrence in case of tie).
+    Non integer vectors are reduced to their unit vector (rounded to 9 decimals)
+    and ordered by their norm. Null vectors are always kept.
+
+    :param hkl: array of 3d hkl indices (shape = (n,3))
+    :param merge_antiparallel: False, vec and -n vec are different directions (Laue spots)
+                               True, vec and -n vec are the same lattice planes normal
+
+    :return: tokeep, toremove: sorted arrays of indices in hkl of fundamentals and harmonics
+    """
+    hkl = np.asarray(hkl).reshape((-1, 3))
+    nb_hkl = len(hkl)
+    indices = np.arange(nb_hkl)
+    if nb_hkl < 2:
+        return indices, np.array([], dtype=np.int64)
+
+    rounded_hkl = np.rint(hkl)
+    if np.all(rounded_hkl == hkl):
+        ihkl = rounded_hkl.astype(np.int64)
+        order = np.gcd.reduce(np.abs(ihkl), axis=1)
+        nonzero = order > 0
+        directions = ihkl[nonzero] // order[nonzero, np.newaxis]
+    else:
+        order = np.sqrt(np.sum(hkl ** 2, axis=1))
+        nonzero = order > 0
+        # + 0. turns -0. into 0. (np.unique compares raw bytes)
+        directions = np.round(hkl[nonzero] / order[nonzero, np.newaxis], decimals=9) + 0.0
+
+    if merge_antiparallel and len(directions):
+        # sign of the first non zero component is set positive
+        firstnonzero = np.argmax(directions != 0, axis=1)
+        signs = np.sign(directions[np.arange(len(directions)), firstnonzero])
+        directions = directions * signs[:, np.newaxis] + 0
+
+    if directions.dtype.kind == "i" and len(directions):
+        # single int64 key per direction: 1D hashing is much faster than rows comparison
+        maxindex = np.amax(np.abs(directions)) + 1
+        base = 2 * maxindex + 1
+        if base ** 3 < 2 ** 62:
+            shifted = directions + maxindex
+            keys = (shifted[:, 0] * base + shifted[:, 1]) * base + shifted[:, 2]
+            _, groups = np.unique(keys, return_inverse=True)
+        else:
+            _, groups = np.unique(directions, axis=0, return_inverse=True)
+    else:
+        _, groups = np.unique(directions, axis=0, return_inverse=True)
+
+    nz_indices = indices[nonzero]
+    # sort by group, then by harmonic order, then by position in hkl
+    sortedpos = np.lexsort((nz_indices, order[nonzero], groups))
+    sortedgroups = groups[sortedpos]
+    isfirst = np.ones(len(sortedpos), dtype=bool)
+    isfirst[1:] = sortedgroups[1:] != sortedgroups[:-1]
+
+    toremove = np.sort(nz_indices[sortedpos[~isfirst]])
+    keepmask = np.ones(nb_hkl, dtype=bool)
+    keepmask[toremove] = False
+
+    return indices[keepmask], toremove
+
+
 def FilterHarmonics_2(hkl, return_indices_toremove=0):
     r"""
     keep only hkl 3d vectors that are representative of direction nh,nk,nl
@@ -447,6 +515,8 @@ def FilterHarmonics_2(hkl, return_indices_toremove=0):
 
     :param hkl: array of 3d hkl indices
     :param return_indices_toremove: 1, returns indices of element in hkl that have been removed
+
+    .. note:: uses getHarmonicsIndices() (gcd reduction) instead of pairwise angles
     """
     if not isinstance(hkl, (np.ndarray, list)):
         print("hkl", hkl)
@@ -455,56 +525,14 @@ def FilterHarmonics_2(hkl, return_indices_toremove=0):
         raise ValueError("hkl is not an array!!")
     if isinstance(hkl, list):
         hkl = np.array(hkl)
-    if np.array(hkl).shape[0] == 1:
-        # print "input array has only one element!"
-        return hkl
-    # square array with element[i,j] = angle between hkl[i] and hkl[j]
-    nb_hkl = len(hkl)
-    angles = np.round(AngleBetweenNormals(hkl, hkl, np.eye(3)), decimals=9)
-    ra = np.ravel(angles)
-    ind_in_flat_a = GT.indices_in_flatTriuMatrix(nb_hkl)
-    # 1D array
-    angle_pairs = np.take(ra, ind_in_flat_a)
-
-    # index of zeros
-    pos_zeros = np.where(angle_pairs == 0)[0]
-
-    # print "pos_zeros",pos_zeros
-
-    if len(pos_zeros) > 0:
-        hkls_pairs_index = GT.indices_in_TriuMatrix(ind_in_flat_a[pos_zeros], nb_hkl)
-        cliques_of_harmonics = GT.getSets(hkls_pairs_index)
-
-        allelem_in_cliques = []
-        for cli in cliques_of_harmonics:
-            allelem_in_cliques += cli
-        initial_set = set(allelem_in_cliques)
-        #        print "initial toremove_set", allelem_in_cliques
-
-        tokeep = []
-        for clique in cliques_of_harmonics:
-            #            print "clique", clique
-            abshkl = np.abs(np.take(hkl, clique, axis=0))
-            fond_index = np.argmin(np.sum(abshkl, axis=1))
-
-            #            print abshkl
-            #            print fond_index
-            #            print "tokeep", clique[fond_index]
-            tokeep.append(clique[fond_index])
-
-        toremove = list(initial_set - set(tokeep))
-        filtered_hkl = np.delete(hkl, toremove, axis=0)
-        if return_indices_toremove:
-            return filtered_hkl, toremove
-        else:
-            return filtered_hkl
 
+    tokeep, toremove = getHarmonicsIndices(hkl)
+    filtered_hkl = np.take(hkl, tokeep, axis=0)
+
+    if return_indices_toremove:
+        return filtered_hkl, toremove.tolist()
     else:
-        #         print "hkl doesn't contain harmonics ..."
-        if return_indices_toremove:
-            return hkl, []
-        else:
-            return hkl
+        return filtered_hkl
 
 
 # ---- -----Unit Cell parameters - Reciprocal and Direct Lattice Parameters  -----
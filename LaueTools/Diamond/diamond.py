@@ -1841,7 +1841,8 @@ def build_Ipix_vs_img_table(indimg,
                             ccdlabel=None,
                             nbdigits=4,
                             xypic_from_LaueTools_Peak_Search_datfile=1,
-                            xypic_from_Imagej=0):
+                            xypic_from_Imagej=0,
+                            nb_of_cpu=1):
 
     # utilise xypic sortis du peak search LaueTools,
     # decales de 1 pixel en x y par rapport au xypic affiches par Imagej
@@ -1916,7 +1917,23 @@ def build_Ipix_vs_img_table(indimg,
     framedim = DictLT.dict_CCD[ccdlabel][0]
     datasizebytes = np.prod(framedim) * 2
 
-    for kk in indimg:
+    imfiles = [os.path.join(imfile_path, imfile_prefix + MG.imgnum_to_str(kk, nbdigits) + imfile_suffix)
+                for kk in indimg]
+    firstimfile = imfiles[0]
+
+    # all pixels of all (uncompressed) images in one pass (memory mapped files)
+    # pixel (xpic, ypic) of LaueTools frame is (xpic - 1, ypic - 1) in image array
+    if (not imfile_suffix.endswith("gz") and fliprot in ("no", "VHR_Feb13")
+            and ccdlabel not in rmccd.CCDLABELS_NOT_MEMMAPABLE):
+        listI[:] = rmccd.readimages_manyROIs(imfiles, xy_LT - 1,
+                                                halfboxsize=0,
+                                                CCDLabel=ccdlabel,
+                                                nb_of_cpu=nb_of_cpu)[:, :, 0, 0]
+        indimg_toread = []
+    else:
+        indimg_toread = indimg
+
+    for kk in indimg_toread:
 
         fileim = os.path.join(imfile_path, imfile_prefix + MG.imgnum_to_str(kk, nbdigits) + imfile_suffix)
         if kim == 0:
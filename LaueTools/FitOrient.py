@@ -37,27 +37,33 @@ RAD = 1.0 / DEG
 IDENTITYMATRIX = np.eye(3)
 
 def remove_harmonic(hkl, uflab, yz):
+    r"""
+    removes harmonics from theoretical peak list
 
+    peaks are grouped by primitive hkl (hkl/gcd(h,k,l)) and only the fundamental
+    (lowest harmonic order) is kept, as in lauecore simulations (see CP.getHarmonicsIndices).
+
+    .. note:: harmonics share the same scattered beam direction uflab, so they are the peaks
+        removed by the former rule (uflab closer than 0.05 to a previous peak in list order),
+        except that the fundamental is kept whatever its position in the list and that
+        distinct reflections with close (but different) uflab are no longer removed
+
+    :param hkl: array of miller indices (shape = (n,3))
+    :param uflab: array of scattered beam unit vectors (shape = (n,3))
+    :param yz: array of peaks position (shape = (n,2))
+
+    :return: hkl2, uflab2, yz2, nspots2, isbadpeak (1 for harmonics, 0 otherwise)
+    """
     # print "removing harmonics from theoretical peak list"
+    hkl = np.asarray(hkl)
     nn = len(uflab[:, 0])
-    isbadpeak = np.zeros(nn, dtype=np.int)
-    toluf = 0.05
-
-    for i in list(range(nn)):
-        if isbadpeak[i] == 0:
-            # print "i=", i
-            for j in list(range(i + 1, nn)):
-                if isbadpeak[j] == 0:
-                    # print "j=", j
-                    if GT.norme_vec(uflab[j, :] - uflab[i, :]) < toluf:
-                        isbadpeak[j] = 1
-                        # print "harmonics :"
-                        # print hkl[i,:]
-                        # print hkl[j,:]
+    isbadpeak = np.zeros(nn, dtype=np.int64)
+
+    # shared harmonics engine (hkl grouping) rather than uflab proximity
+    index_goodpeak, index_badpeak = CP.getHarmonicsIndices(hkl)
+    isbadpeak[index_badpeak] = 1
 
     # print "isbadpeak = ", isbadpeak
-    index_goodpeak = np.where(isbadpeak == 0)
-    # print "index_goodpeak =", index_goodpeak
     hkl2 = hkl[index_goodpeak]
     uflab2 = uflab[index_goodpeak]
     yz2 = yz[index_goodpeak]
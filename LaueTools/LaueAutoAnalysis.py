@@ -90,10 +90,10 @@ def SimulateResult_withMiller(grain, emin, emax, defaultParam, pixelsize=165.0 /
                                         HarmonicsRemoval=1,
                                         pixelsize=pixelsize)
 
-    Twicetheta = [spot.Twicetheta for spot in TwicethetaChi[0]]
-    Chi = [spot.Chi for spot in TwicethetaChi[0]]
-    Miller_ind = [list(spot.Millers) for spot in TwicethetaChi[0]]
-    Energy = [spot.EwaldRadius * CST_ENERGYKEV for spot in TwicethetaChi[0]]
+    Twicetheta = TwicethetaChi[0].Twicetheta.tolist()
+    Chi = TwicethetaChi[0].Chi.tolist()
+    Miller_ind = TwicethetaChi[0].Millers.tolist()
+    Energy = TwicethetaChi[0].Energy.tolist()
 
     posx, posy = F2TC.calc_xycam_from2thetachi(Twicetheta,
                                                 Chi,
@@ -144,9 +144,9 @@ def simulate_theo(grain, emax, emin, paramDet, pixelsize, dim):
                                         detectordiameter=detectordiameter,
                                         kf_direction=kf_direction)
 
-    twicetheta = [spot.Twicetheta for spot in TwicethetaChi[0]]
-    chi = [spot.Chi for spot in TwicethetaChi[0]]
-    Miller_ind = [list(spot.Millers) for spot in TwicethetaChi[0]]
+    twicetheta = TwicethetaChi[0].Twicetheta.tolist()
+    chi = TwicethetaChi[0].Chi.tolist()
+    Miller_ind = TwicethetaChi[0].Millers.tolist()
 
     posx, posy = F2TC.calc_xycam_from2thetachi(twicetheta,
                                                 chi,
@@ -1516,10 +1516,10 @@ if __name__ == "__main__":
                                         HarmonicsRemoval=1,
                                         pixelsize=pixelsize)
 
-    Twicetheta = [spot.Twicetheta for spot in TwicethetaChi[0]]
-    Chi = [spot.Chi for spot in TwicethetaChi[0]]
-    Miller_ind = [list(spot.Millers) for spot in TwicethetaChi[0]]
-    Energy = [spot.EwaldRadius * CST_ENERGYKEV for spot in TwicethetaChi[0]]
+    Twicetheta = TwicethetaChi[0].Twicetheta.tolist()
+    Chi = TwicethetaChi[0].Chi.tolist()
+    Miller_ind = TwicethetaChi[0].Millers.tolist()
+    Energy = TwicethetaChi[0].Energy.tolist()
 
     posx, posy = F2TC.calc_xycam_from2thetachi(Twicetheta,
                                                 Chi,
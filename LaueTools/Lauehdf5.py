@@ -18,6 +18,7 @@ if sys.version_info.major == 3:
     from . import IOLaueTools as IOLT
     from . import dict_LaueTools as DictLT
     from . import orientations as ORI
+    from . import headerindex as HIDX
 else:
 
     import generaltools as GT
@@ -25,6 +26,7 @@ else:
     import IOLaueTools as IOLT
     import dict_LaueTools as DictLT
     import orientations as ORI
+    import headerindex as HIDX
 
 
 MAX_NUMBER_GRAINS = 3
@@ -1087,6 +1089,159 @@ def build_hdf5_fromSummaryFile(
     return True
 
 
+# --- ----------   Pack image files series in one compressed hdf5 file
+# compression of frames: library (blosc is replaced by zlib if not available) and level
+IMAGESERIES_COMPLIB = "blosc"
+IMAGESERIES_COMPLEVEL = 5
+# path of metadata table (frames are at RMCCD.HDF5STACK_DATAPATH)
+IMAGESERIES_METADATAPATH = "/entry/metadata"
+
+
+class ImageMetadata(Tab.IsDescription):
+    """header and motors positions of a packed image file (see headerindex.read_imagemetadata)
+    """
+
+    stackimageindex = Tab.UInt32Col()
+    filename = Tab.StringCol(256)
+    mtime = Tab.Float64Col()
+    filesize = Tab.Int64Col()
+    exposure = Tab.Float64Col(dflt=np.nan)
+    monitor = Tab.Float64Col(dflt=np.nan)
+    xech = Tab.Float64Col(dflt=np.nan)
+    yech = Tab.Float64Col(dflt=np.nan)
+    zech = Tab.Float64Col(dflt=np.nan)
+    timestamp = Tab.Float64Col()
+    timestampsource = Tab.StringCol(8)
+    comments = Tab.StringCol(512)
+
+
+def pack_imageseries(filenames, output_hdf5_filename, CCDLabel="MARCCD165", dirname=None,
+                                                        complib=IMAGESERIES_COMPLIB,
+                                                        complevel=IMAGESERIES_COMPLEVEL,
+                                                        verbose=0):
+    """
+    pack a series of image files in one hdf5 file, to be read with CCDLabel returned by
+    get_imageseries_CCDLabel() (pixel size, saturation and binary format of CCDLabel detector)
+
+    Frames (as returned by readCCDimage) are stored in a compressed array (one chunk per frame)
+    at RMCCD.HDF5STACK_DATAPATH. Header values and motors positions of each file
+    are stored as rows of a table at IMAGESERIES_METADATAPATH
+
+    :param filenames: list of image filenames. Position in list is the stackimageindex of frame
+    :param output_hdf5_filename: full path to hdf5 file to create
+    :param CCDLabel: key of dict_CCD of image files
+    :param dirname: folder of images (None if filenames are full paths)
+    :param complib: compression library ('blosc', 'zlib', 'lzo', 'bzip2')
+    :param complevel: compression level from 0 (no compression) to 9
+
+    :return: nb of packed frames
+    """
+    if complib == "blosc" and Tab.which_lib_version("blosc") is None:
+        complib = "zlib"
+
+    nbframes = len(filenames)
+    if nbframes == 0:
+        raise ValueError("No image to pack")
+    if dirname is not None:
+        filenames = [os.path.join(dirname, filename) for filename in filenames]
+
+    # file may be opened by the module stack reader
+    RMCCD.getHDF5StackReader().release(output_hdf5_filename)
+
+    firstframe = RMCCD.readCCDimage(filenames[0], CCDLabel=CCDLabel, use_memmap=True)[0]
+    framedim = firstframe.shape
+
+    datagroup, dataname = RMCCD.HDF5STACK_DATAPATH.rsplit("/", 1)
+    metadatagroup, metadataname = IMAGESERIES_METADATAPATH.rsplit("/", 1)
+
+    h5file = Tab.open_file(output_hdf5_filename, mode="w", title="packed %s images" % CCDLabel)
+    try:
+        filters = Tab.Filters(complevel=complevel, complib=complib, shuffle=True)
+        frames = h5file.create_carray(datagroup, dataname,
+                                        atom=Tab.Atom.from_dtype(firstframe.dtype),
+                                        shape=(nbframes,) + framedim,
+                                        filters=filters,
+                                        chunkshape=(1,) + framedim,
+                                        createparents=True)
+        frames.attrs.CCDLabel = CCDLabel
+        frames.attrs.pixelsize = DictLT.dict_CCD[CCDLabel][1]
+        frames.attrs.saturation = DictLT.dict_CCD[CCDLabel][2]
+        frames.attrs.stackCCDLabel = RMCCD.registerPackedStackCCDLabel(CCDLabel,
+                                                                    framedim=framedim,
+                                                                    dtype=firstframe.dtype)
+
+        table = h5file.create_table(metadatagroup, metadataname, ImageMetadata,
+                                    "headers of packed image files",
+                                    expectedrows=nbframes,
+                                    createparents=True)
+        row = table.row
+
+        for stackimageindex, filename in enumerate(filenames):
+            if stackimageindex == 0:
+                frame = firstframe
+            else:
+                frame = RMCCD.readCCDimage(filename, CCDLabel=CCDLabel, use_memmap=True)[0]
+            if frame.shape != framedim:
+                raise ValueError("frame dimensions of %s %s differ from %s"
+                                                % (filename, frame.shape, framedim))
+            frames[stackimageindex] = frame
+
+            metadata = HIDX.read_imagemetadata(filename, CCDLabel=CCDLabel, verbose=verbose)
+            row["stackimageindex"] = stackimageindex
+            row["filename"] = os.path.basename(filename).encode()
+            row["timestampsource"] = metadata["timestampsource"].encode()
+            row["comments"] = metadata["comments"].encode("latin-1", "replace")
+            for key in ("mtime", "filesize", "exposure", "monitor", "xech", "yech", "zech",
+                        "timestamp"):
+                if metadata[key] is not None:
+                    row[key] = metadata[key]
+            row.append()
+
+            if verbose:
+                print("%s packed at stackimageindex %d" % (filename, stackimageindex))
+
+        table.flush()
+    finally:
+        h5file.close()
+
+    return nbframes
+
+
+def get_imageseries_CCDLabel(hdf5_filename):
+    """
+    return CCD label to read frames of packed image file series (and to use in peak search,
+    calibration...): detector parameters (pixel size, saturation, frame dimensions and dtype)
+    are read from packed file attributes and registered in dict_CCD
+    (see RMCCD.registerPackedStackCCDLabel()).
+    In other processes, the returned label is registered on demand with the parameters of
+    the packed detector (see RMCCD.resolvePackedStackCCDLabel())
+    """
+    with Tab.open_file(hdf5_filename, mode="r") as h5file:
+        frames = h5file.get_node(RMCCD.HDF5STACK_DATAPATH)
+        attrs = frames.attrs
+        return RMCCD.registerPackedStackCCDLabel(str(attrs.CCDLabel),
+                                                framedim=frames.shape[1:],
+                                                pixelsize=attrs.pixelsize,
+                                                saturation=attrs.saturation,
+                                                dtype=frames.dtype)
+
+
+def read_imageseries_metadata(hdf5_filename):
+    """
+    return metadata table of packed image file series as a numpy record array
+    (fields of ImageMetadata)
+    """
+    with Tab.open_file(hdf5_filename, mode="r") as h5file:
+        return h5file.get_node(IMAGESERIES_METADATAPATH).read()
+
+
+def read_imageseries_frames(hdf5_filename, stackimageindices):
+    """
+    return 3D array of frames at positions stackimageindices of packed image file series
+    """
+    return RMCCD.getHDF5StackReader().getframes(hdf5_filename, stackimageindices)
+
+
 # --- --------------  QUERY the database
 
 
@@ -297,6 +297,7 @@ dict_CCD = {
     "EIGER_4M": ((2167, 2070), 0.075, 4294967295, "no", 0, "uint32", "CCD parameters read from tif header EIGER4M used at ALS", "tif"),
     "EIGER_4Mstack": ((2167, 2070), 0.075, 4294967295, "no", 0, "uint32", "detector parameters read hdf5 EIGER4M stack used at SLS", "h5"),
     "EIGER_4Munstacked": ((2167, 2070), 0.075, 4294967295, "no", 0, "uint32", "unstacked hdf5 EIGER4M  used at SLS", "unstacked"),
+    "LaueHDF5stack": ((2048, 2048), 0.079142, 65535, "no", 0, "uint16", "MARCCD165 image series packed in one compressed hdf5 file (see Lauehdf5.pack_imageseries). framedim read from file. Other detectors: see Lauehdf5.get_imageseries_CCDLabel", "h5"),
     "EIGER_1M": ((1065, 1030), 0.075, 4294967295, "no", 0, "uint32", "CCD parameters read from edf header EIGER1M at BM32 ESRF", "edf"),
 }
 
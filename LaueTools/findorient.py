@@ -1204,10 +1204,12 @@ def FilterHarmonics(hkl):
     keep only hkl 3d vectors that are representative of direction nh,nk,nl
     for any h,k,l signed integers
 
-    TODO: not working ??? see corresponding test: test_FilterHarmonics
-    See FilterHarmonics_2 in CrystalParameters
+    Parallel AND antiparallel vectors are considered as the same lattice planes normal:
+    the one of lowest harmonic order is kept (see CP.getHarmonicsIndices)
 
-    NOTE: this function used to build angles LUT seems correct
+    See FilterHarmonics_2 in CrystalParameters (which keeps antiparallel vectors)
+
+    NOTE: this function is used to build angles LUT
     """
     #     print "np.array(hkl) in FilterHarmonics", np.array(hkl)
     if np.array(hkl).shape[0] == 1:
@@ -1215,43 +1217,11 @@ def FilterHarmonics(hkl):
         return hkl
     elif np.array(hkl).shape == (3,):
         return np.array([hkl])
-    # square array with element[i,j] = cross(HKLs[i],HKLs[j])
-    a = GT.find_parallel_hkl(hkl)
-    SA = a.shape
-    fa = np.reshape(a, (SA[0] * SA[1], 3))
-    ind_in_flat_a = GT.indices_in_flatTriuMatrix(SA[0])
-    # 1D array 3d vectors (inter cross products)
-    crosspair = np.take(fa, ind_in_flat_a, axis=0)
-
-    # print "crosspair",crosspair
-
-    # index of zero 3D vectors
-    pos_zeros = np.where(np.all(crosspair == 0, axis=1) == True)[0]
-
-    # print "pos_zeros",pos_zeros
-
-    if len(pos_zeros) > 0:
-        # print('ind_in_flat_a[pos_zeros]',ind_in_flat_a[pos_zeros])
-        hkls_pairs_index = GT.indices_in_TriuMatrix(ind_in_flat_a[pos_zeros], SA[0])
-        # hkls_pairs = np.take(hkl, hkls_pairs_index, axis=0)
 
-        # print "hkls_pairs_index",hkls_pairs_index
-        # print "hkls_pairs",hkls_pairs
-        # create dict of equivalent hkls (same direction), same irreductible representation
+    hkl = np.array(hkl)
+    tokeep, _ = CP.getHarmonicsIndices(hkl, merge_antiparallel=True)
 
-        #dictsets, intermediary_dict = GT.Set_dict_frompairs(hkls_pairs_index, verbose=0)
-        dictsets, _ = GT.Set_dict_frompairs(hkls_pairs_index, verbose=0)
-
-        # print "dictsets, intermediary_dict",dictsets, intermediary_dict
-
-        toremove = []
-        for _, val in list(dictsets.items()):
-            toremove += sorted(val)[1:]
-        toremove.sort()
-
-        return np.delete(hkl, toremove, axis=0)
-    else:
-        return hkl
+    return np.take(hkl, tokeep, axis=0)
 
 
 def HKL2string(hkl):
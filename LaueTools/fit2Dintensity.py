@@ -35,6 +35,11 @@ except ImportError:
     print("Cython compiled module 'gaussian2D' for fast computation is not installed!")
     USE_CYTHON = False
 
+# max. nb of pixels (nb of ROIs x ROI size) fitted together in gaussfit_batch()
+BATCHFIT_MAXPIXELS = 2 ** 20
+# leastsq default relative tolerance on sum of squares
+BATCHFIT_FTOL = 1.49012e-08
+
 
 def stringint(k, n):
     """ returns string of k by placing zeros before to have n characters
@@ -482,6 +487,200 @@ def gaussfit_2peaks(
         return p, cov, infodict, errmsg
 
 
+def twodgaussian_batch(params, ijindices):
+    """Returns 2d gaussians (see twodgaussian() with circle=0, rotate=1, vheight=1)
+    and their analytic derivatives with respect to parameters for a batch of parameters
+
+    params: array (n, 7) of (height, amplitude, center_x, center_y, width_x, width_y, rota)
+    ijindices: array (2, h, w) of pixel indices (x, y) as given by np.indices()
+
+    returns model array (n, h, w) and jacobian array (n, h, w, 7)
+    """
+    height, amplitude, center_x, center_y, width_x, width_y, rota = [
+                                                    param[:, None, None] for param in params.T]
+    rota = np.pi / 180.0 * rota
+    cosa, sina = np.cos(rota), np.sin(rota)
+    dx = ijindices[0] - center_x
+    dy = ijindices[1] - center_y
+    u = dx * cosa - dy * sina
+    v = dx * sina + dy * cosa
+    invwx2 = 1.0 / width_x ** 2
+    invwy2 = 1.0 / width_y ** 2
+
+    expo = np.exp(-(u ** 2 * invwx2 + v ** 2 * invwy2) / 2.0)
+    g = amplitude * expo
+
+    jac = np.empty(expo.shape + (7,))
+    jac[..., 0] = 1.0
+    jac[..., 1] = expo
+    jac[..., 2] = g * (u * cosa * invwx2 + v * sina * invwy2)
+    jac[..., 3] = g * (v * cosa * invwy2 - u * sina * invwx2)
+    jac[..., 4] = g * u ** 2 * invwx2 / width_x
+    jac[..., 5] = g * v ** 2 * invwy2 / width_y
+    jac[..., 6] = g * u * v * (invwx2 - invwy2) * np.pi / 180.0
+
+    return height + g, jac
+
+
+def leastsq_batch(modelfunc, data, params, weights=None, xtol=0.0000001, ftol=BATCHFIT_FTOL,
+                                                                                maxfev=None):
+    """
+    Levenberg-Marquardt least squares fit of the same model on a batch of 2D arrays
+
+    Each array has its own parameters, damping factor and convergence flag, so that converged
+    fits are no longer computed while the others go on.
+
+    modelfunc: function(params (n, p), ijindices (2, h, w)) returning
+               model (n, h, w) and analytic jacobian (n, h, w, p) (see twodgaussian_batch())
+    data: array (n, h, w)
+    params: array (n, p) of starting parameters
+    weights: None or array (n, h, w) of pixel weights (0 to exclude a pixel)
+    xtol, ftol: relative tolerances on parameters and on sum of squares (as in optimize.leastsq)
+    maxfev: maximum nb of function calls per fit, counted as in optimize.leastsq with
+            finite difference jacobian (p calls per jacobian). Default 200 * (p + 1)
+
+    returns params (n, p), cov (list of n (p, p) arrays or None), infodict (list of n dict
+    with 'nfev' and 'fvec' keys), errmsg (list of n strings)
+    """
+    data = np.asarray(data, dtype=float)
+    params = np.array(params, dtype=float)
+    nbfits, nbparams = params.shape
+    if maxfev is None:
+        maxfev = 200 * (nbparams + 1)
+    if weights is None:
+        weights = np.ones(data.shape)
+    ijindices = np.indices(data.shape[1:])
+    nbpixels = data[0].size
+
+    def residuals_and_jacobian(indices, par):
+        model, jac = modelfunc(par, ijindices)
+        w = weights[indices]
+        res = ((model - data[indices]) * w).reshape((len(indices), nbpixels))
+        jac = (jac * w[..., None]).reshape((len(indices), nbpixels, nbparams))
+        return res, jac
+
+    def normal_equations(res, jac):
+        return np.einsum("nki,nkj->nij", jac, jac), np.einsum("nki,nk->ni", jac, res)
+
+    res, jac = residuals_and_jacobian(np.arange(nbfits), params)
+    cost = np.sum(res ** 2, axis=1)
+    JtJ, Jtr = normal_equations(res, jac)
+    fvec = res
+    nfev = np.full(nbfits, 1 + nbparams)
+    damping = np.full(nbfits, 0.001)
+    errmsg = ["Number of calls to function has reached maxfev = %d." % maxfev] * nbfits
+
+    active = cost > 0
+    for k in np.where(~active)[0]:
+        errmsg[k] = "The sum of squares is zero"
+
+    while np.any(active):
+        act = np.where(active)[0]
+        diagJtJ = np.diagonal(JtJ[act], axis1=1, axis2=2)
+        # floor on diagonal scaling to keep the damped matrix positive definite
+        scale = np.maximum(diagJtJ, 1e-12 * np.amax(diagJtJ, axis=1)[:, None] + 1e-300)
+        damped = JtJ[act] + damping[act, None, None] * np.eye(nbparams) * scale[:, None, :]
+        step = -np.linalg.solve(damped, Jtr[act][..., None])[..., 0]
+
+        trialparams = params[act] + step
+        trialres, trialjac = residuals_and_jacobian(act, trialparams)
+        trialcost = np.sum(trialres ** 2, axis=1)
+        nfev[act] += 1
+
+        better = trialcost < cost[act]
+        acc = act[better]
+        rej = act[~better]
+
+        # accepted steps: new parameters, jacobian and less damping
+        if len(acc):
+            reduction = (cost[acc] - trialcost[better]) / cost[acc]
+            stepnorm = np.sqrt(np.sum(scale[better] * step[better] ** 2, axis=1))
+            parnorm = np.sqrt(np.sum(scale[better] * trialparams[better] ** 2, axis=1))
+
+            params[acc] = trialparams[better]
+            cost[acc] = trialcost[better]
+            fvec[acc] = trialres[better]
+            JtJ[acc], Jtr[acc] = normal_equations(trialres[better], trialjac[better])
+            nfev[acc] += nbparams
+            damping[acc] = np.maximum(damping[acc] * 0.1, 1e-15)
+
+            conv_x = stepnorm <= xtol * parnorm
+            conv_f = (reduction <= ftol) | (trialcost[better] == 0)
+            for k, cx, cf in zip(acc, conv_x, conv_f):
+                if cx or cf:
+                    active[k] = False
+                    errmsg[k] = ("The relative error between two consecutive iterates is at most %f"
+                                % xtol if cx else
+                                "The relative reduction in the sum of squares is at most %f" % ftol)
+
+        # rejected steps: more damping, a fit that cannot be improved any more is converged
+        if len(rej):
+            damping[rej] *= 10.0
+            stuck = rej[damping[rej] > 1e16]
+            active[stuck] = False
+            for k in stuck:
+                errmsg[k] = "The cost function cannot be reduced any more (tolerances too small)"
+
+        exhausted = active & (nfev + nbparams >= maxfev)
+        active[exhausted] = False
+
+    cov = []
+    for k in list(range(nbfits)):
+        try:
+            cov.append(np.linalg.inv(JtJ[k]))
+        except np.linalg.LinAlgError:
+            cov.append(None)
+
+    infodict = [{"nfev": int(nfev[k]), "fvec": fvec[k]} for k in list(range(nbfits))]
+
+    return params, cov, infodict, errmsg
+
+
+def gaussfit_batch(data, params, xtol=0.0000001, Acceptable_HighestValue=False,
+                                                Acceptable_LowestValue=False,
+                                                modelfunc=twodgaussian_batch):
+    """
+    Gaussian fitter of a batch of 2d arrays of the same shape (rotated elliptical gaussian
+    with variable height, see gaussfit() with circle=0, rotate=1, vheight=1)
+
+    Jacobian is analytic and all fits are performed together (see leastsq_batch()) by chunks of
+    BATCHFIT_MAXPIXELS pixels.
+
+    data: array (n, h, w) or list of n arrays (h, w)
+    params: array (n, 7) of initial parameters (height, amplitude, x, y, width_x, width_y, rota)
+    Acceptable_HighestValue: if not False, pixel intensity level above which the pixel has a zero weight
+    Acceptable_LowestValue: if not False, pixel intensity level below which the pixel has a zero weight
+    modelfunc: batch model function with analytic jacobian (twodgaussian_batch() by default)
+
+    Output:
+        params (n, 7), cov, infodict, errmsg, as output of gaussfit(return_all=1) for each array
+    """
+    data = np.asarray(data, dtype=float)
+    params = np.array(params, dtype=float)
+    nbfits = len(data)
+
+    weights = np.ones(data.shape)
+    if Acceptable_HighestValue is not False:
+        weights[data >= Acceptable_HighestValue] = 0
+    if Acceptable_LowestValue is not False:
+        weights[data <= Acceptable_LowestValue] = 0
+
+    chunksize = max(1, BATCHFIT_MAXPIXELS // max(1, data[0].size))
+    res_params = np.zeros_like(params)
+    res_cov, res_infodict, res_errmsg = [], [], []
+    for start in list(range(0, nbfits, chunksize)):
+        chunk = slice(start, start + chunksize)
+        par, cov, infodict, errmsg = leastsq_batch(modelfunc, data[chunk], params[chunk],
+                                                    weights=weights[chunk],
+                                                    xtol=xtol)
+        res_params[chunk] = par
+        res_cov += cov
+        res_infodict += infodict
+        res_errmsg += errmsg
+
+    return res_params, res_cov, res_infodict, res_errmsg
+
+
 def create2Dgaussiandata():
     # Create the gaussian data
     Xin, Yin = np.mgrid[0:201, 0:201]
@@ -171,6 +171,42 @@ def twodlorentzian(inpars, circle, rotate, vheight):
     return rotlorentz
 
 
+def twodlorentzian_batch(params, ijindices):
+    """Returns 2d lorentzians (see twodlorentzian() with circle=0, rotate=1, vheight=1)
+    and their analytic derivatives with respect to parameters for a batch of parameters
+
+    params: array (n, 7) of (height, amplitude, center_x, center_y, width_x, width_y, rota)
+    ijindices: array (2, h, w) of pixel indices (x, y) as given by indices()
+
+    returns model array (n, h, w) and jacobian array (n, h, w, 7)
+    (to be used with fit2Dintensity.gaussfit_batch(modelfunc=twodlorentzian_batch))
+    """
+    height, amplitude, center_x, center_y, width_x, width_y, rota = [
+                                                    param[:, None, None] for param in params.T]
+    rota = pi / 180.0 * rota
+    cosa, sina = cos(rota), sin(rota)
+    dx = ijindices[0] - center_x
+    dy = ijindices[1] - center_y
+    u = dx * cosa - dy * sina
+    v = dx * sina + dy * cosa
+    fu = 1.0 / (width_x * (1.0 + 4 * u ** 2 / width_x))
+    fv = 1.0 / (width_y * (1.0 + 4 * v ** 2 / width_y))
+
+    lorentz = 1.0 / ((1.0 + 4 * u ** 2 / width_x) * (1.0 + 4 * v ** 2 / width_y))
+    g = amplitude * lorentz
+
+    jac = empty(lorentz.shape + (7,))
+    jac[..., 0] = 1.0
+    jac[..., 1] = lorentz
+    jac[..., 2] = 8 * g * (u * cosa * fu + v * sina * fv)
+    jac[..., 3] = 8 * g * (v * cosa * fv - u * sina * fu)
+    jac[..., 4] = 4 * g * u ** 2 * fu / width_x
+    jac[..., 5] = 4 * g * v ** 2 * fv / width_y
+    jac[..., 6] = 8 * g * u * v * (fu - fv) * pi / 180.0
+
+    return height + g, jac
+
+
 def lorentzfit(
     data,
     err=None,
@@ -13,7 +13,6 @@ import multiprocessing
 import sys
 
 import numpy as np
-import scipy.spatial.distance as ssd
 import matplotlib as mpl
 
 if mpl.__version__ < "2.2":
@@ -29,8 +28,10 @@ IDENTITYMATRIX = np.eye(3)
 
 if sys.version_info.major == 3:
     from . import IOLaueTools as IOLT
+    from . import spatialindex as SI
 else:
     import IOLaueTools as IOLT
+    import spatialindex as SI
 
 try:
     # from numba import double
@@ -1105,55 +1106,18 @@ def removeClosePoints_two_sets(XY1, XY2, dist_tolerance=0.5, verbose=0):
 
     XY1 : array([[x1,x2,...],[y1,y2,...]])
     XY2 : array([[x1,x2,...],[y1,y2,...]])
+
+    return X, Y of kept spots of XY1 and their (sorted) indices in XY1
     """
     X, Y = np.array(XY1)
 
-    coord_1 = np.array(XY1).T
-    coord_2 = np.array(XY2).T
-
-    nb_pts1 = len(coord_1)
-
-    coord12 = np.vstack((coord_1, coord_2))
-
-    #    print "coord_1", coord_1
-    #    print "coord_2", coord_2
-
-    # print("coord12", coord12)
-
-    tabdist = ssd.squareform(ssd.pdist(coord12, metric="euclidean"))
+    coord_1 = np.array([X, Y]).T
+    coord_2 = SI.asPoints(np.array(XY2).T)
 
-    close_pos1 = np.where(tabdist < dist_tolerance)
-
-    i1, j1 = close_pos1
-
-    ionly = i1[np.logical_and(i1 != j1, i1 < nb_pts1)]
-
-    toremove = ionly
-
-    #     nb_of_spots_set1 = len(X)
-
-    #     angular_tab = calculdist_from_thetachi(coord_1, coord_2)
-    #
-    #     # angular_tab.shape = (len(coord_2),len(coord_1))
-    # #    print "angular_tab.shape", angular_tab.shape
-    #
-    #     close_pos = np.where(angular_tab < dist_tolerance)
-    #
-    #     i, j = close_pos
-    #
-    # #    print "len(i)", len(i)
-    # #    print "len(j)", len(j)
-    # #    # len(i) = len(coord_2)
-    # #    print "close_pos", close_pos
-    # #    print "i", i
-    # #    print "j", j
-    #
-    #     toremove = j
+    tokeep = SI.setDifference(coord_1, coord_2, dist_tolerance)
 
     if verbose:
-        print("nb of spots to remove", len(toremove))
-
-    tokeep = list(set(list(range(nb_pts1))) - set(toremove))
+        print("nb of spots to remove", len(X) - len(tokeep))
 
     return X[tokeep], Y[tokeep], tokeep
 
@@ -1165,8 +1129,8 @@ def mergelistofPoints(XY1, XY2, dist_tolerance=0.5, verbose=0):
     keeping one spot from XY1 when two spots from XY1 and XY2 are closer than dist_tolerance
     keeping the first spot (in the list) from XY1 when two spots from XY1 are closer than dist_tolerance
 
-    XY1 : array([[x1,x2,...],[y1,y2,...]])
-    XY2 : array([[x1,x2,...],[y1,y2,...]])
+    XY1 : array([[x1,y1],[x2,y2],...])
+    XY2 : array([[x1,y1],[x2,y2],...])
 
     return merged list XY, list spot index of XY1 to delete, list spot index of XY2 to delete
     """
@@ -1177,12 +1141,11 @@ def mergelistofPoints(XY1, XY2, dist_tolerance=0.5, verbose=0):
     n2 = len(XY2)
     # then purged from duplicates with localisation of them
     purged_c12, index_todelete_in_c12 = purgeClosePoints2(c12, dist_tolerance, verbose=verbose)
-    print("c12", c12)
-    print("purged_c12", purged_c12)
-    print("index_todelete_in_c12", index_todelete_in_c12)
-    print("n1 %d,n2 %d" % (n1, n2))
-    print(index_todelete_in_c12 < n1)
-    print(index_todelete_in_c12 >= n1)
+    index_todelete_in_c12 = np.array(index_todelete_in_c12, dtype=int)
+
+    if verbose:
+        print("n1 %d,n2 %d" % (n1, n2))
+        print("index_todelete_in_c12", index_todelete_in_c12)
 
     index_todelete_in_1 = index_todelete_in_c12[index_todelete_in_c12 < n1]
     index_todelete_in_2 = index_todelete_in_c12[index_todelete_in_c12 >= n1] - n1
@@ -1190,70 +1153,70 @@ def mergelistofPoints(XY1, XY2, dist_tolerance=0.5, verbose=0):
     return purged_c12, index_todelete_in_1, index_todelete_in_2
 
 
-def removeClosePoints_2(Twicetheta, Chi, dist_tolerance=0.5):
+def thetachi_to_unitvectors(Theta, Chi):
+    """
+    return array (n, 3) of unit vectors on the sphere whose mutual angles are the angular
+    distances computed by calculdist_from_thetachi() (Theta as latitude, Chi as longitude)
+    """
+    lat = np.array(Theta, dtype=float) * DEG
+    longit = np.array(Chi, dtype=float) * DEG
+
+    return np.array([np.cos(lat) * np.cos(longit),
+                    np.cos(lat) * np.sin(longit),
+                    np.sin(lat)]).T
+
+
+def removeClosePoints_2(Twicetheta, Chi, dist_tolerance=0.5, chained=True):
     """
     remove very close spots within dist_tolerance
 
     dist_tolerance (in deg) is a crude criterium since angular distance are computed
-    as if 2theta,chi coordinates were cartesian ones !
+    as if 2theta,chi coordinates were (theta, chi) ones (see calculdist_from_thetachi())!
 
     NOTE: this can be used for harmonics removal (harmonics enhance too much some sinusoids and
     leads to artefact when searching zone axes by gnomonic-hough transform
     and digital image processing methods)
 
-    TODO: to generalise to cartesian distance
+    chained: True, spots linked by a chain of close spots (each closer than dist_tolerance
+            to the next one) form a set, and only the first spot of each set is kept
+            (see spatialindex.firstOfClusters()). A removed spot may then be farther than
+            dist_tolerance from every kept spot.
+            False, spots are kept in list order unless they are closer than dist_tolerance
+            to an already kept spot (see spatialindex.suppressClosePoints())
 
+    Angular distance below dist_tolerance is converted in chord distance between unit vectors
+    to use spatial index (KD-tree).
     """
-    coord = np.array([Twicetheta, Chi]).T
-    angular_tab = calculdist_from_thetachi(coord, coord)
-
-    close_pos = np.where(angular_tab < dist_tolerance)
-
-    i, j = close_pos
-
-    #    print "close_pos", close_pos
-    #    print "i", i
-    #    print "j", j
+    unitvectors = thetachi_to_unitvectors(Twicetheta, Chi)
+    chord_tolerance = 2.0 * np.sin(min(dist_tolerance, 180.0) * DEG / 2.0)
 
-    dict_sets = Set_dict_frompairs(np.array([i, j]).T, verbose=0)[0]
-
-    #    print "dict_sets", dict_sets
-
-    toremove = []
-    for val in list(dict_sets.values()):
-        if len(val) > 1:
-            toremove += val[1:]
-
-    tokeep = list(set(list(range(len(Twicetheta)))) - set(toremove))
+    if chained:
+        tokeep = SI.firstOfClusters(unitvectors, chord_tolerance)
+    else:
+        tokeep = SI.suppressClosePoints(unitvectors, chord_tolerance)
 
     return Twicetheta[tokeep], Chi[tokeep], tokeep
 
 
-def removeClosePoints(X, Y, dist_tolerance=0.5):
+def removeClosePoints(X, Y, dist_tolerance=0.5, chained=True):
     r"""
     remove very close spots within dist_tolerance (cartesian distance)
-    """
-    coord = np.array([X, Y]).T
-    dist_tab = calcdistancetab(coord, coord)
-
-    close_pos = np.where(dist_tab < dist_tolerance)
 
-    i, j = close_pos
+    chained: True, spots linked by a chain of close spots (each closer than dist_tolerance
+            to the next one) form a set, and only the first spot of each set is kept
+            (see spatialindex.firstOfClusters()). A removed spot may then be farther than
+            dist_tolerance from every kept spot.
+            False, spots are kept in list order unless they are closer than dist_tolerance
+            to an already kept spot (see spatialindex.suppressClosePoints())
 
-    #    print "close_pos", close_pos
-    #    print "i", i
-    #    print "j", j
-
-    dict_sets = Set_dict_frompairs(np.array([i, j]).T, verbose=0)[0]
-
-    #    print "dict_sets", dict_sets
-
-    toremove = []
-    for val in list(dict_sets.values()):
-        if len(val) > 1:
-            toremove += val[1:]
+    return X, Y of kept spots and their (sorted) indices
+    """
+    coord = np.array([X, Y], dtype=float).T
 
-    tokeep = list(set(list(range(len(X)))) - set(toremove))
+    if chained:
+        tokeep = SI.firstOfClusters(coord, dist_tolerance)
+    else:
+        tokeep = SI.suppressClosePoints(coord, dist_tolerance)
 
     return X[tokeep], Y[tokeep], tokeep
 
@@ -1271,6 +1234,10 @@ def purgeClosePoints(peaklist, dist_tolerance=0.5):
 def purgeClosePoints2(peaklist, pixeldistance_remove_duplicates, verbose=0):
     """
     return peaks list without peaks closer than pixeldistance (pixeldistance_remove_duplicates)
+
+    for each pair of close peaks, the peak with the largest index in peaklist is removed
+
+    return purged peaks list, (sorted) indices of removed peaks
     """
 
     if np.shape(peaklist)[0] < 2:
@@ -1279,29 +1246,9 @@ def purgeClosePoints2(peaklist, pixeldistance_remove_duplicates, verbose=0):
 
     pixeldistance = pixeldistance_remove_duplicates
 
-    disttable = ssd.pdist(peaklist, "euclidean")
-
-    maxdistance = np.amax(disttable)
-    sqdistmatrix = ssd.squareform(disttable)
-    # we add on diagonal a large number to avoid the zero (=self interdistance!)
-    # that is annoying when finding minimum
-    distmatrix = sqdistmatrix + np.eye(sqdistmatrix.shape[0]) * maxdistance
-
-    si, fi = np.where(distmatrix < pixeldistance)
-
-    index_to_delete = np.where(fi > si, fi, si)
-
-    # there could be several spots close to one.
-    # so remove duplicates in index_todelete !
-    itd = set(index_to_delete.tolist())
-    index_todelete = np.array(list(itd))
+    index_todelete = SI.duplicatesIndices(peaklist, pixeldistance)
 
     if verbose:
-        print("disttable", disttable)
-        print("maxdistance", maxdistance)
-        print("sqdistmatrix", sqdistmatrix)
-        print("distmatrix", distmatrix)
-        print("index si, fi where distmatrix < pixeldistance", si, fi)
         print("index_todelete", index_todelete)
 
     purged_pklist = np.delete(peaklist, index_todelete, axis=0)  # np.delete
@@ -0,0 +1,358 @@
+r"""
+headerindex module builds and queries an on-disk index (sqlite file) of image files metadata
+(frame dimensions, exposure time, monitor, sample motors positions and acquisition time,
+with the origin of this time: image header or file modification time)
+
+Headers of a whole series of images are parsed once (in parallel threads) and stored
+in a small database file located by default in the images folder.
+Each entry is keyed by the absolute file path and is valid as long as the file
+modification time and size are unchanged: updating the index of a growing (or partially
+rewritten) series only parses new or modified files.
+
+Typical use (e.g. to get sample positions of a map):
+
+>>> hidx = index_imagesfolder("/data/mymap", CCDLabel="MARCCD165")
+>>> xyz = hidx.getmotorspositions(filenames)
+>>> mapgeometry = getmapgeometry(xyz)
+
+More tools can be found in LaueTools package at sourceforge.net and gitlab.esrf.fr
+"""
+import sys
+import os
+import time
+import struct
+import sqlite3
+import concurrent.futures
+
+import numpy as np
+
+if sys.version_info.major == 3:
+    from . import dict_LaueTools as DictLT
+    from . import readmccd as RMCCD
+else:
+    import dict_LaueTools as DictLT
+    import readmccd as RMCCD
+
+# default name of index file written in images folder
+HEADERINDEX_FILENAME = ".lauetools_headerindex.sqlite"
+# nb of threads parsing headers
+HEADERINDEX_NBTHREADS = 8
+# version of the table layout (index is rebuilt if it differs)
+HEADERINDEX_VERSION = 2
+
+# MarCCD frame header (starting at byte 1024 after tiff header)
+MARCCD_FRAMEDIM_OFFSET = 1024 + 80
+# file parameters section starts at 2048: filetitle(128), filepath(128), filename(64),
+# acquire_timestamp(32) (see read_header_marccd)
+MARCCD_ACQUIRETIMESTAMP_OFFSET = 2048 + 320
+MARCCD_TIMESTAMP_FORMAT = "%m%d%H%M%Y.%S"
+
+# origin of acquisition time (timestampsource field)
+TIMESTAMP_FROM_HEADER = "header"
+TIMESTAMP_FROM_MTIME = "mtime"
+
+# metadata fields stored in index: (name, sqlite type)
+HEADERINDEX_FIELDS = [("path", "TEXT PRIMARY KEY"),
+                        ("mtime", "REAL"),
+                        ("filesize", "INTEGER"),
+                        ("ccdlabel", "TEXT"),
+                        ("framedim_0", "INTEGER"),
+                        ("framedim_1", "INTEGER"),
+                        ("exposure", "REAL"),
+                        ("monitor", "REAL"),
+                        ("xech", "REAL"),
+                        ("yech", "REAL"),
+                        ("zech", "REAL"),
+                        ("timestamp", "REAL"),
+                        ("timestampsource", "TEXT"),
+                        ("comments", "TEXT")]
+FIELDNAMES = [name for name, _ in HEADERINDEX_FIELDS]
+
+
+def read_marccd_timestamp(filename):
+    r"""
+    return acquisition time (in seconds since epoch) written in marccd header or None
+    """
+    with open(filename, "rb") as f:
+        f.seek(MARCCD_ACQUIRETIMESTAMP_OFFSET)
+        strtime = f.read(32).split(b"\x00")[0].decode("latin-1").strip()
+    if not strtime:
+        return None
+    try:
+        return time.mktime(time.strptime(strtime[:15], MARCCD_TIMESTAMP_FORMAT))
+    except ValueError:
+        return None
+
+
+def read_marccd_framedim(filename):
+    r"""
+    return (nslow, nfast) frame dimensions written in marccd header or None
+    """
+    with open(filename, "rb") as f:
+        f.seek(MARCCD_FRAMEDIM_OFFSET)
+        nfast, nslow = struct.unpack("I I", f.read(8))
+    if nfast == 0 or nslow == 0 or nfast > 2 ** 16 or nslow > 2 ** 16:
+        return None
+    return nslow, nfast
+
+
+def read_imagemetadata(filename, CCDLabel="MARCCD165", filestat=None, verbose=0):
+    r"""
+    read metadata of one image file
+
+    Missing or unreadable header values are set to None (the reading error is printed
+    if verbose). Acquisition time (timestamp) defaults to the file modification time:
+    timestampsource is TIMESTAMP_FROM_HEADER or TIMESTAMP_FROM_MTIME.
+
+    :param filename: full path to image file
+    :param CCDLabel: key of dict_CCD
+    :param filestat: result of os.stat(filename) (read if None)
+    :param verbose: 1 to print header reading errors
+
+    :return: dict with keys FIELDNAMES. exposure is in milliseconds
+    """
+    if filestat is None:
+        filestat = os.stat(filename)
+
+    framedim = DictLT.dict_CCD[CCDLabel][0]
+    metadata = dict.fromkeys(FIELDNAMES)
+    metadata.update({"path": os.path.abspath(filename),
+                    "mtime": filestat.st_mtime,
+                    "filesize": filestat.st_size,
+                    "ccdlabel": CCDLabel,
+                    "framedim_0": framedim[0],
+                    "framedim_1": framedim[1],
+                    "timestamp": filestat.st_mtime,
+                    "timestampsource": TIMESTAMP_FROM_MTIME,
+                    "comments": ""})
+
+    try:
+        if CCDLabel.startswith("MARCCD"):
+            comments, expo_time = RMCCD.read_header_marccd2(filename)
+            metadata["comments"] = comments
+            metadata["exposure"] = expo_time
+            # from beamline designed input: xech yech zech monitor ...
+            values = comments.split()
+            for key, strval in zip(("xech", "yech", "zech", "monitor"), values):
+                metadata[key] = float(strval)
+
+            headerframedim = read_marccd_framedim(filename)
+            if headerframedim is not None:
+                metadata["framedim_0"], metadata["framedim_1"] = headerframedim
+            timestamp = read_marccd_timestamp(filename)
+            if timestamp is not None:
+                metadata["timestamp"] = timestamp
+                metadata["timestampsource"] = TIMESTAMP_FROM_HEADER
+
+        elif CCDLabel in ("sCMOS", "sCMOS_fliplr"):
+            dictpar = RMCCD.read_header_scmos(filename)
+            if "exposure" in dictpar:
+                metadata["exposure"] = dictpar["exposure"] * 1000.
+            if "mon" in dictpar:
+                metadata["monitor"] = dictpar["mon"]
+            xyz = RMCCD.read_motorsposition_fromheader(filename, CCDLabel=CCDLabel)[0]
+            metadata["xech"], metadata["yech"], metadata["zech"] = xyz
+    except (ValueError, KeyError, IndexError, TypeError, struct.error, OSError) as err:
+        # partially filled header
+        if verbose:
+            print("incomplete header of %s (CCDLabel %s): %s: %s"
+                    % (filename, CCDLabel, type(err).__name__, err))
+
+    return metadata
+
+
+class HeaderIndex(object):
+    r"""
+    sqlite index of images metadata (see read_imagemetadata)
+
+    :param indexfile: path to index file (created if it does not exist)
+    """
+    def __init__(self, indexfile):
+        self.indexfile = indexfile
+        self.connection = sqlite3.connect(indexfile)
+        self._create_table()
+
+    def _create_table(self):
+        cursor = self.connection.cursor()
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version != HEADERINDEX_VERSION:
+            cursor.execute("DROP TABLE IF EXISTS headers")
+            cursor.execute("PRAGMA user_version = %d" % HEADERINDEX_VERSION)
+        cursor.execute("CREATE TABLE IF NOT EXISTS headers (%s)"
+                        % ", ".join("%s %s" % field for field in HEADERINDEX_FIELDS))
+        self.connection.commit()
+
+    def update(self, filenames, CCDLabel="MARCCD165", nbthreads=HEADERINDEX_NBTHREADS, verbose=0):
+        r"""
+        parse headers of new or modified files and store their metadata
+
+        :param filenames: list of full paths to image files
+        :param CCDLabel: key of dict_CCD
+        :param nbthreads: nb of threads reading headers (1 for sequential reading)
+
+        :return: nb of parsed files
+        """
+        stored = {path: (mtime, filesize) for path, mtime, filesize in
+                    self.connection.execute("SELECT path, mtime, filesize FROM headers")}
+
+        toparse = []
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            filestat = os.stat(path)
+            if stored.get(path) != (filestat.st_mtime, filestat.st_size):
+                toparse.append((path, filestat))
+
+        if not toparse:
+            return 0
+
+        if nbthreads > 1 and len(toparse) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=nbthreads) as executor:
+                allmetadata = list(executor.map(lambda args: read_imagemetadata(args[0], CCDLabel,
+                                                                                    args[1],
+                                                                                    verbose),
+                                                toparse))
+        else:
+            allmetadata = [read_imagemetadata(path, CCDLabel, filestat, verbose)
+                            for path, filestat in toparse]
+
+        self.connection.executemany("INSERT OR REPLACE INTO headers VALUES (%s)"
+                                    % ", ".join(["?"] * len(FIELDNAMES)),
+                                    [[metadata[key] for key in FIELDNAMES]
+                                        for metadata in allmetadata])
+        self.connection.commit()
+
+        if verbose:
+            print("%d image headers parsed and stored in %s" % (len(toparse), self.indexfile))
+
+        return len(toparse)
+
+    def get(self, filename):
+        r"""
+        return metadata dict of filename or None if it is not indexed
+        """
+        row = self.connection.execute("SELECT * FROM headers WHERE path = ?",
+                                        (os.path.abspath(filename),)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(FIELDNAMES, row))
+
+    def getmany(self, filenames):
+        r"""
+        return list of metadata dicts of filenames (None for not indexed files)
+        """
+        paths = [os.path.abspath(filename) for filename in filenames]
+        allmetadata = {}
+        # sqlite limits the nb of parameters of a query
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            query = "SELECT * FROM headers WHERE path IN (%s)" % ", ".join(["?"] * len(chunk))
+            for row in self.connection.execute(query, chunk):
+                allmetadata[row[0]] = dict(zip(FIELDNAMES, row))
+        return [allmetadata.get(path) for path in paths]
+
+    def getvalues(self, filenames, keys):
+        r"""
+        return array of metadata values (nb files, nb keys). Missing values are set to nan
+        """
+        values = np.full((len(filenames), len(keys)), np.nan)
+        for k, metadata in enumerate(self.getmany(filenames)):
+            if metadata is None:
+                continue
+            for j, key in enumerate(keys):
+                if metadata[key] is not None:
+                    values[k, j] = metadata[key]
+        return values
+
+    def getmotorspositions(self, filenames):
+        r"""
+        return array of sample motors positions (xech, yech, zech) of filenames, shape (n, 3)
+        """
+        return self.getvalues(filenames, ("xech", "yech", "zech"))
+
+    def remove(self, filenames):
+        r"""
+        remove filenames entries from index
+        """
+        self.connection.executemany("DELETE FROM headers WHERE path = ?",
+                                    [(os.path.abspath(filename),) for filename in filenames])
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM headers").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def index_imagesfolder(dirname, filenames=None, CCDLabel="MARCCD165", indexfile=None,
+                                                        nbthreads=HEADERINDEX_NBTHREADS,
+                                                        verbose=0):
+    r"""
+    build or update index of image files headers of a folder
+
+    :param dirname: folder of images
+    :param filenames: list of image filenames (relative to dirname). If None, all files
+        of dirname with the extension of CCDLabel in dict_CCD
+    :param CCDLabel: key of dict_CCD
+    :param indexfile: path to index file (default: dirname/HEADERINDEX_FILENAME)
+
+    :return: HeaderIndex object (to be closed by user)
+    """
+    if filenames is None:
+        extension = "." + DictLT.dict_CCD[CCDLabel][7]
+        filenames = sorted(name for name in os.listdir(dirname) if name.endswith(extension))
+    if indexfile is None:
+        indexfile = os.path.join(dirname, HEADERINDEX_FILENAME)
+
+    headerindex = HeaderIndex(indexfile)
+    headerindex.update([os.path.join(dirname, name) for name in filenames],
+                        CCDLabel=CCDLabel,
+                        nbthreads=nbthreads,
+                        verbose=verbose)
+    return headerindex
+
+
+def getmapgeometry(positions, tolerance=1e-4):
+    r"""
+    guess raster scan geometry from motors positions of successive images
+
+    :param positions: array of motors positions (nb images, nb motors) in acquisition order
+    :param tolerance: minimum motor displacement considered as a step
+
+    :return: dict with keys: 'fastaxis', 'slowaxis' (motor indices or None),
+        'nbfast' (nb of images per line), 'nbslow' (nb of lines),
+        'faststep', 'slowstep' (median step of motors)
+    """
+    positions = np.asarray(positions, dtype=float)
+    nbimages = len(positions)
+    moves = np.abs(np.diff(positions, axis=0)) > tolerance
+
+    geometry = {"fastaxis": None, "slowaxis": None, "nbfast": nbimages, "nbslow": 1,
+                "faststep": 0.0, "slowstep": 0.0}
+    movingaxes = np.where(np.any(moves, axis=0))[0]
+    if len(movingaxes) == 0:
+        return geometry
+
+    # fast motor moves first, slow motor moves at the end of the first line
+    firstmoves = np.array([np.argmax(moves[:, axis]) for axis in movingaxes])
+    fastaxis = movingaxes[np.argmin(firstmoves)]
+    geometry["fastaxis"] = int(fastaxis)
+    fastdiff = np.diff(positions[:, fastaxis])
+    geometry["faststep"] = float(np.median(fastdiff[np.abs(fastdiff) > tolerance]))
+
+    if len(movingaxes) > 1:
+        slowaxis = movingaxes[np.argsort(firstmoves)[1]]
+        nbfast = int(np.argmax(moves[:, slowaxis])) + 1
+        slowdiff = np.diff(positions[:, slowaxis])
+        geometry.update({"slowaxis": int(slowaxis),
+                        "nbfast": nbfast,
+                        "nbslow": int(np.ceil(nbimages / float(nbfast))),
+                        "slowstep": float(np.median(slowdiff[np.abs(slowdiff) > tolerance]))})
+
+    return geometry
@@ -0,0 +1,305 @@
+r"""
+imagesimulator module renders synthetic detector images from simulated Laue spots
+(anisotropic 2D gaussian spots + background + Poisson noise) in any detector frame geometry
+defined in dict_CCD
+
+Spots are accumulated sparsely (only pixels in the vicinity of spots are computed)
+tile by tile so that memory does not depend on the number of spots.
+
+More tools can be found in LaueTools package at sourceforge.net and gitlab.esrf.fr
+"""
+import sys
+
+import numpy as np
+
+if sys.version_info.major == 3:
+    from . import dict_LaueTools as DictLT
+    from . import lauecore as LAUE
+else:
+    import dict_LaueTools as DictLT
+    import lauecore as LAUE
+
+# size (in pixel) of square tiles used to accumulate spots intensity
+RENDER_TILESIZE = 512
+# max. nb of pixel values computed at once (nb of spots * spot window area)
+RENDER_MAXPIXELS = 2 ** 22
+# spots are truncated beyond RENDER_NSIGMA standard deviations
+RENDER_NSIGMA = 4.0
+
+
+def getframeparameters(CCDLabel):
+    r"""
+    return detector frame parameters from dict_CCD
+
+    :param CCDLabel: key of dict_CCD
+
+    :return: framedim (nb rows, nb columns), pixelsize (mm), saturation value, data format
+    """
+    framedim, pixelsize, saturation, _, _, formatdata = DictLT.dict_CCD[CCDLabel][:6]
+    return tuple(framedim), pixelsize, saturation, formatdata
+
+
+def _broadcast_spotsparameters(nbspots, *params):
+    return [np.broadcast_to(np.asarray(param, dtype=np.float64), (nbspots,)) for param in params]
+
+
+def splat_gaussianspots(image, posx, posy, amplitude, sigma_x=1.5, sigma_y=None, angle=0.0,
+                                                            position_definition=1,
+                                                            nsigma=RENDER_NSIGMA,
+                                                            tilesize=RENDER_TILESIZE,
+                                                            maxpixels=RENDER_MAXPIXELS):
+    r"""
+    add (in place) anisotropic 2D gaussian spots to image
+
+    I(x,y) = amplitude * exp(-(u**2 / (2 sigma_x**2) + v**2 / (2 sigma_y**2)))
+
+    with (u, v) coordinates of (x - posx, y - posy) in the frame of spot axes rotated by angle
+
+    :param image: 2D float array (nb rows, nb columns) to be incremented
+    :param posx: spots X pixel position (along columns)
+    :param posy: spots Y pixel position (along rows)
+    :param amplitude: spots peak intensity (scalar or array)
+    :param sigma_x: standard deviation (pixel) along spot first axis (scalar or array)
+    :param sigma_y: standard deviation (pixel) along spot second axis. None: equal to sigma_x
+    :param angle: angle (deg) between spot first axis and X axis (scalar or array)
+    :param position_definition: 1 for XMAS like offset (pixel [0,0] center is at X=1, Y=1)
+        as in readmccd.PeakSearch, 0 for no offset
+    :param nsigma: spots are truncated beyond nsigma standard deviations
+    :param tilesize: size of square tiles in which spots are accumulated
+    :param maxpixels: max. nb of pixel values computed at once
+
+    :return: image
+    """
+    posx = np.asarray(posx, dtype=np.float64).ravel()
+    posy = np.asarray(posy, dtype=np.float64).ravel()
+    nbspots = len(posx)
+    if nbspots == 0:
+        return image
+    if sigma_y is None:
+        sigma_y = sigma_x
+
+    amplitude, sigma_x, sigma_y, angle = _broadcast_spotsparameters(nbspots, amplitude,
+                                                                    sigma_x, sigma_y, angle)
+    if position_definition == 1:
+        col = posx - 1.0
+        row = posy - 1.0
+    else:
+        col = posx
+        row = posy
+
+    # half width of window containing each spot
+    halfwidth = np.ceil(nsigma * np.maximum(sigma_x, sigma_y)).astype(np.int64)
+
+    nbrows, nbcols = image.shape
+    # remove spots whose window does not touch the frame
+    inframe = ((col + halfwidth >= 0) & (col - halfwidth <= nbcols - 1)
+                & (row + halfwidth >= 0) & (row - halfwidth <= nbrows - 1)
+                & (amplitude != 0))
+    if not np.any(inframe):
+        return image
+
+    col, row, halfwidth = col[inframe], row[inframe], halfwidth[inframe]
+    amplitude, sigma_x, sigma_y = amplitude[inframe], sigma_x[inframe], sigma_y[inframe]
+    angrad = angle[inframe] * np.pi / 180.0
+    cosa, sina = np.cos(angrad), np.sin(angrad)
+
+    # nearest pixel of spots center
+    icol = np.round(col).astype(np.int64)
+    irow = np.round(row).astype(np.int64)
+    # spots are assigned to the tile containing their center pixel (clipped in frame)
+    tileindex = ((np.clip(irow, 0, nbrows - 1) // tilesize) * (nbcols // tilesize + 1)
+                + np.clip(icol, 0, nbcols - 1) // tilesize)
+    order = np.argsort(tileindex, kind="stable")
+    tilestarts = np.flatnonzero(np.r_[True, np.diff(tileindex[order]) != 0])
+    tileends = np.r_[tilestarts[1:], len(order)]
+
+    for start, end in zip(tilestarts, tileends):
+        spots = order[start:end]
+        maxhw = int(halfwidth[spots].max())
+        tilerow0 = max(int(irow[spots].min()) - maxhw, 0)
+        tilerow1 = min(int(irow[spots].max()) + maxhw + 1, nbrows)
+        tilecol0 = max(int(icol[spots].min()) - maxhw, 0)
+        tilecol1 = min(int(icol[spots].max()) + maxhw + 1, nbcols)
+        tileshape = (tilerow1 - tilerow0, tilecol1 - tilecol0)
+        tile = np.zeros(tileshape[0] * tileshape[1], dtype=np.float64)
+
+        offsets = np.arange(-maxhw, maxhw + 1)
+        dcol, drow = [arr.ravel() for arr in np.meshgrid(offsets, offsets)]
+        batchsize = max(maxpixels // len(dcol), 1)
+
+        for bstart in range(0, len(spots), batchsize):
+            bspots = spots[bstart:bstart + batchsize]
+            pixcol = icol[bspots][:, np.newaxis] + dcol
+            pixrow = irow[bspots][:, np.newaxis] + drow
+
+            dx = pixcol - col[bspots][:, np.newaxis]
+            dy = pixrow - row[bspots][:, np.newaxis]
+            u = dx * cosa[bspots][:, np.newaxis] + dy * sina[bspots][:, np.newaxis]
+            v = -dx * sina[bspots][:, np.newaxis] + dy * cosa[bspots][:, np.newaxis]
+            values = amplitude[bspots][:, np.newaxis] * np.exp(
+                -0.5 * ((u / sigma_x[bspots][:, np.newaxis]) ** 2
+                        + (v / sigma_y[bspots][:, np.newaxis]) ** 2))
+
+            valid = ((pixcol >= tilecol0) & (pixcol < tilecol1)
+                    & (pixrow >= tilerow0) & (pixrow < tilerow1)
+                    & (np.abs(dcol) <= halfwidth[bspots][:, np.newaxis])
+                    & (np.abs(drow) <= halfwidth[bspots][:, np.newaxis]))
+
+            flatindices = (pixrow[valid] - tilerow0) * tileshape[1] + pixcol[valid] - tilecol0
+            tile += np.bincount(flatindices, weights=values[valid], minlength=len(tile))
+
+        image[tilerow0:tilerow1, tilecol0:tilecol1] += tile.reshape(tileshape)
+
+    return image
+
+
+def finalize_image(image, background=0.0, poissonnoise=True, saturation=None,
+                                                            formatdata=None,
+                                                            seed=None):
+    r"""
+    add background and Poisson noise to an image of expected intensities
+    and convert it to detector data format
+
+    :param image: 2D float array of expected intensities (spots)
+    :param background: scalar or 2D array (same shape as image) of background intensity
+    :param poissonnoise: True to draw pixel intensities from Poisson distribution
+    :param saturation: max. pixel intensity (None: no clipping)
+    :param formatdata: numpy data type of output image (None: float)
+    :param seed: seed of random generator for reproducible images
+
+    :return: 2D array
+    """
+    expected = image + background
+    np.maximum(expected, 0, out=expected)
+
+    if poissonnoise:
+        rng = np.random.RandomState(seed)
+        data = rng.poisson(expected).astype(np.float64)
+    else:
+        data = expected
+
+    if saturation is not None:
+        np.minimum(data, saturation, out=data)
+
+    if formatdata is not None:
+        if np.issubdtype(np.dtype(formatdata), np.integer):
+            data = np.round(data)
+        data = data.astype(formatdata)
+
+    return data
+
+
+def render_spotsimage(posx, posy, amplitude, sigma_x=1.5, sigma_y=None, angle=0.0,
+                                                            CCDLabel="MARCCD165",
+                                                            framedim=None,
+                                                            background=0.0,
+                                                            poissonnoise=True,
+                                                            seed=None,
+                                                            position_definition=1,
+                                                            nsigma=RENDER_NSIGMA,
+                                                            tilesize=RENDER_TILESIZE):
+    r"""
+    render a synthetic detector image from spots positions
+
+    :param posx, posy: spots pixel positions
+    :param amplitude, sigma_x, sigma_y, angle: spots shape parameters (see splat_gaussianspots())
+    :param CCDLabel: key of dict_CCD giving frame dimensions, saturation and data format
+    :param framedim: (nb rows, nb columns) to override frame dimensions of CCDLabel
+    :param background: scalar or 2D array of background intensity
+    :param poissonnoise: True to add Poisson noise
+    :param seed: seed of random generator for reproducible images
+
+    :return: 2D array with data format of CCDLabel
+    """
+    dim, _, saturation, formatdata = getframeparameters(CCDLabel)
+    if framedim is None:
+        framedim = dim
+
+    image = np.zeros(framedim, dtype=np.float64)
+    splat_gaussianspots(image, posx, posy, amplitude, sigma_x=sigma_x, sigma_y=sigma_y,
+                                                        angle=angle,
+                                                        position_definition=position_definition,
+                                                        nsigma=nsigma,
+                                                        tilesize=tilesize)
+
+    return finalize_image(image, background=background, poissonnoise=poissonnoise,
+                                                        saturation=saturation,
+                                                        formatdata=formatdata,
+                                                        seed=seed)
+
+
+def render_LauePattern(grains, emin, emax, detectorparameters, CCDLabel="MARCCD165",
+                                                            amplitude=1000.0,
+                                                            sigma_x=1.5,
+                                                            sigma_y=None,
+                                                            angle=0.0,
+                                                            background=0.0,
+                                                            poissonnoise=True,
+                                                            seed=None,
+                                                            kf_direction="Z>0",
+                                                            chunksize=LAUE.STREAM_CHUNKSIZE,
+                                                            nbprocesses=1,
+                                                            dictmaterials=DictLT.dict_Materials):
+    r"""
+    simulate Laue pattern of a set of grains and render the corresponding detector image
+
+    grains are simulated by chunks (see lauecore.SimulateLaue_stream()), so that memory
+    only depends on the frame size.
+
+    :param grains: iterable of 4 elements grain parameters (as in lauecore.SimulateLaue())
+    :param emin, emax: energy band pass (keV)
+    :param detectorparameters: detector calibration parameters [dd, xcen, ycen, xbet, xgam]
+    :param CCDLabel: key of dict_CCD giving frame dimensions, pixel size, saturation and format
+    :param amplitude: spots peak intensity, scalar or function of
+        (grainindex, Miller_ind, Energy) arrays returning an array of amplitudes
+    :param sigma_x, sigma_y, angle: spots shape parameters (see splat_gaussianspots())
+    :param background: scalar or 2D array of background intensity
+    :param poissonnoise: True to add Poisson noise
+    :param seed: seed of random generator for reproducible images
+
+    :return: 2D array with data format of CCDLabel
+    """
+    framedim, pixelsize, saturation, formatdata = getframeparameters(CCDLabel)
+
+    image = np.zeros(framedim, dtype=np.float64)
+
+    for (grainindex, _, _, Miller_ind, posx, posy, Energy
+                            ) in LAUE.SimulateLaue_stream(grains, emin, emax, detectorparameters,
+                                                        chunksize=chunksize,
+                                                        nbprocesses=nbprocesses,
+                                                        kf_direction=kf_direction,
+                                                        pixelsize=pixelsize,
+                                                        dim=(framedim[1], framedim[0]),
+                                                        dictmaterials=dictmaterials):
+        if callable(amplitude):
+            amplitudes = amplitude(grainindex, Miller_ind, Energy)
+        else:
+            amplitudes = amplitude
+        splat_gaussianspots(image, posx, posy, amplitudes, sigma_x=sigma_x, sigma_y=sigma_y,
+                                                                        angle=angle)
+
+    return finalize_image(image, background=background, poissonnoise=poissonnoise,
+                                                        saturation=saturation,
+                                                        formatdata=formatdata,
+                                                        seed=seed)
+
+
+def write_rawimage(outputname, image, CCDLabel="PRINCETON"):
+    r"""
+    write image as binary file with blank header that can be read by
+    readmccd.readCCDimage() with the raw method (offsetheader and format of dict_CCD)
+
+    :param outputname: full path of output file
+    :param image: 2D array
+    :param CCDLabel: key of dict_CCD (must have no frame transform (fliprot='no'))
+    """
+    framedim, _, _, fliprot, offsetheader, formatdata = DictLT.dict_CCD[CCDLabel][:6]
+    if fliprot != "no":
+        raise ValueError("CCDLabel %s implies a frame transform. Not supported" % CCDLabel)
+    if tuple(np.shape(image)) != tuple(framedim):
+        raise ValueError("image shape %s does not match framedim of %s"
+                                                    % (str(np.shape(image)), CCDLabel))
+
+    with open(outputname, "wb") as f:
+        f.write(b"\x00" * max(offsetheader, 0))
+        np.asarray(image, dtype=formatdata).tofile(f)
@@ -54,6 +54,9 @@ except ImportError:
 # --- ------------ CONSTANTS
 DEG = np.pi / 180.0
 CST_ENERGYKEV = DictLT.CST_ENERGYKEV
+# nb of candidate orientation matrices simulated at once in getUBs_and_MatchingRate()
+# (abort request and progress are checked between two batches)
+MATCHINGRATE_BATCH_NBMATRICES = 20
 
 # --- -------------  PROCEDURES
 def stringint(k, n):
@@ -763,29 +766,33 @@ def getUBs_and_MatchingRate(spot_index_1, spot_index_2, ang_tol_LUT, angdist, co
     WORKEREXIST = 0
     if worker is not None:
         WORKEREXIST = 1
-    # loop over orient matrix given from LUT recognition for one central spot
     nb_UB_matrices = len(list_orient_matrix)
+    batchsize = MATCHINGRATE_BATCH_NBMATRICES
+    # loop over orient matrix given from LUT recognition for one central spot
     for mat_ind in list(range(nb_UB_matrices)):
-        if WORKEREXIST:
-            #             print "there is a worker !!"
-            if worker._want_abort:
-                print("\n\n!!!!!!! Indexation Aborted \n\n!!!!!!!\n")
-                BestScores_per_centralspot = np.array([])
-                worker.callbackfct(None)
-                return
-        if (mat_ind % 20) == 0:
+        if (mat_ind % batchsize) == 0:
+            if WORKEREXIST:
+                #             print "there is a worker !!"
+                if worker._want_abort:
+                    print("\n\n!!!!!!! Indexation Aborted \n\n!!!!!!!\n")
+                    BestScores_per_centralspot = np.array([])
+                    worker.callbackfct(None)
+                    return
             print("Calculating matching with exp. data for matrix #%d / %d" % (mat_ind,
                                                                                 nb_UB_matrices))
-        # compute matching rate and store if high
-        AngRes = matchingrate.Angular_residues_np(list_orient_matrix[mat_ind],
-                                                    twiceTheta_exp,
-                                                    Chi_exp,
-                                                    key_material=key_material,
-                                                    emax=emax,
-                                                    ResolutionAngstrom=ResolutionAngstrom,
-                                                    ang_tol=ang_tol_MR,
-                                                    detectorparameters=detectorparameters,
-                                                    dictmaterials=dictmaterials)
+            # simulate at once Laue patterns of the next batch of orient matrices
+            batch_AngRes = matchingrate.Angular_residues_np_batch(
+                                                list_orient_matrix[mat_ind:mat_ind + batchsize],
+                                                twiceTheta_exp,
+                                                Chi_exp,
+                                                key_material=key_material,
+                                                emax=emax,
+                                                ResolutionAngstrom=ResolutionAngstrom,
+                                                ang_tol=ang_tol_MR,
+                                                detectorparameters=detectorparameters,
+                                                dictmaterials=dictmaterials)
+        # matching rate (to be stored if high)
+        AngRes = batch_AngRes[mat_ind % batchsize]
 
         if AngRes is None:
             continue
@@ -2071,12 +2078,8 @@ def getOrientMatrices(spot_index_central, energy_max, Tab_angl_dist, Theta_exp,
 
         # --- loop over orient matrix given from LUT recognition for one central spot
         currentspotindex2 = -1
-        for mat_ind in list(range(len(list_orient_matrix))):
-
-            #             print "calculating matching with exp. Data for matrix condidate index=%d" % mat_ind
-
-            # compute matching (indexation) rate
-            AngRes = matchingrate.Angular_residues_np(list_orient_matrix[mat_ind],
+        # compute matching (indexation) rate of all matrix candidates at once
+        list_AngRes = matchingrate.Angular_residues_np_batch(list_orient_matrix,
                                                         twiceTheta_exp,
                                                         Chi_exp,
                                                         key_material=key_material,
@@ -2085,6 +2088,11 @@ def getOrientMatrices(spot_index_central, energy_max, Tab_angl_dist, Theta_exp,
                                                         ang_tol=MR_tol_angle,
                                                         detectorparameters=detectorparameters,
                                                         dictmaterials=dictmaterials)
+        for mat_ind in list(range(len(list_orient_matrix))):
+
+            #             print "calculating matching with exp. Data for matrix condidate index=%d" % mat_ind
+
+            AngRes = list_AngRes[mat_ind]
 
             if AngRes is None:
                 continue
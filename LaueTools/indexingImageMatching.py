@@ -1555,10 +1555,10 @@ def StickLabel_on_exp_peaks(Angles,
                                 verbose=0,
                                 dictmaterials=dictmaterials)
 
-    # fastcompute=0 => result is list of spot instances which are on camera (with harmonics)
+    # fastcompute=0 => result is list of SpotsTable of spots which are on camera (with harmonics)
     TwicethetaChi = LAUE.filterLaueSpots(spots2pi, fileOK=0, fastcompute=0)
 
-    theta_and_chi_theo = np.array([[elem.Twicetheta / 2.0, elem.Chi] for elem in TwicethetaChi[0]])
+    theta_and_chi_theo = np.array([TwicethetaChi[0].Twicetheta / 2.0, TwicethetaChi[0].Chi]).T
     theta_and_chi_exp = np.array([twicetheta_data / 2.0, chi_data]).T
 
     # from the experimental point of view (how far are the theoritical point from 1 one exp point)
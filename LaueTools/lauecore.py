@@ -17,6 +17,9 @@ from __future__ import division
 import math
 import sys
 import builtins
+import collections
+import itertools
+import multiprocessing
 
 import numpy as np
 
@@ -51,6 +54,26 @@ except ImportError:
 
 DEG = np.pi / 180.0
 
+# max. nb of (orientation matrix, hkl node) pairs handled at once in batched simulation
+BATCH_MAXNODES = 2000000
+# nb of grains simulated at once in streaming simulation (SimulateLaue_stream())
+STREAM_CHUNKSIZE = 64
+# max. nb of tables kept in cache by getStructureFactor2()
+STRUCTUREFACTOR_CACHE_MAXSIZE = 16
+# hkl range of tables of structure factors is a multiple of STRUCTUREFACTOR_HKLSTEP
+STRUCTUREFACTOR_HKLSTEP = 8
+_STRUCTUREFACTOR_CACHE = collections.OrderedDict()
+
+# hkl nodes cache (see getHKLnodes_cached())
+USE_HKLNODES_CACHE = True
+HKLNODES_CACHE_MAXBYTES = 256 * 2 ** 20
+# radius factor of cached nodes to handle orientation matrices with some distortion
+HKLNODES_MARGIN = 1.1
+# l * HKLNODES_KEYSPAN + k sorts nodes as in genHKL_np()
+HKLNODES_KEYSPAN = 2 ** 20
+_HKLNODES_CACHE = collections.OrderedDict()
+_HKLNODES_CACHE_NBBYTES = [0]
+
 # --- ---------- Spot class
 class spot:
     r"""
@@ -91,6 +114,175 @@ class spot:
         # print "inter ", inter
         return np.array(self.Millers) / GT.pgcdl(inter)
 
+# --- ---------- Columnar spots container
+# one record per simulated spot. Undefined angles or detector positions are set to nan
+SPOTS_DTYPE = np.dtype([("Millers", np.int64, (3,)),
+                        ("Qxyz", np.float64, (3,)),
+                        ("EwaldRadius", np.float64),
+                        ("Energy", np.float64),
+                        ("Twicetheta", np.float64),
+                        ("Chi", np.float64),
+                        ("Xcam", np.float64),
+                        ("Ycam", np.float64),
+                        ("grainindex", np.int32)])
+
+
+class spotview(object):
+    r"""
+    lightweight read-only view on one record of a SpotsTable
+
+    Exposes the same attributes as spot instances (Millers, Qxyz, EwaldRadius, Xcam, Ycam,
+    Twicetheta, Chi) so that legacy code iterating over spots keeps working.
+    Undefined values (nan in table) are returned as None as for spot instances.
+    """
+    __slots__ = ("_record",)
+
+    def __init__(self, record):
+        self._record = record
+
+    def _optional(self, fieldname):
+        val = self._record[fieldname]
+        if val != val:  # nan
+            return None
+        return val
+
+    @property
+    def Millers(self):
+        return self._record["Millers"]
+
+    @property
+    def Qxyz(self):
+        return self._record["Qxyz"]
+
+    @property
+    def EwaldRadius(self):
+        return self._record["EwaldRadius"]
+
+    @property
+    def Energy(self):
+        return self._record["Energy"]
+
+    @property
+    def grainindex(self):
+        return self._record["grainindex"]
+
+    @property
+    def Twicetheta(self):
+        return self._optional("Twicetheta")
+
+    @property
+    def Chi(self):
+        return self._optional("Chi")
+
+    @property
+    def Xcam(self):
+        return self._optional("Xcam")
+
+    @property
+    def Ycam(self):
+        return self._optional("Ycam")
+
+    __hash__ = spot.__hash__
+    have_fond_indices = spot.have_fond_indices
+
+
+class SpotsTable(object):
+    r"""
+    container of simulated spots stored in columns (numpy structured array of dtype SPOTS_DTYPE)
+
+    Columns are available as arrays: table.Twicetheta, table.Chi, table.Millers, table.Energy, ...
+    Iterating over the table or indexing with an integer gives spotview objects
+    (with attributes of spot instances). Indexing with slice, mask or array of indices
+    gives a new SpotsTable.
+
+    :param data: structured array of dtype SPOTS_DTYPE, or None for empty table
+    """
+    def __init__(self, data=None):
+        if data is None:
+            data = np.zeros(0, dtype=SPOTS_DTYPE)
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        for record in self.data:
+            yield spotview(record)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return spotview(self.data[key])
+        return SpotsTable(self.data[key])
+
+    def __repr__(self):
+        return "SpotsTable of %d spot(s)" % len(self.data)
+
+    def column(self, fieldname):
+        r"""
+        return array of values of field fieldname for all spots
+        """
+        return self.data[fieldname]
+
+    @property
+    def Millers(self):
+        return self.data["Millers"]
+
+    @property
+    def Qxyz(self):
+        return self.data["Qxyz"]
+
+    @property
+    def EwaldRadius(self):
+        return self.data["EwaldRadius"]
+
+    @property
+    def Energy(self):
+        return self.data["Energy"]
+
+    @property
+    def Twicetheta(self):
+        return self.data["Twicetheta"]
+
+    @property
+    def Chi(self):
+        return self.data["Chi"]
+
+    @property
+    def Xcam(self):
+        return self.data["Xcam"]
+
+    @property
+    def Ycam(self):
+        return self.data["Ycam"]
+
+    @property
+    def grainindex(self):
+        return self.data["grainindex"]
+
+    def delete(self, indices):
+        r"""
+        return new SpotsTable without spots of given indices
+        """
+        return SpotsTable(np.delete(self.data, indices))
+
+    def tolist(self):
+        r"""
+        return list of spotview (one per spot)
+        """
+        return list(iter(self))
+
+
+def concatenate_SpotsTables(list_spotstables):
+    r"""
+    merge several SpotsTable (e.g. one per grain) in a single SpotsTable
+
+    :param list_spotstables: list of SpotsTable (None elements are skipped)
+    """
+    list_data = [table.data for table in list_spotstables if table is not None]
+    if not list_data:
+        return SpotsTable()
+    return SpotsTable(np.concatenate(list_data))
+
 # --- ---------------   PROCEDURES
 def Quicklist(OrientMatrix, ReciprocBasisVectors, listRSnorm, lambdamin, verbose=0):
     r"""
@@ -296,6 +488,261 @@ def genHKL_np(listn, Extinc):
     return CP.ApplyExtinctionrules(HKL, Extinc)
 
 
+# --- ---------------  Cache of reciprocal lattice nodes
+def _HKLnodes_cachekey(Bmatrix, Extinc, wavelmin, ResolutionAngstrom):
+    r"""
+    return hashable key of cached hkl nodes
+    """
+    Bkey = np.round(np.array(Bmatrix, dtype=np.float64), decimals=12).tobytes()
+    if not ResolutionAngstrom:
+        ResolutionAngstrom = False
+    return (Bkey, Extinc, float(wavelmin), ResolutionAngstrom)
+
+
+def getHKLnodes_cached(Bmatrix, Extinc, wavelmin, ResolutionAngstrom=False,
+                                                    margin=HKLNODES_MARGIN):
+    r"""
+    return hkl nodes (and their q vectors B*hkl before rotation) that can be in the largest
+    Ewald sphere (of radius 1/wavelmin) whatever the crystal orientation.
+
+    Nodes are kept in a process-wide least recently used cache keyed by
+    (B matrix, extinction rules, wavelmin, ResolutionAngstrom) whose memory is bounded
+    by HKLNODES_CACHE_MAXBYTES (see set_HKLnodes_cache_maxbytes() and clear_HKLnodes_cache())
+
+    :param Bmatrix: B matrix (a*,b*,c* vectors in column in LaueTools frame)
+    :param Extinc: label for extinction rules ('no','fcc','dia', etc...)
+    :param wavelmin: smallest wavelength in Angstrom
+    :param ResolutionAngstrom: False or smallest interplanar distance in Angstrom
+    :param margin: q vectors radius factor so that nodes remain valid for orientation
+        matrices whose smallest singular value is larger than 1/margin (see isOrientMatrix_cachable())
+
+    :return: hkl (n,3) array of integers, Bhkl (n,3) array of q vectors, and sorted
+        keys l * HKLNODES_KEYSPAN + k of nodes (see select_HKLnodes_inlimits()) (read-only arrays)
+        or None if nodes are too numerous to be cached
+    """
+    key = _HKLnodes_cachekey(Bmatrix, Extinc, wavelmin, ResolutionAngstrom)
+
+    if key in _HKLNODES_CACHE:
+        _HKLNODES_CACHE.move_to_end(key)
+        return _HKLNODES_CACHE[key]
+
+    Bmatrix = np.array(Bmatrix, dtype=np.float64)
+    qmax = 2.0 / wavelmin
+    if ResolutionAngstrom:
+        qmax = min(qmax, 1.0 / ResolutionAngstrom)
+    qmax = qmax * margin
+
+    # |h| <= |(B^-1)[0]| * |q|
+    hklmax = np.ceil(np.sqrt(np.sum(np.linalg.inv(Bmatrix) ** 2, axis=1)) * qmax).astype(int)
+
+    # estimated size of hkl, Bhkl and keys arrays for nodes in sphere (pi/6 of the cube)
+    if np.prod(2.0 * hklmax + 1) * np.pi / 6.0 * 7 * 8 > HKLNODES_CACHE_MAXBYTES:
+        return None
+
+    hkl = genHKL_np([[-int(nmax), int(nmax) + 1] for nmax in hklmax], Extinc)
+
+    Bhkl = np.dot(hkl, Bmatrix.T)
+    insphere = np.sum(Bhkl ** 2, axis=1) <= qmax ** 2
+    hkl = hkl[insphere]
+    Bhkl = Bhkl[insphere]
+    # nodes are sorted by l then by k (see genHKL_np())
+    lkkey = hkl[:, 2].astype(np.int64) * HKLNODES_KEYSPAN + hkl[:, 1]
+
+    nodes = (hkl, Bhkl, lkkey)
+    for arr in nodes:
+        arr.flags.writeable = False
+
+    nbbytes = sum(arr.nbytes for arr in nodes)
+    if nbbytes <= HKLNODES_CACHE_MAXBYTES:
+        _HKLNODES_CACHE[key] = nodes
+        _HKLNODES_CACHE_NBBYTES[0] += nbbytes
+        _trim_HKLnodes_cache()
+
+    return nodes
+
+
+def isOrientMatrix_cachable(OrientMatrix, margin=HKLNODES_MARGIN):
+    r"""
+    return True if nodes given by getHKLnodes_cached() contain all nodes that can be
+    in the largest Ewald sphere once rotated (and distorted) by OrientMatrix
+    """
+    smallest_singularvalue = np.amin(np.linalg.svd(np.array(OrientMatrix, dtype=np.float64),
+                                                    compute_uv=False))
+    return smallest_singularvalue * margin >= 1.0
+
+
+def _trim_HKLnodes_cache():
+    r"""
+    remove least recently used cached hkl nodes until memory bound is fulfilled
+    """
+    while _HKLNODES_CACHE and _HKLNODES_CACHE_NBBYTES[0] > HKLNODES_CACHE_MAXBYTES:
+        _, nodes = _HKLNODES_CACHE.popitem(last=False)
+        _HKLNODES_CACHE_NBBYTES[0] -= sum(arr.nbytes for arr in nodes)
+
+
+def set_HKLnodes_cache_maxbytes(maxbytes):
+    r"""
+    set memory bound (in bytes) of cached hkl nodes (0 disables the cache)
+    """
+    global HKLNODES_CACHE_MAXBYTES
+    HKLNODES_CACHE_MAXBYTES = int(maxbytes)
+    _trim_HKLnodes_cache()
+
+
+def clear_HKLnodes_cache(Bmatrix=None, Extinc=None):
+    r"""
+    remove cached hkl nodes
+
+    :param Bmatrix: None to remove all cached nodes, otherwise remove only nodes computed
+        with this B matrix (and Extinc extinction rules if not None)
+    """
+    if Bmatrix is None:
+        _HKLNODES_CACHE.clear()
+        _HKLNODES_CACHE_NBBYTES[0] = 0
+        return
+
+    Bkey = _HKLnodes_cachekey(Bmatrix, Extinc, 0, False)[0]
+    for key in list(_HKLNODES_CACHE.keys()):
+        if key[0] == Bkey and (Extinc is None or key[1] == Extinc):
+            nodes = _HKLNODES_CACHE.pop(key)
+            _HKLNODES_CACHE_NBBYTES[0] -= sum(arr.nbytes for arr in nodes)
+
+
+def getHKLnodes_cache_info():
+    r"""
+    return number of cached hkl nodes sets and their memory size in bytes
+    """
+    return len(_HKLNODES_CACHE), _HKLNODES_CACHE_NBBYTES[0]
+
+
+# --- ---------------  Pruning of nodes that cannot reach the detector
+def getDetectorCone_qspace(kf_direction=DEFAULT_TOP_GEOMETRY, detectordistance=None,
+                                                    detectordiameter=None,
+                                                    OpeningAngleCollection=22.0,
+                                                    nbsamples=360):
+    r"""
+    compute a cone (in reciprocal space) containing all q vectors whose scattered beam kf
+    can be collected by the detector
+
+    Detector collects kf vectors in a cone of axis given by kf_direction ('Z>0', 'X>0', etc. or
+    [2theta, chi] in degrees) and half-angle arctan(detectordiameter / 2 / detectordistance)
+    (90 deg if detector distance and diameter are not given, OpeningAngleCollection if
+    kf_direction is [2theta, chi]).
+    Since q is parallel to kf_unit - ki_unit whatever the energy, q directions are also
+    in a cone.
+
+    :return: None if kf_direction is '4PI', otherwise
+        (q cone axis unit vector, cosine of q cone half-angle, sinus of largest Bragg angle)
+    """
+    axes = {"Z>0": (0.0, 0.0, 1.0),
+            "Y>0": (0.0, 1.0, 0.0),
+            "Y<0": (0.0, -1.0, 0.0),
+            "X>0": (1.0, 0.0, 0.0),
+            "X<0": (-1.0, 0.0, 0.0)}
+
+    if isinstance(kf_direction, (builtins.list, tuple, np.ndarray)):
+        kf_2theta, kf_chi = np.array(kf_direction, dtype=np.float64) * DEG
+        kfaxis = np.array([np.cos(kf_2theta),
+                            np.sin(kf_2theta) * np.sin(kf_chi),
+                            np.sin(kf_2theta) * np.cos(kf_chi)])
+        halfangle = OpeningAngleCollection * DEG
+    elif kf_direction in axes:
+        kfaxis = np.array(axes[kf_direction])
+        if detectordistance is None or detectordiameter is None:
+            halfangle = np.pi / 2.0
+        else:
+            halfangle = np.arctan(detectordiameter / 2.0 / detectordistance)
+    else:
+        return None
+
+    # 2theta = angle(kf, ki) with ki // x
+    angle_kf_ki = np.arccos(np.clip(kfaxis[0], -1.0, 1.0))
+    sinthetamax = np.sin(min(angle_kf_ki + halfangle, np.pi) / 2.0)
+
+    # SECURITY margin for sampling
+    margin = 1.0 * DEG
+    if angle_kf_ki <= halfangle + margin:
+        # kf // ki is collected: q is perpendicular to ki for vanishing 2theta
+        return np.array([-1.0, 0.0, 0.0]), 0.0, sinthetamax
+
+    # kf unit vectors on the border of the detection cone
+    perp1 = np.cross(kfaxis, (1.0, 0.0, 0.0) if abs(kfaxis[0]) < 0.9 else (0.0, 0.0, 1.0))
+    perp1 = perp1 / np.sqrt(np.sum(perp1 ** 2))
+    perp2 = np.cross(kfaxis, perp1)
+    azimuth = np.linspace(0.0, 2 * np.pi, nbsamples, endpoint=False)
+    kfs = (np.cos(halfangle) * kfaxis[np.newaxis, :]
+            + np.sin(halfangle) * (np.cos(azimuth)[:, np.newaxis] * perp1
+                                    + np.sin(azimuth)[:, np.newaxis] * perp2))
+    kfs = np.vstack((kfaxis, kfs))
+
+    qs = kfs - np.array([1.0, 0.0, 0.0])
+    qs = qs / np.sqrt(np.sum(qs ** 2, axis=1))[:, np.newaxis]
+
+    qaxis = np.sum(qs, axis=0)
+    qaxis = qaxis / np.sqrt(np.sum(qaxis ** 2))
+    qhalfangle = np.amax(np.arccos(np.clip(np.dot(qs, qaxis), -1.0, 1.0))) + margin
+
+    return qaxis, np.cos(min(qhalfangle, np.pi)), sinthetamax
+
+
+def getHKLlimits_pruned(UBmatrix, wavelmin, qcone, ResolutionAngstrom=False):
+    r"""
+    return Miller indices limits of nodes q = UB * hkl lying in the cone qcone of
+    q directions (see getDetectorCone_qspace()) within the largest q norm for Bragg angles
+    of qcone, and in the largest Ewald sphere
+
+    :return: [[hmin,hmax],[kmin,kmax],[lmin,lmax]] (to be used as python range limits)
+    """
+    qaxis, cosqhalfangle, sinthetamax = qcone
+    qmax = 2.0 * sinthetamax / wavelmin
+    if ResolutionAngstrom:
+        qmax = min(qmax, 1.0 / ResolutionAngstrom)
+
+    qhalfangle = np.arccos(cosqhalfangle)
+    invUB = np.linalg.inv(np.array(UBmatrix, dtype=np.float64))
+
+    limits = []
+    # h = r . q   with r row of UB^-1: extrema of h over the spherical cone
+    # and over the largest Ewald sphere (centre -1/wavelmin x, radius 1/wavelmin)
+    for row in invUB:
+        normrow = np.sqrt(np.sum(row ** 2))
+        angle_row_qaxis = np.arccos(np.clip(np.dot(row, qaxis) / normrow, -1.0, 1.0))
+        upper = qmax * normrow * np.cos(min(max(angle_row_qaxis - qhalfangle, 0.0), np.pi / 2))
+        lower = qmax * normrow * np.cos(min(max(np.pi - angle_row_qaxis - qhalfangle, 0.0),
+                                            np.pi / 2))
+        upper = min(upper, (-row[0] + normrow) / wavelmin)
+        lower = min(lower, (row[0] + normrow) / wavelmin)
+        # SECURITY -1 and +2 (exclusion convention for slicing in python)
+        limits.append([-int(np.ceil(lower)) - 1, int(np.ceil(upper)) + 2])
+
+    return limits
+
+
+def select_HKLnodes_inlimits(lkkey, hkl, list_hkl_limits):
+    r"""
+    return indices of hkl nodes in list_hkl_limits
+
+    :param lkkey: sorted keys l * HKLNODES_KEYSPAN + k of nodes (as given by getHKLnodes_cached())
+    :param hkl: hkl nodes
+    """
+    (hmin, hmax), (kmin, kmax), (lmin, lmax) = list_hkl_limits
+    # one contiguous block of nodes per l value with k in [kmin, kmax[
+    lvalues = np.arange(lmin, lmax, dtype=np.int64) * HKLNODES_KEYSPAN
+    starts = np.searchsorted(lkkey, lvalues + kmin)
+    ends = np.searchsorted(lkkey, lvalues + kmax)
+    lengths = ends - starts
+    nbnodes = np.sum(lengths)
+    if nbnodes == 0:
+        return np.zeros(0, dtype=int)
+
+    # concatenation of ranges [starts[i], ends[i][
+    blockstarts = np.cumsum(lengths) - lengths
+    indices = np.arange(nbnodes) + np.repeat(starts - blockstarts, lengths)
+
+    H = hkl[indices, 0]
+    return indices[(H >= hmin) & (H < hmax)]
+
+
 # --- -----------------------  Main procedures
 def parse_grainparameters(SingleCrystalParams):
     r"""
@@ -325,7 +772,9 @@ def getLaueSpots(wavelmin, wavelmax, crystalsParams, linestowrite,
                                             ResolutionAngstrom=False,
                                             fileOK=1,
                                             verbose=1,
-                                            dictmaterials=None):
+                                            dictmaterials=None,
+                                            detectordistance=None,
+                                            detectordiameter=None):
     r"""
     Compute Qxyz vectors and corresponding HKL miller indices for nodes in recicprocal space that can be measured
     for the given detection geometry and energy bandpass configuration.
@@ -368,6 +817,11 @@ def getLaueSpots(wavelmin, wavelmax, crystalsParams, linestowrite,
     :param linestowrite: list of [string] that can be write in file or display in
         stdout. Example: [[""]] or [["**********"],["lauetools"]]
 
+    :param detectordistance: approximate detector distance (mm)
+    :param detectordiameter: approximate detector diameter (mm)
+        if both are given, only nodes that can be collected by the detector are generated
+        (see getDetectorCone_qspace()). Finer selection on camera is still done in filterLaueSpots()
+
     :return:
         * list of [Qx,Qy,Qz]s for each grain, list of [H,K,L]s for each grain (fastcompute = 0)
 
@@ -448,6 +902,10 @@ def getLaueSpots(wavelmin, wavelmax, crystalsParams, linestowrite,
     wholelistvecfiltered = []
     wholelistindicesfiltered = []
 
+    # cone of q directions collected by the detector to prune hkl nodes
+    qcone = getDetectorCone_qspace(kf_direction, detectordistance, detectordiameter,
+                                    OpeningAngleCollection=OpeningAngleCollection)
+
     # calculation of RS lattice nodes in lauetools laboratory frame and indices
 
     # loop over grains
@@ -465,50 +923,74 @@ def getLaueSpots(wavelmin, wavelmax, crystalsParams, linestowrite,
             print("")
 
         Bmatrix = np.array(Bmatrix)
-
-        # generation of hkl nodes from Bmatrix
-
-        listvecstarlength = np.sqrt(np.sum(Bmatrix ** 2, axis=0))
-
-        # print "listvecstarlength",listvecstarlength
-
-        # in Bmatrix.T,  a*, b* ,c* are rows of this argument
-        #  B matrix in q= Orientmatrix B G formula
-        # limitation of probed h k and l ranges
-        list_hkl_limits = Quicklist(Orientmatrix, Bmatrix.T, listvecstarlength, wlm, verbose=0)
-
-        # Loop over h k l
-        # ----cython optimization
-        global USE_CYTHON
-        if USE_CYTHON:
-            hlim, klim, llim = list_hkl_limits
-            hmin, hmax = hlim
-            kmin, kmax = klim
-            lmin, lmax = llim
-            dict_extinc = {"no": 0, "fcc": 1, "dia": 2}
-            try:
-                ExtinctionCode = dict_extinc[Extinc]
-                SPECIAL_EXTINC = False
-            except KeyError:
-                ExtinctionCode = 0
-                SPECIAL_EXTINC = True
-
-            #  print "\n\n*******\nUsing Cython optimization\n********\n\n"
-            hkls, counter = generatehkl.genHKL(hmin, hmax, kmin, kmax, lmin, lmax, ExtinctionCode)
-
-            table_vec = hkls[:counter]
-
-            # TODO need to remove element [0,0,0] or naturally removed in ?
-            if SPECIAL_EXTINC:
-                #  print "special extinction"
-                table_vec = CP.ApplyExtinctionrules(table_vec, Extinc)
-
-        if not USE_CYTHON:
-            table_vec = genHKL_np(list_hkl_limits, Extinc)
-
         Orientmatrix = np.array(Orientmatrix)
 
-        listrotvec = np.dot(Orientmatrix, np.dot(Bmatrix, table_vec.T))
+        cachednodes = None
+        if USE_HKLNODES_CACHE and isOrientMatrix_cachable(Orientmatrix):
+            # hkl nodes and B*hkl vectors are computed once for all grains and images
+            cachednodes = getHKLnodes_cached(Bmatrix, Extinc, wlm, ResolutionAngstrom)
+
+        if cachednodes is not None:
+            table_vec, Bhkl, lkkey = cachednodes
+            if qcone is not None:
+                # keep only nodes that can reach the detector
+                toprobe = select_HKLnodes_inlimits(lkkey, table_vec,
+                                                getHKLlimits_pruned(np.dot(Orientmatrix, Bmatrix),
+                                                                    wlm, qcone, ResolutionAngstrom))
+                table_vec = table_vec[toprobe]
+                Bhkl = Bhkl[toprobe]
+            listrotvec = np.dot(Orientmatrix, Bhkl.T)
+        else:
+            # generation of hkl nodes from Bmatrix
+
+            listvecstarlength = np.sqrt(np.sum(Bmatrix ** 2, axis=0))
+
+            # print "listvecstarlength",listvecstarlength
+
+            # in Bmatrix.T,  a*, b* ,c* are rows of this argument
+            #  B matrix in q= Orientmatrix B G formula
+            # limitation of probed h k and l ranges
+            list_hkl_limits = Quicklist(Orientmatrix, Bmatrix.T, listvecstarlength, wlm, verbose=0)
+
+            if qcone is not None and list_hkl_limits is not None:
+                # keep only nodes that can reach the detector
+                pruned_limits = getHKLlimits_pruned(np.dot(Orientmatrix, Bmatrix), wlm, qcone,
+                                                    ResolutionAngstrom)
+                for lim, plim in zip(list_hkl_limits, pruned_limits):
+                    lim[0] = max(lim[0], plim[0])
+                    # at least one index value for genHKL_np()
+                    lim[1] = max(min(lim[1], plim[1]), lim[0] + 1)
+
+            # Loop over h k l
+            # ----cython optimization
+            global USE_CYTHON
+            if USE_CYTHON:
+                hlim, klim, llim = list_hkl_limits
+                hmin, hmax = hlim
+                kmin, kmax = klim
+                lmin, lmax = llim
+                dict_extinc = {"no": 0, "fcc": 1, "dia": 2}
+                try:
+                    ExtinctionCode = dict_extinc[Extinc]
+                    SPECIAL_EXTINC = False
+                except KeyError:
+                    ExtinctionCode = 0
+                    SPECIAL_EXTINC = True
+
+                #  print "\n\n*******\nUsing Cython optimization\n********\n\n"
+                hkls, counter = generatehkl.genHKL(hmin, hmax, kmin, kmax, lmin, lmax, ExtinctionCode)
+
+                table_vec = hkls[:counter]
+
+                # TODO need to remove element [0,0,0] or naturally removed in ?
+                if SPECIAL_EXTINC:
+                    #  print "special extinction"
+                    table_vec = CP.ApplyExtinctionrules(table_vec, Extinc)
+
+            if not USE_CYTHON:
+                table_vec = genHKL_np(list_hkl_limits, Extinc)
+
+            listrotvec = np.dot(Orientmatrix, np.dot(Bmatrix, table_vec.T))
 
         listrotvec_X = listrotvec[0]
         listrotvec_Y = listrotvec[1]
@@ -1042,13 +1524,14 @@ def filterLaueSpots(vec_and_indices, HarmonicsRemoval=1,
     :param fastcompute:
         * 1, outputs a list for each grain of 2theta spots and a list for each grain of chi spots
             (HARMONICS spots are still HERE!)
-        * 0, outputs list for each grain of spots with
+        * 0, outputs for each grain a SpotsTable of spots (see create_SpotsTable())
 
     :param kf_direction: label for detection geometry (CCD plane with respect to the incoming beam and sample)
     :type kf_direction: string
 
     :return:
-        * list of spot instances if fastcompute=0
+        * list of SpotsTable (one per grain) if fastcompute=0. Iterating over a SpotsTable
+            gives objects with the attributes of spot instances
 
         * 2theta, chi          if fastcompute=1
 
@@ -1193,22 +1676,17 @@ def filterLaueSpots(vec_and_indices, HarmonicsRemoval=1,
             oncam_L = np.compress(onCam_cond, indi_L)
             oncam_HKL = np.transpose(np.array([oncam_H, oncam_K, oncam_L]))
 
-            # build list of spot objects
-            listspot = get2ThetaChi_geometry(oncam_vec,
-                                            oncam_HKL,
-                                            detectordistance=detectordistance,
-                                            pixelsize=pixelsize,
-                                            dim=dim,
-                                            kf_direction=kf_direction)
-            #print("listspot", listspot)
-            # print("oncam_HKL", oncam_HKL.tolist())
+            # build table of spots (columns of spots attributes)
+            listspot = create_SpotsTable(oncam_vec,
+                                        oncam_HKL,
+                                        detectordistance=detectordistance,
+                                        pixelsize=pixelsize,
+                                        dim=dim,
+                                        kf_direction=kf_direction,
+                                        grainindex=grainindex)
             # Creating list of spot with or without harmonics
-            if HarmonicsRemoval and listspot:
-                # ListSpots_Oncam_wo_harmonics[grainindex] = RemoveHarmonics(listspot)
-                # (oncam_HKL_filtered, toremove)
-                (_, toremove) = CP.FilterHarmonics_2(oncam_HKL, return_indices_toremove=1)
-                #print('toremove',toremove)
-                listspot = np.delete(np.array(listspot), toremove).tolist()
+            if HarmonicsRemoval:
+                listspot = RemoveHarmonics(listspot)
 
             # feeding final list of spots
             ListSpots_Oncam_wo_harmonics[grainindex] = listspot
@@ -1379,6 +1857,12 @@ def filterLaueSpots_full_np(veccoord, indicemiller, onlyXYZ=False, HarmonicsRemo
         oncam_L = np.compress(onCam_cond, indi_L)
         oncam_HKL = np.transpose(np.array([oncam_H, oncam_K, oncam_L]))
 
+        # Removing harmonics (fundamentals of lowest energy are kept)
+        if HarmonicsRemoval:
+            tokeep, _ = CP.getHarmonicsIndices(oncam_HKL)
+            oncam_vec = np.take(oncam_vec, tokeep, axis=0)
+            oncam_HKL = np.take(oncam_HKL, tokeep, axis=0)
+
         # build list of spot objects
         TwthetaChiEnergyMillers_list_one_grain = get2ThetaChi_geometry_full_np(
                                                                 oncam_vec,
@@ -1389,16 +1873,6 @@ def filterLaueSpots_full_np(veccoord, indicemiller, onlyXYZ=False, HarmonicsRemo
                                                                 kf_direction=kf_direction)
 
         #         print 'TwthetaChiEnergy_list_one_grain', TwthetaChiEnergy_list_one_grain
-        # Creating list of spot with or without harmonics
-        if HarmonicsRemoval and True:  # listspot:
-            raise ValueError("Harmonic removal is not implemented and listspot does not exist anymore")
-            #                ListSpots_Oncam_wo_harmonics[i] = RemoveHarmonics(listspot)
-            # (oncam_HKL_filtered, toremove) = CP.FilterHarmonics_2(
-            #     oncam_HKL, return_indices_toremove=1
-            # )
-            # listspot = np.delete(np.array(listspot), toremove).tolist()
-
-        # print "Number of spot in camera w / o harmonics",len(ListSpots_Oncam_wo_harmonics[i])
 
     # (fastcompute = 1) no instantiation of spot object
     # will return 2theta, chi for each grain
@@ -1488,6 +1962,91 @@ def get2ThetaChi_geometry(oncam_vec, oncam_HKL, detectordistance=DEFAULT_DETECTO
     return listspot
 
 
+def create_SpotsTable(oncam_vec, oncam_HKL, detectordistance=DEFAULT_DETECTOR_DISTANCE,
+                                                                pixelsize=165.0 / 2048,
+                                                                dim=(2048, 2048),
+                                                                kf_direction=DEFAULT_TOP_GEOMETRY,
+                                                                grainindex=0):
+    r"""
+    computes SpotsTable from oncam_vec (q 3D vectors) and oncam_HKL (miller indices 3D vectors)
+
+    vectorized equivalent of get2ThetaChi_geometry() (same selection of spots and same
+    spots attributes as create_spot functions, except that Xcam, Ycam are also computed
+    for 'Z>0' geometry).
+
+    :param oncam_vec: q vectors [qx,qy,qz] (corresponding to kf collected on camera)
+    :type oncam_vec: array with 3D elements (shape = (n,3))
+    :param oncam_HKL: miller indices
+    :type oncam_HKL: array with 3D elements (shape = (n,3))
+    :param kf_direction: label for detection geometry
+    :param grainindex: index of grain to be written in each spot record
+
+    :return: SpotsTable
+    """
+    oncam_vec = np.asarray(oncam_vec, dtype=np.float64).reshape((-1, 3))
+    oncam_HKL = np.asarray(oncam_HKL).reshape((-1, 3))
+    if len(oncam_vec) != len(oncam_HKL):
+        raise ValueError("Wrong input for create_SpotsTable()")
+
+    Qx, Qy, Qz = oncam_vec.T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Rewald = np.sum(oncam_vec ** 2, axis=1) / (2.0 * np.abs(Qx))
+        XplusR = Qx + Rewald
+
+        # spots to keep and spots with defined attributes for each geometry (see create_spot*())
+        tokeep = np.ones(len(Qx), dtype=bool)
+        Xcam = np.full(len(Qx), np.nan)
+        Ycam = np.full(len(Qx), np.nan)
+        if kf_direction == "Z>0":
+            defined = Qz > 0
+            Xcam = -(detectordistance * XplusR / Qz) / pixelsize + dim[0] / 2
+            Ycam = -(detectordistance * Qy / Qz) / pixelsize + dim[1] / 2
+        elif kf_direction == "Y>0":
+            defined = Qy > 0
+            Xcam = detectordistance * XplusR / Qy / pixelsize
+            Ycam = detectordistance * Qz / Qy / pixelsize
+        elif kf_direction == "Y<0":
+            defined = Qy < 0
+            Xcam = -detectordistance * XplusR / Qy / pixelsize + dim[0] / 2.0
+            Ycam = detectordistance * Qz / Qy / pixelsize + dim[1] / 2.0
+        elif kf_direction == "X>0":
+            tokeep = (np.any(oncam_HKL != 0, axis=1)) & (Qx < 0) & (XplusR > 0)
+            defined = tokeep
+            abskx = np.abs(XplusR)
+            Xcam = -detectordistance * Qy / abskx / pixelsize + dim[0] / 2.0
+            Ycam = -detectordistance * Qz / abskx / pixelsize + dim[1] / 2.0
+        elif kf_direction == "X<0":
+            defined = Qx < 0
+            abskx = np.abs(XplusR)
+            Xcam = detectordistance * Qy / abskx / pixelsize + dim[0] / 2.0
+            Ycam = detectordistance * Qz / abskx / pixelsize + dim[1] / 2.0
+        else:  # '4PI' or [2theta, chi] direction: no camera position
+            defined = tokeep
+
+        normkout = np.sqrt(XplusR ** 2 + Qy ** 2 + Qz ** 2)
+        Twicetheta = np.arccos(XplusR / normkout) / DEG
+        Chi = np.arctan2(Qy * 1.0, Qz) / DEG
+
+    undefined = np.logical_not(defined)
+    Twicetheta[undefined] = np.nan
+    Chi[undefined] = np.nan
+    Xcam[undefined] = np.nan
+    Ycam[undefined] = np.nan
+
+    data = np.zeros(np.count_nonzero(tokeep), dtype=SPOTS_DTYPE)
+    data["Millers"] = oncam_HKL[tokeep]
+    data["Qxyz"] = oncam_vec[tokeep]
+    data["EwaldRadius"] = Rewald[tokeep]
+    data["Energy"] = Rewald[tokeep] * CST_ENERGYKEV
+    data["Twicetheta"] = Twicetheta[tokeep]
+    data["Chi"] = Chi[tokeep]
+    data["Xcam"] = Xcam[tokeep]
+    data["Ycam"] = Ycam[tokeep]
+    data["grainindex"] = grainindex
+
+    return SpotsTable(data)
+
+
 def get2ThetaChi_geometry_full_np(oncam_vec, oncam_HKL, detectordistance=DEFAULT_DETECTOR_DISTANCE,
                                                                 pixelsize=165.0 / 2048,
                                                                 dim=(2048, 2048),
@@ -1547,21 +2106,25 @@ def get2ThetaChi_geometry_full_np(oncam_vec, oncam_HKL, detectordistance=DEFAULT
 
 def RemoveHarmonics(listspot):
     r"""
-    removes harmonics present in listspot (list of objects of spot class)
+    removes harmonics present in listspot (SpotsTable or list of objects of spot class)
+
+    spots are grouped by primitive Miller indices (hkl/gcd(h,k,l), sign is kept)
+    and only the fundamental (lowest harmonic order, i.e. lowest energy) is kept
 
-    .. todo:: NOT USED ANYMORE!
+    :return: SpotsTable or list of spots (same type as input), initial order is preserved
     """
-    _invdict = {}
+    if len(listspot) < 2:
+        return listspot
 
-    # print "len after sorting wtih respect to __hash__()",len(sorted(listspot, reverse = True))
-    for elem in sorted(listspot, reverse=True):
-        # print "elem, elem.__hash__()",elem.Millers, elem.__hash__()
+    if isinstance(listspot, SpotsTable):
+        tokeep, _ = CP.getHarmonicsIndices(listspot.Millers)
+        return listspot[tokeep]
 
-        _invdict[elem.__hash__()] = elem
-        _oncamsansh = [_invdict[cle] for cle in list(_invdict.keys())]
+    Millers = np.array([elem.Millers for elem in listspot])
+    tokeep, _ = CP.getHarmonicsIndices(Millers)
 
     # print "Number of fundamental spots (RS directions): %d"%len(_oncamsansh)
-    return _oncamsansh
+    return [listspot[index] for index in tokeep]
 
 
 def calcSpots_fromHKLlist(UB, B0, HKL, dictCCD):
@@ -1652,7 +2215,8 @@ def SimulateLaue_merge(
     pixelsize=165 / 2048.0,
     dim=(2048, 2048),
     detectordiameter=None,
-    dictmaterials=dict_Materials):
+    dictmaterials=dict_Materials,
+    nbprocesses=1):
     r"""
     Simulates Laue pattern full data from a list of grains and concatenate results data
 
@@ -1665,6 +2229,12 @@ def SimulateLaue_merge(
     :param output_nb_spots: * True, output a second element (in addition to data)
                             with list of partial nb of spots per grain
                             (to know the grain origin of spots)
+
+    :param nbprocesses: nb of processes simulating grains in parallel (only_2thetachi=False)
+
+    .. note:: for a very large nb of grains, use SimulateLaue_stream(),
+        SimulateLaue_merge_tofile() or SimulateLaue_merge_toimage() whose memory
+        does not depend on the nb of grains
     """
     # use SimulateLaue
     if not only_2thetachi:
@@ -1674,31 +2244,27 @@ def SimulateLaue_merge(
         All_posx = []
         All_posy = []
         All_Energy = []
-        All_nb_spots = []
-
-        for grain in grains:
-            (Twicetheta, Chi, Miller_ind, posx, posy, Energy) = SimulateLaue(
-                grain,
-                emin,
-                emax,
-                detectorparameters,
-                kf_direction=kf_direction,
-                ResolutionAngstrom=ResolutionAngstrom,
-                removeharmonics=removeharmonics,
-                pixelsize=pixelsize,
-                dim=dim,
-                detectordiameter=detectordiameter,
-                dictmaterials=dictmaterials)
-
-            nb_spots = len(Twicetheta)
-
+        All_nb_spots = np.zeros(len(grains), dtype=int)
+
+        for (grainindex, Twicetheta, Chi, Miller_ind, posx, posy, Energy
+                            ) in SimulateLaue_stream(grains, emin, emax, detectorparameters,
+                                                    nbprocesses=nbprocesses,
+                                                    kf_direction=kf_direction,
+                                                    ResolutionAngstrom=ResolutionAngstrom,
+                                                    removeharmonics=removeharmonics,
+                                                    pixelsize=pixelsize,
+                                                    dim=dim,
+                                                    detectordiameter=detectordiameter,
+                                                    dictmaterials=dictmaterials):
             All_Twicetheta.append(Twicetheta)
             All_Chi.append(Chi)
             All_Miller_ind.append(Miller_ind)
             All_posx.append(posx)
             All_posy.append(posy)
             All_Energy.append(Energy)
-            All_nb_spots.append(nb_spots)
+            All_nb_spots += np.bincount(grainindex, minlength=len(grains))
+
+        All_nb_spots = All_nb_spots.tolist()
 
         All_Twicetheta = np.concatenate(All_Twicetheta)
         All_Chi = np.concatenate(All_Chi)
@@ -1747,6 +2313,182 @@ def SimulateLaue_merge(
         return toreturn
 
 
+def _simulate_grains_chunk(args):
+    r"""
+    simulate a chunk of grains with SimulateLaue() and concatenate results
+
+    (module level function to be used by a multiprocessing pool in SimulateLaue_stream())
+
+    :param args: (grains, firstgrainindex, emin, emax, detectorparameters, simulkwargs)
+
+    :return: grainindex, Twicetheta, Chi, Miller_ind, posx, posy, Energy (flat arrays)
+    """
+    grains, firstgrainindex, emin, emax, detectorparameters, simulkwargs = args
+
+    list_results = []
+    list_grainindex = []
+    for grainindex, grain in enumerate(grains, firstgrainindex):
+        res = SimulateLaue(grain, emin, emax, detectorparameters, **simulkwargs)
+        list_results.append([np.asarray(elem) for elem in res])
+        list_grainindex.append(np.full(len(res[0]), grainindex, dtype=np.int32))
+
+    if not list_results:
+        return (np.zeros(0, dtype=np.int32), np.zeros(0), np.zeros(0),
+                np.zeros((0, 3), dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0))
+
+    Twicetheta, Chi, Miller_ind, posx, posy, Energy = [
+        np.concatenate([res[k] for res in list_results]) for k in range(6)]
+    Miller_ind = Miller_ind.reshape((-1, 3))
+
+    return np.concatenate(list_grainindex), Twicetheta, Chi, Miller_ind, posx, posy, Energy
+
+
+def SimulateLaue_stream(grains, emin, emax, detectorparameters, chunksize=STREAM_CHUNKSIZE,
+                                                                nbprocesses=1,
+                                                                kf_direction=DEFAULT_TOP_GEOMETRY,
+                                                                ResolutionAngstrom=False,
+                                                                removeharmonics=0,
+                                                                pixelsize=165 / 2048.0,
+                                                                dim=(2048, 2048),
+                                                                detectordiameter=None,
+                                                                dictmaterials=dict_Materials):
+    r"""
+    Simulates Laue pattern full data from a (possibly very long) sequence of grains
+    by chunks of grains. Generator yielding the data of each chunk.
+
+    Memory only depends on chunksize and nbprocesses (not on the total nb of grains).
+    grains can be a generator of grain parameters.
+
+    :param grains: iterable of 4 elements grain parameters (as in SimulateLaue())
+    :param chunksize: nb of grains simulated at once
+    :param nbprocesses: nb of processes of the pool simulating chunks in parallel
+        (1: no multiprocessing)
+
+    :return: generator yielding for each chunk the tuple
+        (grainindex, Twicetheta, Chi, Miller_ind, posx, posy, Energy)
+        of flat arrays (grainindex is the index of the grain in grains)
+
+    .. note:: chunks are yielded in grains order whatever nbprocesses
+    """
+    simulkwargs = {"kf_direction": kf_direction,
+                    "ResolutionAngstrom": ResolutionAngstrom,
+                    "removeharmonics": removeharmonics,
+                    "pixelsize": pixelsize,
+                    "dim": dim,
+                    "detectordiameter": detectordiameter,
+                    "dictmaterials": dictmaterials}
+
+    chunksize = max(int(chunksize), 1)
+    nbprocesses = max(int(nbprocesses), 1)
+
+    def chunksargs():
+        grainsiterator = iter(grains)
+        firstgrainindex = 0
+        while True:
+            chunk = list(itertools.islice(grainsiterator, chunksize))
+            if not chunk:
+                return
+            yield chunk, firstgrainindex, emin, emax, detectorparameters, simulkwargs
+            firstgrainindex += len(chunk)
+
+    if nbprocesses == 1:
+        for args in chunksargs():
+            yield _simulate_grains_chunk(args)
+        return
+
+    pool = multiprocessing.Pool(nbprocesses)
+    try:
+        allchunksargs = chunksargs()
+        while True:
+            # at most nbprocesses chunks are simulated (and stored) at once
+            wave = list(itertools.islice(allchunksargs, nbprocesses))
+            if not wave:
+                break
+            for res in pool.map(_simulate_grains_chunk, wave):
+                yield res
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def SimulateLaue_merge_tofile(grains, emin, emax, detectorparameters, outputfilename,
+                                                                    chunksize=STREAM_CHUNKSIZE,
+                                                                    nbprocesses=1,
+                                                                    **simulkwargs):
+    r"""
+    Simulates Laue pattern of a (possibly very large) set of grains and writes incrementally
+    all spots in a single column text file (one line per spot)
+
+    columns: grainindex, h, k, l, Energy (keV), 2theta (deg), chi (deg), Xcam, Ycam
+
+    :param grains: iterable of 4 elements grain parameters (as in SimulateLaue())
+    :param outputfilename: full path of output file
+    :param chunksize: nb of grains simulated at once
+    :param nbprocesses: nb of processes of the pool simulating chunks in parallel
+    :param simulkwargs: other simulation parameters of SimulateLaue_stream()
+
+    :return: total nb of spots, nb of grains
+    """
+    nbspots = 0
+    # nb of grains taken from grains iterable (grains without spot are counted)
+    nbgrains = [0]
+
+    def countedgrains():
+        for grain in grains:
+            nbgrains[0] += 1
+            yield grain
+
+    with open(outputfilename, "w") as f:
+        f.write("# grainindex h k l Energy 2theta chi Xcam Ycam\n")
+        for (grainindex, Twicetheta, Chi, Miller_ind, posx, posy, Energy
+                            ) in SimulateLaue_stream(countedgrains(), emin, emax, detectorparameters,
+                                                    chunksize=chunksize,
+                                                    nbprocesses=nbprocesses,
+                                                    **simulkwargs):
+            if len(grainindex):
+                data = np.column_stack((grainindex, Miller_ind, Energy, Twicetheta, Chi,
+                                        posx, posy))
+                np.savetxt(f, data, fmt=["%d"] * 4 + ["%.6f"] * 5)
+                nbspots += len(grainindex)
+
+    return nbspots, nbgrains[0]
+
+
+def SimulateLaue_merge_toimage(grains, emin, emax, detectorparameters, image=None,
+                                                                chunksize=STREAM_CHUNKSIZE,
+                                                                nbprocesses=1,
+                                                                dim=(2048, 2048),
+                                                                **simulkwargs):
+    r"""
+    Simulates Laue pattern of a (possibly very large) set of grains and accumulates
+    incrementally the spots in a 2D image (each spot adds 1 to the pixel of its position)
+
+    :param grains: iterable of 4 elements grain parameters (as in SimulateLaue())
+    :param image: 2D array (shape = dim[1], dim[0]) to be incremented
+        (can be a numpy.memmap to keep the image on disk). None to create a new image
+    :param chunksize: nb of grains simulated at once
+    :param nbprocesses: nb of processes of the pool simulating chunks in parallel
+    :param simulkwargs: other simulation parameters of SimulateLaue_stream()
+
+    :return: image (array with shape (dim[1], dim[0]) with image[Y, X] = nb of spots)
+    """
+    if image is None:
+        image = np.zeros((dim[1], dim[0]), dtype=np.uint32)
+
+    for res in SimulateLaue_stream(grains, emin, emax, detectorparameters,
+                                                    chunksize=chunksize,
+                                                    nbprocesses=nbprocesses,
+                                                    dim=dim,
+                                                    **simulkwargs):
+        posx, posy = res[4:6]
+        X = np.round(posx).astype(np.int64)
+        Y = np.round(posy).astype(np.int64)
+        inframe = (X >= 0) & (X < image.shape[1]) & (Y >= 0) & (Y < image.shape[0])
+        np.add.at(image, (Y[inframe], X[inframe]), 1)
+
+    return image
+
+
 def SimulateLaue_twins(grainparent, twins_operators, emin, emax, detectorparameters,
                                                                 only_2thetachi=True,
                                                                 output_nb_spots=False,
@@ -1756,37 +2498,85 @@ def SimulateLaue_twins(grainparent, twins_operators, emin, emax, detectorparamet
                                                                 pixelsize=165 / 2048.0,
                                                                 dim=(2048, 2048),
                                                                 detectordiameter=None,
-                                                                dictmaterials=dict_Materials):
+                                                                dictmaterials=dict_Materials,
+                                                                output_variants=False):
     r"""
     Simulates Laue pattern full data for twinned grain
 
+    Parent grain and all its variants (U * twin_op) share the same B matrix: a single set of
+    hkl nodes is generated and all orientation matrices are simulated as a stacked batch
+    (see SimulateLaue_batch())
+
     :param grainparent: list of 4 elements grain parameter
 
     :param twins_operators: list of 3*3 matrices corresponding of Matrices
+        (e.g. indexingSpotsSet.get4sigma3Matrices(np.eye(3)) for the 4 sigma3 twins)
+
+    :param only_2thetachi: * True, return only concatenated 2theta and chi,
+                           * False, return All_Twicetheta, All_Chi, All_Miller_ind,
+                                    All_posx, All_posy, All_Energy
 
     :param output_nb_spots: True, output a second element with list of partial nb of spots per grain
 
+    :param output_variants: True, output a last element: array of variant index of each spot
+                            (0 for parent grain, i for twins_operators[i-1])
+
     .. note:: USED in test only in detectorCalibration...simulate_theo  to simulate 2 twinned crystals
     """
-    # nb_twins = len(twins_operators)
-
-    Bmat, dilat, Umat, extinction = grainparent
+    key_material = grainparent[3]
+    Umat = grainparent[2]
+
+    # parent grain then twins
+    OrientMatrices = [Umat] + [np.dot(Umat, twin_op) for twin_op in twins_operators]
+    nb_variants = len(OrientMatrices)
+
+    grains = [CP.Prepare_Grain(key_material, mat, dictmaterials=dictmaterials)
+                                                            for mat in OrientMatrices]
+    Bmatrix, Extinc = grains[0][:2]
+    OrientMatrices = np.array([grain[2] for grain in grains], dtype=np.float64)
+
+    if only_2thetachi and detectordiameter is not None:
+        # as in SimulateResult()
+        detectordiameter = detectordiameter * 1.2
+
+    (Twicetheta, Chi, Miller_ind, posx, posy, Energy, offsets) = SimulateLaue_batch(
+                                                        OrientMatrices,
+                                                        Bmatrix,
+                                                        Extinc,
+                                                        emin,
+                                                        emax,
+                                                        detectorparameters,
+                                                        kf_direction=kf_direction,
+                                                        ResolutionAngstrom=ResolutionAngstrom,
+                                                        pixelsize=pixelsize,
+                                                        dim=dim,
+                                                        detectordiameter=detectordiameter)
+
+    variants = np.repeat(np.arange(nb_variants), np.diff(offsets))
 
-    grains = [grainparent]
+    if removeharmonics:
+        tokeep = np.zeros(len(variants), dtype=bool)
+        for variant_index in list(range(nb_variants)):
+            fundamentals, _ = CP.getHarmonicsIndices(
+                                Miller_ind[offsets[variant_index]:offsets[variant_index + 1]])
+            tokeep[fundamentals + offsets[variant_index]] = True
+
+        Twicetheta, Chi, Miller_ind = Twicetheta[tokeep], Chi[tokeep], Miller_ind[tokeep]
+        posx, posy, Energy = posx[tokeep], posy[tokeep], Energy[tokeep]
+        variants = variants[tokeep]
+
+    if only_2thetachi:
+        toreturn = (Twicetheta, Chi)
+    else:
+        toreturn = (Twicetheta, Chi, Miller_ind, posx, posy, Energy)
 
-    for _, twin_op in enumerate(twins_operators):
-        twinUmat = np.dot(Umat, twin_op)
-        grains.append([Bmat, dilat, twinUmat, extinction])
+    if output_variants:
+        toreturn = toreturn + (variants,)
 
-    return SimulateLaue_merge(grains, emin, emax, detectorparameters, only_2thetachi=only_2thetachi,
-                                                            output_nb_spots=output_nb_spots,
-                                                            kf_direction=kf_direction,
-                                                            ResolutionAngstrom=ResolutionAngstrom,
-                                                            removeharmonics=removeharmonics,
-                                                            pixelsize=pixelsize,
-                                                            dim=dim,
-                                                            detectordiameter=detectordiameter,
-                                                            dictmaterials=dictmaterials)
+    if output_nb_spots:
+        return toreturn, np.bincount(variants, minlength=nb_variants).tolist()
+    else:
+        return toreturn
 
 
 def SimulateLaue(grain, emin, emax, detectorparameters, kf_direction=DEFAULT_TOP_GEOMETRY,
@@ -1844,7 +2634,9 @@ def SimulateLaue(grain, emin, emax, detectorparameters, kf_direction=DEFAULT_TOP
                             verbose=0,
                             kf_direction=kf_direction,
                             ResolutionAngstrom=ResolutionAngstrom,
-                            dictmaterials=dictmaterials)
+                            dictmaterials=dictmaterials,
+                            detectordistance=detectorparameters[0],
+                            detectordiameter=DETECTORDIAMETER)
 
     #     print "len Spots2pi", len(Spots2pi[0][0])
 
@@ -1858,12 +2650,15 @@ def SimulateLaue(grain, emin, emax, detectorparameters, kf_direction=DEFAULT_TOP
                                             HarmonicsRemoval=removeharmonics,
                                             pixelsize=pixelsize)
 
-    ListofSpots = ListofListofSpots[0]
+    if ListofListofSpots is None:  # no spot on camera
+        ListofSpots = SpotsTable()
+    else:
+        ListofSpots = ListofListofSpots[0]
 
-    Twicetheta = np.array([spot.Twicetheta for spot in ListofSpots])
-    Chi = np.array([spot.Chi for spot in ListofSpots])
-    Miller_ind = np.array([list(spot.Millers) for spot in ListofSpots])
-    Energy = np.array([spot.EwaldRadius * CST_ENERGYKEV for spot in ListofSpots])
+    Twicetheta = ListofSpots.Twicetheta
+    Chi = ListofSpots.Chi
+    Miller_ind = ListofSpots.Millers
+    Energy = ListofSpots.Energy
 
     posx, posy = LTGeo.calc_xycam_from2thetachi(Twicetheta,
                                                 Chi,
@@ -1923,7 +2718,9 @@ def SimulateLaue_full_np(grain, emin, emax, detectorparameters, kf_direction=DEF
                             verbose=0,
                             kf_direction=kf_direction,
                             ResolutionAngstrom=ResolutionAngstrom,
-                            dictmaterials=dictmaterials)
+                            dictmaterials=dictmaterials,
+                            detectordistance=detectorparameters[0],
+                            detectordiameter=DETECTORDIAMETER)
 
     #     print "Qxyz", Qxyz
     #     print "HKL", HKL
@@ -1972,6 +2769,248 @@ def SimulateLaue_full_np(grain, emin, emax, detectorparameters, kf_direction=DEF
         return Twicetheta, Chi, Miller_ind, posx, posy, Energy
 
 
+# --- -----------------  Batched simulation of many orientations
+def getHKLlimits_batch(UBmatrices, wavelmin, ResolutionAngstrom=False):
+    r"""
+    return Miller indices limits common to a stack of UB matrices (UB = OrientMatrix * B)
+
+    Since h = (UB^-1)[0] . q with \|q\| <= 2 / wavelmin (diameter of the largest Ewald sphere),
+    the limits do not depend on the sample orientation beyond the norms of the rows of UB^-1.
+
+    :param UBmatrices: stack of matrices UB (each one multiplies hkl to give q in lab. frame)
+    :type UBmatrices: array with shape (N, 3, 3)
+    :param wavelmin: smallest wavelength in Angstrom
+    :param ResolutionAngstrom: False or smallest interplanar distance in Angstrom
+
+    :return: [[hmin,hmax],[kmin,kmax],[lmin,lmax]] (to be used as python range limits)
+    """
+    qmax = 2.0 / wavelmin
+    if ResolutionAngstrom:
+        qmax = min(qmax, 1.0 / ResolutionAngstrom)
+
+    invUBs = np.linalg.inv(np.asarray(UBmatrices, dtype=np.float64))
+    # largest norm of each row of UB^-1 over all matrices
+    rownorms = np.amax(np.sqrt(np.sum(invUBs ** 2, axis=2)), axis=0)
+    hklmax = np.ceil(rownorms * qmax).astype(int) + 1
+
+    return [[-int(nmax), int(nmax) + 1] for nmax in hklmax]
+
+
+def get_kf_condition(Qx, Qy, Qz, Qsquare, kf_direction=DEFAULT_TOP_GEOMETRY,
+                                                    OpeningAngleCollection=22.0):
+    r"""
+    return boolean array of q vectors (with Qx < 0) whose scattered beam kf is in
+    the region defined by kf_direction (see getLaueSpots())
+    """
+    if kf_direction == "Z>0":
+        return Qz > 0.0
+    elif kf_direction == "Y>0":
+        return Qy > 0
+    elif kf_direction == "Y<0":
+        return Qy < 0
+    elif kf_direction == "X>0":
+        return Qx + 1.0 / (2.0 * np.abs(Qx) / Qsquare) > 0
+    elif kf_direction == "X<0":
+        return Qx + 1.0 / (2.0 * np.abs(Qx) / Qsquare) < 0
+    elif kf_direction == "4PI":
+        return np.ones(len(Qx), dtype=bool)
+    elif isinstance(kf_direction, (builtins.list, np.ndarray)):
+        if len(kf_direction) != 2:
+            raise ValueError("kf_direction must be defined by a list of two angles !")
+        kf_2theta, kf_chi = kf_direction
+        kf_2theta, kf_chi = kf_2theta * DEG, kf_chi * DEG
+        Rewald = Qsquare / (2 * np.fabs(Qx))
+        return (np.arccos(((Qx + Rewald) * np.cos(kf_2theta)
+                            + Qy * np.sin(kf_2theta) * np.sin(kf_chi)
+                            + Qz * np.sin(kf_2theta) * np.cos(kf_chi)) / Rewald)
+                < OpeningAngleCollection * DEG)
+    else:
+        raise ValueError("kf_direction '%s' is not understood!" % str(kf_direction))
+
+
+def get_oncamera_condition(Qx, Qy, Qz, Rewald, detectordistance, detectordiameter,
+                                                    kf_direction=DEFAULT_TOP_GEOMETRY):
+    r"""
+    return boolean array of q vectors whose scattered beam hits a detector of diameter
+    detectordiameter placed at detectordistance in the geometry given by kf_direction
+
+    same selection as in filterLaueSpots() and filterLaueSpots_full_np()
+    """
+    if kf_direction == "Z>0":
+        ratiod = detectordistance / Qz
+        Ycam = ratiod * (Qx + Rewald)
+        Xcam = ratiod * Qy
+    elif kf_direction == "Y>0":
+        ratiod = detectordistance / Qy
+        Xcam = ratiod * (Qx + Rewald)
+        Ycam = ratiod * Qz
+    elif kf_direction == "Y<0":
+        ratiod = detectordistance / np.abs(Qy)
+        Xcam = -ratiod * (Qx + Rewald)
+        Ycam = ratiod * Qz
+    elif kf_direction == "X>0":
+        ratiod = detectordistance / np.abs(Qx + Rewald)
+        Xcam = -1.0 * ratiod * Qy
+        Ycam = -ratiod * Qz
+    elif kf_direction == "X<0":
+        ratiod = detectordistance / np.abs(Qx + Rewald)
+        Xcam = ratiod * Qy
+        Ycam = ratiod * Qz
+    elif kf_direction == "4PI" or isinstance(kf_direction, (builtins.list, np.ndarray)):
+        return np.ones(len(Qx), dtype=bool)
+    else:
+        raise ValueError("Unknown laue geometry code for kf_direction parameter")
+
+    return Xcam ** 2 + Ycam ** 2 <= (detectordiameter / 2.0) ** 2
+
+
+def getLaueSpots_batch(wavelmin, wavelmax, Bmatrix, Extinc, OrientMatrices,
+                                            kf_direction=DEFAULT_TOP_GEOMETRY,
+                                            OpeningAngleCollection=22.0,
+                                            ResolutionAngstrom=False,
+                                            detectordistance=DEFAULT_DETECTOR_DISTANCE,
+                                            detectordiameter=DEFAULT_DETECTOR_DIAMETER,
+                                            maxnodes=BATCH_MAXNODES):
+    r"""
+    Compute q vectors and Miller indices of Laue spots collected on camera for a stack of
+    orientation matrices sharing the same B matrix and extinction rules
+
+    A single set of hkl nodes is generated for all orientations and q vectors are computed
+    with stacked numpy operations by chunks of orientation matrices whose number of
+    (matrix, node) pairs is at most maxnodes.
+
+    :param wavelmin:   smallest wavelength in Angstrom
+    :param wavelmax:  largest wavelength in Angstrom
+    :param Bmatrix: B matrix (a*,b*,c* vectors in column in LaueTools frame)
+    :param Extinc: label for extinction rules ('no','fcc','dia', etc...)
+    :param OrientMatrices: orientation matrices
+    :type OrientMatrices: array with shape (N, 3, 3)
+
+    :return: Qxyz (M,3) array, HKL (M,3) array, offsets (N+1) array such as spots of
+        orientation matrix i are Qxyz[offsets[i]:offsets[i+1]]
+    """
+    if not 0 < wavelmin < wavelmax:
+        raise ValueError("wavelengthes must be positive and ordered")
+
+    OrientMatrices = np.asarray(OrientMatrices, dtype=np.float64)
+    if OrientMatrices.ndim == 2:
+        OrientMatrices = OrientMatrices.reshape((1, 3, 3))
+    if OrientMatrices.shape[1:] != (3, 3):
+        raise ValueError("OrientMatrices must be a stack of 3*3 matrices")
+
+    Bmatrix = np.array(Bmatrix, dtype=np.float64)
+    nb_matrices = len(OrientMatrices)
+
+    cachednodes = None
+    if USE_HKLNODES_CACHE and all(isOrientMatrix_cachable(mat) for mat in OrientMatrices):
+        cachednodes = getHKLnodes_cached(Bmatrix, Extinc, wavelmin, ResolutionAngstrom)
+
+    if cachednodes is not None:
+        table_vec, Bhkl = cachednodes[:2]
+    else:
+        UBs = np.dot(OrientMatrices, Bmatrix)
+        table_vec = genHKL_np(getHKLlimits_batch(UBs, wavelmin, ResolutionAngstrom), Extinc)
+        Bhkl = np.dot(table_vec, Bmatrix.T)
+    nb_nodes = len(table_vec)
+
+    chunksize = max(1, int(maxnodes // max(nb_nodes, 1)))
+
+    list_Q, list_HKL = [], []
+    nbspots = np.zeros(nb_matrices, dtype=int)
+    for start in list(range(0, nb_matrices, chunksize)):
+        # shape (n, nb_nodes, 3)
+        Qs = np.einsum("nij,kj->nki", OrientMatrices[start:start + chunksize], Bhkl)
+        Qsquare = np.sum(Qs ** 2, axis=2)
+        Qx = Qs[:, :, 0]
+
+        # inside the two Ewald's spheres (Qx < 0 implicitly)
+        Condit = np.logical_and((Qx * 2.0 / wavelmin + Qsquare) <= 0.0,
+                                (Qx * 2.0 / wavelmax + Qsquare) > 0.0)
+        if ResolutionAngstrom:
+            Condit = np.logical_and(Condit, Qsquare < (1.0 / ResolutionAngstrom) ** 2)
+
+        mat_ind, node_ind = np.nonzero(Condit)
+        Q = Qs[mat_ind, node_ind]
+        Qsquare = Qsquare[mat_ind, node_ind]
+        Rewald = Qsquare / 2.0 / np.abs(Q[:, 0])
+
+        tokeep = np.logical_and(get_kf_condition(Q[:, 0], Q[:, 1], Q[:, 2], Qsquare,
+                                                kf_direction=kf_direction,
+                                                OpeningAngleCollection=OpeningAngleCollection),
+                                get_oncamera_condition(Q[:, 0], Q[:, 1], Q[:, 2], Rewald,
+                                                detectordistance, detectordiameter,
+                                                kf_direction=kf_direction))
+
+        list_Q.append(Q[tokeep])
+        list_HKL.append(table_vec[node_ind[tokeep]])
+        nbspots[start:start + chunksize] = np.bincount(mat_ind[tokeep], minlength=len(Qs))
+
+    offsets = np.zeros(nb_matrices + 1, dtype=int)
+    offsets[1:] = np.cumsum(nbspots)
+
+    return np.concatenate(list_Q), np.concatenate(list_HKL), offsets
+
+
+def SimulateLaue_batch(OrientMatrices, Bmatrix, Extinc, emin, emax, detectorparameters,
+                                                        kf_direction=DEFAULT_TOP_GEOMETRY,
+                                                        ResolutionAngstrom=False,
+                                                        pixelsize=165 / 2048.0,
+                                                        dim=(2048, 2048),
+                                                        detectordiameter=None,
+                                                        only_2thetachi=False,
+                                                        maxnodes=BATCH_MAXNODES):
+    r"""Compute Laue Pattern spots positions, scattering angles, miller indices and energies
+    for a stack of orientation matrices sharing the same B matrix (batched version of
+    SimulateLaue_full_np() without harmonics removal)
+
+    :param OrientMatrices: orientation matrices
+    :type OrientMatrices: array with shape (N, 3, 3)
+    :param Bmatrix: B matrix (a*,b*,c* vectors in column in LaueTools frame)
+    :param Extinc: label for extinction rules ('no','fcc','dia', etc...)
+    :param emin: minimum bandpass energy (keV)
+    :param emax: maximum bandpass energy (keV)
+    :param detectorparameters: detector calibration parameters [dd, xcen, ycen, xbet, xgam]
+    :param only_2thetachi: True, do not compute spots position on detector
+
+    :return: flat arrays (for all matrices) Twicetheta, Chi, Miller_ind, posx, posy, Energy
+        and offsets (N+1) such as data of orientation matrix i are in slice
+        offsets[i]:offsets[i+1]
+
+        if only_2thetachi is True: Twicetheta, Chi, offsets
+
+    .. note:: Chi is computed with arctan2 as in create_spot_np()
+    """
+    if detectordiameter is None:
+        DETECTORDIAMETER = pixelsize * dim[0]
+    else:
+        DETECTORDIAMETER = detectordiameter
+
+    Qxyz, Miller_ind, offsets = getLaueSpots_batch(CST_ENERGYKEV / emax,
+                                                    CST_ENERGYKEV / emin,
+                                                    Bmatrix,
+                                                    Extinc,
+                                                    OrientMatrices,
+                                                    kf_direction=kf_direction,
+                                                    ResolutionAngstrom=ResolutionAngstrom,
+                                                    detectordistance=detectorparameters[0],
+                                                    detectordiameter=DETECTORDIAMETER,
+                                                    maxnodes=maxnodes)
+
+    Twicetheta, Chi, Energy, Miller_ind = create_spot_np(Qxyz, Miller_ind, detectorparameters[0])
+
+    if only_2thetachi:
+        return Twicetheta, Chi, offsets
+
+    posx, posy = LTGeo.calc_xycam_from2thetachi(Twicetheta,
+                                                Chi,
+                                                detectorparameters,
+                                                verbose=0,
+                                                pixelsize=pixelsize,
+                                                kf_direction=kf_direction)[:2]
+
+    return Twicetheta, Chi, Miller_ind, posx, posy, Energy, offsets
+
+
 def SimulateResult(grain, emin, emax, simulparameters,
                     fastcompute=1, ResolutionAngstrom=False, dictmaterials=dict_Materials):
     r"""Simulates 2theta chi of Laue Pattern spots for ONE SINGLE grain
@@ -2010,7 +3049,9 @@ def SimulateResult(grain, emin, emax, simulparameters,
                             fileOK=0,
                             verbose=0,
                             kf_direction=kf_direction,
-                            dictmaterials=dictmaterials)
+                            dictmaterials=dictmaterials,
+                            detectordistance=detectordistance,
+                            detectordiameter=detectordiameter * 1.2)
     # ---------------------------------------------------------------------------
 
     # array(vec) and array(indices)  of spots exiting the crystal in 2pi steradian
@@ -2087,6 +3128,9 @@ def atomicformfactor(q, element="Ge"):
     elif element == "O":
         p = (3.04850, 13.2771, 2.28680, 5.70110, 1.54630, 0.323900, 0.867000, 32.9089, 0.250800)
 
+    elif element == "Si":
+        p = (6.2915, 2.4386, 3.0353, 32.3337, 1.9891, 0.6785, 1.5410, 81.6937, 1.1407)
+
     val = 0
     for k in list(range(4)):
         val += p[2 * k] * np.exp(-p[2 * k + 1] * (q / 4 / np.pi) ** 2)
@@ -2094,6 +3138,110 @@ def atomicformfactor(q, element="Ge"):
     return val
 
 
+def _structurefactor_diamond(element):
+    def structurefactor(h, k, l, qvector):
+        return atomicformfactor(qvector, element) * StructureFactorCubic(h, k, l)
+    return structurefactor
+
+
+def _structurefactor_UO2(h, k, l, qvector):
+    return StructureFactorUO2(h, k, l, qvector, 0.0, 0.0)
+
+
+# structure factor F(h, k, l, q) of materials for intensities computation
+# (mean square displacements of UO2 atoms are set to 0 i.e. no Debye Waller factor)
+dict_StructureFactorModels = {"Si": _structurefactor_diamond("Si"),
+                            "Ge": _structurefactor_diamond("Ge"),
+                            "UO2": _structurefactor_UO2}
+
+
+def _getStructureFactor2Table(key_material, Bmatrix, hklmax):
+    r"""
+    return |F|**2 for all h, k, l in [-hklmax, hklmax] (3D array indexed by h+hklmax, k+hklmax,
+    l+hklmax), from LRU cache if available
+    """
+    Bmatrix = np.ascontiguousarray(Bmatrix, dtype=np.float64)
+    key = (key_material, Bmatrix.tobytes(), hklmax)
+    if key in _STRUCTUREFACTOR_CACHE:
+        _STRUCTUREFACTOR_CACHE.move_to_end(key)
+        return _STRUCTUREFACTOR_CACHE[key]
+
+    n = 2 * hklmax + 1
+    hkl = np.indices((n, n, n)).reshape((3, -1)) - hklmax
+    h, k, l = hkl
+    qvector = 2 * np.pi * np.sqrt(np.sum(np.dot(Bmatrix, hkl) ** 2, axis=0))
+    F = dict_StructureFactorModels[key_material](h, k, l, qvector)
+    table = (np.abs(F) ** 2).reshape((n, n, n))
+    table.setflags(write=False)
+
+    _STRUCTUREFACTOR_CACHE[key] = table
+    while len(_STRUCTUREFACTOR_CACHE) > STRUCTUREFACTOR_CACHE_MAXSIZE:
+        _STRUCTUREFACTOR_CACHE.popitem(last=False)
+    return table
+
+
+def clear_StructureFactor_cache():
+    r"""
+    remove all tables of structure factors from cache
+    """
+    _STRUCTUREFACTOR_CACHE.clear()
+
+
+def getStructureFactor2(Miller_ind, key_material, Bmatrix=None, dictmaterials=dict_Materials):
+    r"""
+    return square modulus of structure factor of reflections from tabulated values
+
+    Tables of |F|**2 over a cube of hkl are computed once per (material, Bmatrix, hkl range)
+    and kept in a LRU cache (see STRUCTUREFACTOR_CACHE_MAXSIZE).
+
+    :param Miller_ind: array of hkl (shape = (n, 3))
+    :param key_material: material key. If there is no structure factor model for this material
+        in dict_StructureFactorModels, |F|**2 = 1 for all reflections
+    :param Bmatrix: B matrix (a*,b*,c* in columns) used to compute q. None: B matrix of
+        key_material in dictmaterials
+
+    :return: array of |F|**2 (n elements)
+    """
+    Miller_ind = np.asarray(Miller_ind).reshape((-1, 3))
+    if key_material not in dict_StructureFactorModels:
+        return np.ones(len(Miller_ind))
+    if len(Miller_ind) == 0:
+        return np.zeros(0)
+
+    if Bmatrix is None:
+        Bmatrix = CP.Prepare_Grain(key_material, np.eye(3), dictmaterials=dictmaterials)[0]
+
+    hkl = np.round(Miller_ind).astype(np.int64)
+    # hkl range rounded up to share tables between calls
+    hklmax = int(np.abs(hkl).max())
+    hklmax = max(STRUCTUREFACTOR_HKLSTEP * int(np.ceil(hklmax / STRUCTUREFACTOR_HKLSTEP)),
+                STRUCTUREFACTOR_HKLSTEP)
+
+    table = _getStructureFactor2Table(key_material, Bmatrix, hklmax)
+    h, k, l = (hkl + hklmax).T
+    return table[h, k, l]
+
+
+def getSpotsIntensity(Miller_ind, Energy, key_material, Bmatrix=None, spectrum=None,
+                                                                    dictmaterials=dict_Materials):
+    r"""
+    return simulated intensity of Laue spots: |F(hkl)|**2 * spectrum(Energy)
+
+    :param Miller_ind: array of hkl (shape = (n, 3))
+    :param Energy: array of spots energy (keV)
+    :param key_material: material key (see getStructureFactor2())
+    :param spectrum: None for flat spectrum, or (energies, weights) two arrays tabulating the
+        incoming beam spectrum (linearly interpolated)
+
+    :return: array of intensities (n elements)
+    """
+    F2 = getStructureFactor2(Miller_ind, key_material, Bmatrix=Bmatrix, dictmaterials=dictmaterials)
+    if spectrum is None:
+        return F2
+    energies, weights = spectrum
+    return F2 * np.interp(Energy, energies, weights, left=0.0, right=0.0)
+
+
 def simulatepurepattern_np(grain, emin, emax, kf_direction, data_filename, PlotLaueDiagram=1,
                                                         Plot_Data=0,
                                                         verbose=0,
@@ -694,7 +694,9 @@ def Angular_residues_np(test_Matrix, twicetheta_data, chi_data, ang_tol=0.5,
                                     verbose=0,
                                     kf_direction=kf_direction,
                                     ResolutionAngstrom=ResolutionAngstrom,
-                                    dictmaterials=dictmaterials)
+                                    dictmaterials=dictmaterials,
+                                    detectordistance=detectordistance,
+                                    detectordiameter=detectordiameter)
 
     if not SCIKITLEARN or not onlyXYZ:
         # 2theta,chi of spot which are on camera (with harmonics)
@@ -803,7 +805,9 @@ def Angular_residues_np_multimatrices(ListMatrices, twicetheta_data, chi_data, a
                                     verbose=0,
                                     kf_direction=kf_direction,
                                     ResolutionAngstrom=ResolutionAngstrom,
-                                    dictmaterials=dictmaterials)
+                                    dictmaterials=dictmaterials,
+                                    detectordistance=detectordistance,
+                                    detectordiameter=detectordiameter)
 
         # 2theta,chi of spot which are on camera (with harmonics)
         # None because no need of hkl vectors
@@ -831,6 +835,131 @@ def Angular_residues_np_multimatrices(ListMatrices, twicetheta_data, chi_data, a
                                     proxtable=0)
 
 
+def Angular_residues_np_batch(ListMatrices, twicetheta_data, chi_data, ang_tol=0.5,
+                                                                key_material="Si",
+                                                                emin=5,
+                                                                emax=25,
+                                                                ResolutionAngstrom=False,
+                                                                detectorparameters=None,
+                                                                dictmaterials=dict_Materials):
+    r"""
+    Computes angular residues as Angular_residues_np() for a list of orientation matrices
+    whose Laue patterns are simulated at once by lauecore.SimulateLaue_batch()
+
+    :return: list of results of getProximity() (or None if no spot is simulated)
+        for each orientation matrix of ListMatrices
+    """
+    if detectorparameters is None:
+        # use default parameter
+        kf_direction = "Z>0"
+        detectordistance = 70.0
+        detectordiameter = 165.0
+        pixelsize = 165.0 / 2048
+        dim = (2048, 2048)
+    else:
+        kf_direction = detectorparameters["kf_direction"]
+        detectordistance = detectorparameters["detectorparameters"][0]
+        detectordiameter = detectorparameters["detectordiameter"]
+        pixelsize = detectorparameters["pixelsize"]
+        dim = detectorparameters["dim"]
+
+    if len(ListMatrices) == 0:
+        return []
+
+    # B matrix and extinction rules are common to all matrices
+    Bmatrix, Extinc = CP.Prepare_Grain(key_material, ListMatrices[0],
+                                        dictmaterials=dictmaterials)[:2]
+
+    Twicetheta, Chi, offsets = LAUE.SimulateLaue_batch(ListMatrices, Bmatrix, Extinc, emin, emax,
+                                                        [detectordistance],
+                                                        kf_direction=kf_direction,
+                                                        ResolutionAngstrom=ResolutionAngstrom,
+                                                        pixelsize=pixelsize,
+                                                        dim=dim,
+                                                        detectordiameter=detectordiameter,
+                                                        only_2thetachi=True)
+
+    list_AngRes = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        if start == end:
+            list_AngRes.append(None)
+            continue
+        list_AngRes.append(getProximity((Twicetheta[start:end], Chi[start:end]),
+                                        twicetheta_data / 2.0, chi_data,
+                                        angtol=ang_tol,
+                                        proxtable=0))
+    return list_AngRes
+
+
+def IntensityWeighted_MatchingRates(ListMatrices, twicetheta_data, chi_data, ang_tol=0.5,
+                                                                key_material="Si",
+                                                                emin=5,
+                                                                emax=25,
+                                                                ResolutionAngstrom=False,
+                                                                detectorparameters=None,
+                                                                spectrum=None,
+                                                                dictmaterials=dict_Materials):
+    r"""
+    Computes for each orientation matrix the intensity weighted matching rate, i.e. the
+    percentage of the total simulated intensity carried by simulated spots which are closer
+    than ang_tol to an experimental spot.
+
+    Simulated intensities are |F(hkl)|**2 * spectrum(Energy) taken from tabulated and cached
+    structure factors (see lauecore.getSpotsIntensity()).
+
+    :param detectorparameters: dictionary of detector parameters as in Angular_residues_np()
+    :param spectrum: None for flat spectrum, or (energies, weights) tabulated incoming spectrum
+
+    :return: list of matching rates (or None if no spot is simulated) for each orientation matrix
+    """
+    if detectorparameters is None:
+        # use default parameter
+        kf_direction = "Z>0"
+        detectordistance = 70.0
+        detectordiameter = 165.0
+    else:
+        kf_direction = detectorparameters["kf_direction"]
+        detectordistance = detectorparameters["detectorparameters"][0]
+        detectordiameter = detectorparameters["detectordiameter"]
+
+    if len(ListMatrices) == 0:
+        return []
+
+    # B matrix and extinction rules are common to all matrices
+    Bmatrix, Extinc = CP.Prepare_Grain(key_material, ListMatrices[0],
+                                        dictmaterials=dictmaterials)[:2]
+
+    Qxyz, Miller_ind, offsets = LAUE.getLaueSpots_batch(CST_ENERGYKEV / emax,
+                                                        CST_ENERGYKEV / emin,
+                                                        Bmatrix,
+                                                        Extinc,
+                                                        ListMatrices,
+                                                        kf_direction=kf_direction,
+                                                        ResolutionAngstrom=ResolutionAngstrom,
+                                                        detectordistance=detectordistance,
+                                                        detectordiameter=detectordiameter)
+
+    Twicetheta, Chi, Energy, Miller_ind = LAUE.create_spot_np(Qxyz, Miller_ind, detectordistance)
+
+    Intensity = LAUE.getSpotsIntensity(Miller_ind, Energy, key_material, Bmatrix=Bmatrix,
+                                                                        spectrum=spectrum)
+
+    exp_data = array([twicetheta_data / 2.0, chi_data]).T
+
+    list_rates = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        totalintensity = np.sum(Intensity[start:end])
+        if start == end or totalintensity <= 0:
+            list_rates.append(None)
+            continue
+        theo_data = array([Twicetheta[start:end] / 2.0, Chi[start:end]]).T
+        residues = amin(GT.calculdist_from_thetachi(exp_data, theo_data), axis=1)
+        matchedintensity = np.sum(Intensity[start:end][residues < ang_tol])
+        list_rates.append(100.0 * matchedintensity / totalintensity)
+
+    return list_rates
+
+
 def Angular_residues(test_Matrix, twicetheta_data, chi_data, ang_tol=0.5, key_material="Si",
                                 emin=5,
                                 emax=25,
@@ -873,7 +1002,9 @@ def Angular_residues(test_Matrix, twicetheta_data, chi_data, ang_tol=0.5, key_ma
                                     verbose=0,
                                     kf_direction=kf_direction,
                                     ResolutionAngstrom=ResolutionAngstrom,
-                                    dictmaterials=dictmaterials)
+                                    dictmaterials=dictmaterials,
+                                    detectordistance=detectordistance,
+                                    detectordiameter=detectordiameter)
     # 2theta,chi of spot which are on camera (with harmonics)
     TwicethetaChi = LAUE.filterLaueSpots(spots2pi,
                                         fileOK=0,
@@ -460,10 +460,10 @@ def dosimulation_parametric(_list_param, Transform_params=None, SelectGrains=Non
                         # print "ChildGrain_index 900%nb_transforms",ChildGrain_index, gaugecount
 
                     Listspots = Laue_spot_list[0]
-                    twicetheta = [spot.Twicetheta for spot in Listspots]
-                    chi = [spot.Chi for spot in Listspots]
-                    energy = [spot.EwaldRadius * DictLT.CST_ENERGYKEV for spot in Listspots]
-                    Miller_ind = [list(spot.Millers) for spot in Listspots]
+                    twicetheta = Listspots.Twicetheta.tolist()
+                    chi = Listspots.Chi.tolist()
+                    energy = Listspots.Energy.tolist()
+                    Miller_ind = Listspots.Millers.tolist()
 
                     calib = [detectordistance, posCEN[0], posCEN[1], cameraAngles[0], cameraAngles[1]]
 
@@ -511,11 +511,10 @@ def dosimulation_parametric(_list_param, Transform_params=None, SelectGrains=Non
                         wx.Yield()
                         # print "ChildGrain_index 900%nb_transforms",ChildGrain_index, gaugecount
 
-                    twicetheta = [spot.Twicetheta for spot in Laue_spot_list[0]]
-                    chi = [spot.Chi for spot in Laue_spot_list[0]]
-                    energy = [spot.EwaldRadius * DictLT.CST_ENERGYKEV
-                        for spot in Laue_spot_list[0]]
-                    Miller_ind = [list(spot.Millers) for spot in Laue_spot_list[0]]
+                    twicetheta = Laue_spot_list[0].Twicetheta.tolist()
+                    chi = Laue_spot_list[0].Chi.tolist()
+                    energy = Laue_spot_list[0].Energy.tolist()
+                    Miller_ind = Laue_spot_list[0].Millers.tolist()
 
                     calib = [detectordistance, posCEN[0], posCEN[1], cameraAngles[0], cameraAngles[1]]
 
@@ -524,8 +523,8 @@ def dosimulation_parametric(_list_param, Transform_params=None, SelectGrains=Non
                                         kf_direction=kf_direction)[:2]
                     # posx, posy, theta0 = LTGeo.calc_xycam_from2thetachi(twicetheta, chi, calib, pixelsize = self.pixelsize)
 
-                    posx = [spot.Xcam for spot in Laue_spot_list[0]]
-                    posy = [spot.Ycam for spot in Laue_spot_list[0]]
+                    posx = Laue_spot_list[0].Xcam.tolist()
+                    posy = Laue_spot_list[0].Ycam.tolist()
 
                     # vecRR = [
                     #     spot.Qxyz for spot in Laue_spot_list[0]
@@ -576,10 +575,10 @@ def dosimulation_parametric(_list_param, Transform_params=None, SelectGrains=Non
                         wx.Yield()
                         # print "ChildGrain_index 900%nb_transforms",ChildGrain_index, gaugecount
 
-                    twicetheta = [spot.Twicetheta for spot in Laue_spot_list[0]]
-                    chi = [spot.Chi for spot in Laue_spot_list[0]]
-                    energy = [spot.EwaldRadius * DictLT.CST_ENERGYKEV for spot in Laue_spot_list[0]]
-                    Miller_ind = [list(spot.Millers) for spot in Laue_spot_list[0]]
+                    twicetheta = Laue_spot_list[0].Twicetheta.tolist()
+                    chi = Laue_spot_list[0].Chi.tolist()
+                    energy = Laue_spot_list[0].Energy.tolist()
+                    Miller_ind = Laue_spot_list[0].Millers.tolist()
 
                     posx, posy = LTGeo.calc_xycam_from2thetachi(twicetheta, chi, calib,
                                         pixelsize=pixelsize,
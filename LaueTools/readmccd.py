@@ -13,8 +13,14 @@ __author__ = "Jean-Sebastien Micha, CRG-IF BM32 @ ESRF"
 import sys
 import os
 import copy
+import collections
+import itertools
+import concurrent.futures
+import threading
 import time as ttt
 import struct
+import tracemalloc
+import functools
 
 import configparser as CONF
 
@@ -23,6 +29,11 @@ import configparser as CONF
 # import scipy.interpolate as sci
 import scipy.ndimage as ndimage
 import scipy.signal
+try:
+    import scipy.fft as sfft
+except ImportError:
+    # scipy < 1.4: no FFT based convolution in KernelFilter
+    sfft = None
 import scipy.spatial.distance as ssd
 
 try:
@@ -43,6 +54,13 @@ except ImportError:
     print("Missing library libtiff, Please install: pylibtiff if you need open some tiff images")
     LIBTIFF_EXISTS = False
 
+try:
+    import tables as Tab
+
+    TABLES_EXISTS = True
+except ImportError:
+    TABLES_EXISTS = False
+
 try:
     from PIL import Image
 
@@ -61,12 +79,16 @@ if sys.version_info.major == 3:
     from . import generaltools as GT
     from . import IOLaueTools as IOLT
     from . import dict_LaueTools as DictLT
+    from . import spottracking as ST
+    from . import spatialindex as SI
 else:
     import fit2Dintensity as fit2d
     import fit2Dintensity_Lorentz as fit2d_l
     import generaltools as GT
     import IOLaueTools as IOLT
     import dict_LaueTools as DictLT
+    import spottracking as ST
+    import spatialindex as SI
 
 listfile = os.listdir(os.curdir)
 
@@ -109,7 +131,7 @@ def stringint(k, n):
     #     res = '0' * (n - len(strint)) + strint
 
     encodingdigits = "{" + ":0{}".format(int(n)) + "}"
-    res = encodingdigits % k
+    res = encodingdigits.format(k)
 
     return res
 
@@ -125,6 +147,7 @@ def setfilename(imagefilename, imageindex, nbdigits=4, CCDLabel=None):
     :return filename: input filename with index replaced by input imageindex
     :rtype: string
     """
+    resolvePackedStackCCDLabel(CCDLabel)
 
     #     print "imagefilename",imagefilename
     if imagefilename.endswith("mccd"):
@@ -156,7 +179,7 @@ def setfilename(imagefilename, imageindex, nbdigits=4, CCDLabel=None):
                 else:
                     imagefilename = prefix0 + "_{:04d}.{}".format(imageindex, ext)
 
-    elif CCDLabel in ("EIGER_4Mstack",):
+    elif CCDLabel in HDF5STACK_CCDLABELS:
         # only stackimageindex is changed not imagefilename
         pass
 
@@ -223,6 +246,7 @@ def getIndex_fromfilename(imagefilename, nbdigits=4, CCDLabel=None, stackimagein
 
     :return: file index
     """
+    resolvePackedStackCCDLabel(CCDLabel)
     #     print "CCDLabel",CCDLabel
     #     print "imagefilename",imagefilename
 
@@ -246,7 +270,7 @@ def getIndex_fromfilename(imagefilename, nbdigits=4, CCDLabel=None, stackimagein
                 imageindex = int(prefix.split("_")[1])
 
     # for stacked images we return the position of image data in the stack as imagefileindex
-    elif CCDLabel in ("EIGER_4Mstack",):
+    elif CCDLabel in HDF5STACK_CCDLABELS:
         imageindex = stackimageindex
 
     elif imagefilename.endswith("mar.tiff"):
@@ -356,7 +380,7 @@ def readheader(filename, offset=4096, CCDLabel="MARCCD165"):
         offset = filesize - np.prod(framedim) * 2
     f = open(filename, "rb")
     myheader = f.read(offset)
-    myheader.replace("\x00", " ")
+    myheader = myheader.replace(b"\x00", b" ")
 
     f.close()
     return myheader
@@ -375,13 +399,13 @@ def read_header_marccd(filename):
     allsentences = ""
     for _ in list(range(32)):
         tt = f.read(32)
-        s1 = tt.strip("\x00")
+        s1 = tt.strip(b"\x00").decode("latin-1")
         if s1 != "":
             allsentences += s1 + "\n"
         # print posbyte, s1
         posbyte += 32
     tt = f.read(1024)
-    s1 = tt.strip("\x00")
+    s1 = tt.strip(b"\x00").decode("latin-1")
     if s1 != "":
         allsentences += s1 + "\n"
 
@@ -401,7 +425,7 @@ def read_header_marccd2(filename):
     f.seek(3072)
     tt = f.read(512)
     # from beamline designed input
-    dataset_comments = tt.strip("\x00")
+    dataset_comments = tt.strip(b"\x00").decode("latin-1")
 
     f.seek(1024 + 2 * 256 + 128 + 12)
     s = struct.Struct("I I I")
@@ -432,6 +456,9 @@ def read_header_scmos(filename):
 
     dictpar = {}
     strcom = img.tag[270]
+    # tiff tags values are tuples
+    if isinstance(strcom, tuple):
+        strcom = strcom[0]
     si = strcom.index("(")
     fi = strcom.index(")")
     listpar = strcom[si + 1 : fi].split()
@@ -500,7 +527,115 @@ def readoneimage_full(filename, frametype="mccd", dirname=None):
     return pilimage, np.reshape(ravdata, shapeCCD)
 
 
-def readCCDimage(filename, CCDLabel="MARCCD165", dirname=None, stackimageindex=-1, verbose=0):
+# images read in advance during peak search of file series: max nb, max memory (bytes), nb of threads
+PREFETCH_NBIMAGES = 2
+PREFETCH_MAXMEMORY = 2 ** 28
+PREFETCH_NBTHREADS = 2
+
+# hdf5 stacked images: nb of files kept open, min nb of frames read at once (sequential reading),
+# max memory (bytes) of frames blocks cached for all open files, data node path
+HDF5STACK_MAXOPENFILES = 8
+HDF5STACK_PREFETCH = 8
+HDF5STACK_MAXCACHEDMEMORY = 2 ** 27
+HDF5STACK_DATAPATH = "/entry/data/data"
+# CCD labels of frames stacked in hdf5 files (read by HDF5StackReader)
+HDF5STACK_CCDLABELS = ("EIGER_4Mstack", "LaueHDF5stack")
+# CCD labels of image series packed by Lauehdf5.pack_imageseries() are this prefix + CCD label
+# of image files (see registerPackedStackCCDLabel())
+PACKEDSTACK_PREFIX = "LaueHDF5stack_"
+
+# local maxima search by tiles (nbthreads > 1): side length (pixel) of square tiles
+LOCALMAXIMA_TILESIZE = 1024
+
+# seeded peak search of file series: max shift (pixel) of a peak from its seed,
+# nb of frames between two full frame searches, min fraction of seeds still found as peaks
+SEEDEDPEAKSEARCH_MAXSHIFT = 5
+SEEDEDPEAKSEARCH_FULLSEARCHPERIOD = 10
+SEEDEDPEAKSEARCH_MINFRACTION = 0.8
+
+# kernel convolution (KernelFilter): max nb of cached filters, of cached kernel spectra per filter
+KERNELFILTER_MAXITEMS = 16
+KERNELFILTER_MAXFFTSHAPES = 8
+# cost model (ns per pixel) choosing the fastest convolution method:
+# direct: per kernel element, separable: overhead + per 1D kernel element, fft: per log2(nb pixels)
+KERNELFILTER_COST_DIRECT = 1.5
+KERNELFILTER_COST_SEPARABLE = (42.0, 0.66)
+KERNELFILTER_COST_FFT = 1.9
+
+# background images cache: max nb of cached arrays
+BACKGROUNDCACHE_MAXITEMS = 8
+# rolling background: nb of frames between two background estimations, nb of averaged estimations
+ROLLINGBACKGROUND_UPDATEPERIOD = 10
+ROLLINGBACKGROUND_NBESTIMATES = 3
+
+# CCD labels whose image files cannot be mapped in memory (compressed data, hdf5 stack, masked data)
+CCDLABELS_NOT_MEMMAPABLE = ("EIGER_4Mstack", "LaueHDF5stack", "EIGER_4Munstacked", "TIFF Format",
+                            "VHR_PSI", "VHR_DLS", "pnCCD_Tuba")
+# CCD labels (keys of dict_CCD) whose binary data are stored in big endian byte order
+CCDLABELS_BIGENDIAN = ()
+
+
+def registerPackedStackCCDLabel(CCDLabel, framedim=None, pixelsize=None, saturation=None,
+                                                                                dtype=None):
+    r"""
+    register in dict_CCD the CCD label of an image series of CCDLabel detector packed in
+    one hdf5 file (see Lauehdf5.pack_imageseries()) and return it
+
+    Pixel size, saturation value and binary format are those of CCDLabel detector (unless given,
+    e.g. read from packed file attributes by Lauehdf5.get_imageseries_CCDLabel()). Packed frames
+    are already oriented (no geometrical operator) and have no header.
+
+    :param CCDLabel: key of dict_CCD of packed image files
+    :param framedim: frame dimensions in packed file (default: from dict_CCD)
+
+    :return: CCD label (PACKEDSTACK_PREFIX + CCDLabel)
+    """
+    global HDF5STACK_CCDLABELS, CCDLABELS_NOT_MEMMAPABLE
+
+    stacklabel = PACKEDSTACK_PREFIX + CCDLabel
+    ccdframedim, ccdpixelsize, ccdsaturation, fliprot, _, ccddtype = DictLT.dict_CCD[CCDLabel][:6]
+    if framedim is None:
+        framedim = tuple(ccdframedim)
+        # frames rotated by 90 deg by apply_fliprot()
+        if fliprot in ("spe", "vhr", "vhrdiamond"):
+            framedim = (framedim[1], framedim[0])
+
+    DictLT.dict_CCD[stacklabel] = (tuple(int(dim) for dim in framedim),
+                                    ccdpixelsize if pixelsize is None else float(pixelsize),
+                                    ccdsaturation if saturation is None else saturation,
+                                    "no",
+                                    0,
+                                    ccddtype if dtype is None else str(dtype),
+                                    "%s image series packed in one compressed hdf5 file "
+                                    "(see Lauehdf5.pack_imageseries)" % CCDLabel,
+                                    "h5")
+
+    if stacklabel not in HDF5STACK_CCDLABELS:
+        HDF5STACK_CCDLABELS = HDF5STACK_CCDLABELS + (stacklabel,)
+    if stacklabel not in CCDLABELS_NOT_MEMMAPABLE:
+        CCDLABELS_NOT_MEMMAPABLE = CCDLABELS_NOT_MEMMAPABLE + (stacklabel,)
+
+    return stacklabel
+
+
+def resolvePackedStackCCDLabel(CCDLabel):
+    r"""
+    register on demand an unknown CCD label PACKEDSTACK_PREFIX + detector label
+    with parameters of detector (see registerPackedStackCCDLabel()) and return CCDLabel
+
+    Packed stack labels are not stored in dict_LaueTools: they must be resolved in any
+    process reading them (e.g. spawned workers, or a label reloaded from a saved session)
+    """
+    if (CCDLabel not in DictLT.dict_CCD and isinstance(CCDLabel, str)
+            and CCDLabel.startswith(PACKEDSTACK_PREFIX)
+            and CCDLabel[len(PACKEDSTACK_PREFIX):] in DictLT.dict_CCD):
+        registerPackedStackCCDLabel(CCDLabel[len(PACKEDSTACK_PREFIX):])
+
+    return CCDLabel
+
+
+def readCCDimage(filename, CCDLabel="MARCCD165", dirname=None, stackimageindex=-1, verbose=0,
+                                                                        use_memmap=False):
     r"""Read raw data binary image file.
 
     Read raw data binary image file and return pixel intensity 2D array such as
@@ -516,6 +651,9 @@ def readCCDimage(filename, CCDLabel="MARCCD165", dirname=None, stackimageindex=-
     :type stackimageindex: int, optional
     :param verbose: 0 or 1, defaults to 0
     :type verbose: int, optional
+    :param use_memmap: True, returns a read-only memory mapped view of raw binary data
+                        (see memmapCCDimage()). Nothing is read until pixels are accessed.
+    :type use_memmap: bool, optional
     :raises ValueError: if data format and CCD parameters from label are not compatible
     :return:
         - dataimage, 2D array image data pixel intensity properly oriented
@@ -523,6 +661,10 @@ def readCCDimage(filename, CCDLabel="MARCCD165", dirname=None, stackimageindex=-
         - fliprot : string, key for CCD frame transform to orient image
     :rtype: tuple of 3 elements
     """
+    resolvePackedStackCCDLabel(CCDLabel)
+    if use_memmap and CCDLabel not in CCDLABELS_NOT_MEMMAPABLE:
+        return memmapCCDimage(filename, CCDLabel=CCDLabel, dirname=dirname)
+
     (framedim, _, _, fliprot, offsetheader, formatdata, _, _) = DictLT.dict_CCD[CCDLabel]
 
     USE_RAW_METHOD = False
@@ -530,7 +672,18 @@ def readCCDimage(filename, CCDLabel="MARCCD165", dirname=None, stackimageindex=-
     print("CCDLabel in readCCDimage", CCDLabel)
     #    if extension != extension:
     #        print "warning : file extension does not match CCD type set in Set CCD File Parameters"
-    if FABIO_EXISTS:
+    if CCDLabel in HDF5STACK_CCDLABELS:
+
+        if dirname is not None:
+            pathtofile = os.path.join(dirname, filename)
+        else:
+            pathtofile = filename
+
+        # hdf5 file stays open in the pool of the module stack reader
+        dataimage = getHDF5StackReader().getframe(pathtofile, stackimageindex)
+        framedim = dataimage.shape
+
+    elif FABIO_EXISTS:
 
         if CCDLabel in ('MARCCD165', "EDF", "EIGER_4M", "EIGER_1M",
                         "sCMOS", "sCMOS_fliplr","sCMOS_fliplr_16M", "sCMOS_16M",
@@ -555,28 +708,6 @@ def readCCDimage(filename, CCDLabel="MARCCD165", dirname=None, stackimageindex=-
         else:
             USE_RAW_METHOD = True
 
-    elif CCDLabel in ("EIGER_4Mstack", ):
-
-        import tables as Tab
-
-        if dirname is not None:
-            pathtofile = os.path.join(dirname, filename)
-        else:
-            pathtofile = filename
-
-        # TODO check to correct version transition
-        if Tab.__version__ >= "3.4.2":
-            hdf5file = Tab.open_file(pathtofile)
-        else:
-            hdf5file = Tab.openFile(pathtofile)
-
-        print("opening hdf5 stacked data table")
-        alldata = hdf5file.root.entry.data.data
-        print("alldata.shape", alldata.shape)
-
-        dataimage = alldata[stackimageindex]
-        framedim = dataimage.shape
-
     elif LIBTIFF_EXISTS:
         print("----> Using libtiff...")
         if CCDLabel in ("sCMOS", "MARCCD165", "TIFF Format",
@@ -613,6 +744,11 @@ def readCCDimage(filename, CCDLabel="MARCCD165", dirname=None, stackimageindex=-
 
             im = Image.open(fullpath, "r")
             dataimage = np.array(im.getdata()).reshape(framedim)
+        else:
+            USE_RAW_METHOD = True
+
+    else:
+        USE_RAW_METHOD = True
 
     # RAW method knowing or deducing offsetheader and dataformat
     if USE_RAW_METHOD:
@@ -675,6 +811,254 @@ def readCCDimage(filename, CCDLabel="MARCCD165", dirname=None, stackimageindex=-
                 CCDLabel))
 
     # some array transformations if needed depending on the CCD mounting
+    dataimage = apply_fliprot(dataimage, fliprot)
+
+    #     print "framedim",framedim, fliprot
+    return dataimage, framedim, fliprot
+
+
+class HDF5StackReader(object):
+    r"""
+    reader of frames stacked in hdf5 files (e.g. EIGER_4Mstack) keeping a bounded pool
+    of open files
+
+    When frames of a stack are read sequentially, they are read by blocks aligned on hdf5 chunks
+    (at least `prefetch` frames) so that each chunk is decompressed only once. Other
+    (random) accesses read only the requested frame. Cached blocks of all open files
+    take at most `maxcachedmemory` bytes, and the block of a file is dropped when file is closed.
+
+    Reader is thread safe (e.g. used by ImagePrefetcher threads): hdf5 library is not, so
+    files pool, reading and cached blocks are protected by a single lock.
+
+    Frames appended to a stack file after it has been opened are seen: file is reopened when
+    a frame index beyond the known nb of frames is requested.
+
+    :param maxopenfiles: max nb of files kept open (least recently used file is closed first)
+    :param prefetch: min nb of frames read at once (rounded up to a multiple of chunk size)
+    :param datapath: path of stacked frames array node in hdf5 file
+    :param maxcachedmemory: max memory (bytes) of cached blocks of frames
+
+    usage::
+
+        reader = HDF5StackReader()
+        frame = reader.getframe("stack_0001.h5", 10)
+        for filename, stackimageindex, frame in reader.iterframes(["stack_0001.h5", "stack_0002.h5"]):
+            ...
+        reader.close()
+    """
+    def __init__(self, maxopenfiles=HDF5STACK_MAXOPENFILES,
+                        prefetch=HDF5STACK_PREFETCH,
+                        datapath=HDF5STACK_DATAPATH,
+                        maxcachedmemory=HDF5STACK_MAXCACHEDMEMORY):
+        if not TABLES_EXISTS:
+            raise ImportError("module tables (pytables) is needed to read hdf5 stacked images")
+        self.maxopenfiles = max(int(maxopenfiles), 1)
+        self.prefetch = max(int(prefetch), 1)
+        self.datapath = datapath
+        self.maxcachedmemory = maxcachedmemory
+        # path: [hdf5 file, data node, (first frame index of block, block of frames) or None,
+        #        index of last read frame]
+        self.pool = collections.OrderedDict()
+        self.cachedmemory = 0
+        self._lock = threading.RLock()
+
+    def _getentry(self, filename):
+        r""" returns pool entry of opened file (open it if needed). Lock must be held """
+        filename = os.path.abspath(filename)
+        if filename in self.pool:
+            self.pool.move_to_end(filename)
+            return self.pool[filename]
+
+        while len(self.pool) >= self.maxopenfiles:
+            _, entry = self.pool.popitem(last=False)
+            self._closeentry(entry)
+
+        if hasattr(Tab, "open_file"):
+            hdf5file = Tab.open_file(filename, mode="r")
+        else:
+            hdf5file = Tab.openFile(filename, mode="r")
+
+        entry = [hdf5file, hdf5file.get_node(self.datapath), None, None]
+        self.pool[filename] = entry
+        return entry
+
+    def _dropblock(self, entry):
+        r""" release cached block of pool entry. Lock must be held """
+        if entry[2] is not None:
+            self.cachedmemory -= entry[2][1].nbytes
+            entry[2] = None
+
+    def _closeentry(self, entry):
+        r""" drop cached block and close file of pool entry. Lock must be held """
+        self._dropblock(entry)
+        entry[0].close()
+
+    def _getnbframes(self, filename, stackimageindex=None):
+        r"""
+        returns pool entry and nb of frames of filename. File is reopened if stackimageindex is
+        beyond the nb of frames known at opening (file may have been appended). Lock must be held
+        """
+        entry = self._getentry(filename)
+        nbframes = entry[1].shape[0]
+        if stackimageindex is not None and stackimageindex >= nbframes:
+            self.release(filename)
+            entry = self._getentry(filename)
+            nbframes = entry[1].shape[0]
+        return entry, nbframes
+
+    def getblocksize(self, filename):
+        r"""
+        nb of frames read at once in sequential reading: multiple of chunk size along stack axis
+        >= prefetch, within maxcachedmemory (at least one chunk)
+        """
+        with self._lock:
+            datanode = self._getentry(filename)[1]
+            chunkshape = getattr(datanode, "chunkshape", None)
+            chunk = chunkshape[0] if chunkshape else 1
+            nbchunks = int(np.ceil(self.prefetch / float(chunk)))
+            chunkmemory = chunk * int(np.prod(datanode.shape[1:])) * datanode.dtype.itemsize
+            nbchunks = max(min(nbchunks, int(self.maxcachedmemory // max(chunkmemory, 1))), 1)
+            return chunk * nbchunks
+
+    def getnbframes(self, filename):
+        r""" nb of frames in stack file """
+        with self._lock:
+            return self._getnbframes(filename)[1]
+
+    def getframe(self, filename, stackimageindex):
+        r""" returns 2D array (own copy) of frame at position stackimageindex in stack file """
+        with self._lock:
+            entry, nbframes = self._getnbframes(filename,
+                                                stackimageindex if stackimageindex >= 0 else None)
+            datanode = entry[1]
+            if stackimageindex < 0:
+                stackimageindex += nbframes
+            if not 0 <= stackimageindex < nbframes:
+                raise IndexError("stackimageindex %d is out of range of %s (%d frames)"
+                                                    % (stackimageindex, filename, nbframes))
+
+            # reading from first frame or next frame of last read one
+            sequential = stackimageindex == (entry[3] + 1 if entry[3] is not None else 0)
+            entry[3] = stackimageindex
+
+            if entry[2] is not None:
+                firstindex, block = entry[2]
+                if firstindex <= stackimageindex < firstindex + len(block):
+                    return block[stackimageindex - firstindex].copy()
+                self._dropblock(entry)
+
+            if not sequential:
+                # random access: only requested frame is read
+                return datanode[stackimageindex]
+
+            blocksize = self.getblocksize(filename)
+            firstindex = (stackimageindex // blocksize) * blocksize
+            block = datanode[firstindex: min(firstindex + blocksize, nbframes)]
+            self._cacheblock(entry, firstindex, block)
+
+            return block[stackimageindex - firstindex].copy()
+
+    def _cacheblock(self, entry, firstindex, block):
+        r"""
+        cache block of entry, dropping blocks of least recently used files to stay
+        within maxcachedmemory. Lock must be held
+        """
+        for otherentry in self.pool.values():
+            if self.cachedmemory + block.nbytes <= self.maxcachedmemory:
+                break
+            self._dropblock(otherentry)
+        if self.cachedmemory + block.nbytes <= self.maxcachedmemory:
+            entry[2] = (firstindex, block)
+            self.cachedmemory += block.nbytes
+
+    def iterframes(self, filenames, start=0, stop=None):
+        r"""
+        iterate over frames of many stack files
+
+        :param filenames: list of stack files paths
+        :param start, stop: range of stackimageindex in each file (stop=None: until last frame)
+
+        :return: generator of (filename, stackimageindex, frame)
+        """
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        for filename in filenames:
+            nbframes = self.getnbframes(filename)
+            laststop = nbframes if stop is None else min(stop, nbframes)
+            for stackimageindex in list(range(start, laststop)):
+                yield filename, stackimageindex, self.getframe(filename, stackimageindex)
+            # release memory of last block
+            with self._lock:
+                self._dropblock(self._getentry(filename))
+
+    def getframes(self, filename, stackimageindices):
+        r"""
+        returns 3D array of frames at positions stackimageindices (in any order) in stack file
+
+        Frames are read in one pass over increasing indices (only needed chunks are read)
+        """
+        stackimageindices = np.asarray(stackimageindices, dtype=np.int64)
+        with self._lock:
+            entry, nbframes = self._getnbframes(filename, int(np.amax(stackimageindices, initial=-1)))
+            datanode = entry[1]
+            stackimageindices = np.where(stackimageindices < 0, stackimageindices + nbframes,
+                                                                                stackimageindices)
+            if np.any((stackimageindices < 0) | (stackimageindices >= nbframes)):
+                raise IndexError("stackimageindices are out of range of %s (%d frames)"
+                                                                        % (filename, nbframes))
+            sortedindices, positions = np.unique(stackimageindices, return_inverse=True)
+            frames = np.empty((len(sortedindices),) + tuple(datanode.shape[1:]),
+                                                                        dtype=datanode.dtype)
+            # consecutive indices are read as slices
+            splits = np.where(np.diff(sortedindices) != 1)[0] + 1
+            for first, last in zip(np.r_[0, splits], np.r_[splits, len(sortedindices)]):
+                frames[first:last] = datanode[sortedindices[first]: sortedindices[last - 1] + 1]
+        return frames[positions]
+
+    def release(self, filename):
+        r""" close filename if it is opened """
+        with self._lock:
+            entry = self.pool.pop(os.path.abspath(filename), None)
+            if entry is not None:
+                self._closeentry(entry)
+
+    def close(self):
+        r""" close all opened files """
+        with self._lock:
+            while self.pool:
+                _, entry = self.pool.popitem(last=False)
+                self._closeentry(entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_HDF5STACKREADER = None
+
+
+def getHDF5StackReader():
+    r""" returns stack reader shared by module functions (created at first call) """
+    global _HDF5STACKREADER
+    if _HDF5STACKREADER is None:
+        _HDF5STACKREADER = HDF5StackReader()
+    return _HDF5STACKREADER
+
+
+def apply_fliprot(dataimage, fliprot):
+    r"""
+    orient 2D raw image data according to the CCD mounting key `fliprot` (see dict_CCD)
+
+    numpy rot90, fliplr and flipud return views: no pixel data is copied
+    (nor read if dataimage is a numpy memmap)
+
+    :param dataimage: 2D array of raw pixel intensity
+    :param fliprot: string, key for CCD frame transform
+
+    :return: 2D array (view of dataimage) properly oriented
+    """
     if fliprot == "spe":
         dataimage = np.rot90(dataimage, k=1)
 
@@ -697,7 +1081,71 @@ def readCCDimage(filename, CCDLabel="MARCCD165", dirname=None, stackimageindex=-
     elif fliprot == "frelon2":
         dataimage = np.flipud(dataimage)
 
-    #     print "framedim",framedim, fliprot
+    return dataimage
+
+
+def getrawimageformat(filename, CCDLabel="MARCCD165", dirname=None):
+    r"""
+    returns parameters to decode raw binary pixel data of an image file of a given CCD
+
+    header size is taken from dict_CCD if consistent with file size, otherwise
+    it is deduced from file size (data are assumed to be at the end of file
+    as for MARCCD and uncompressed sCMOS tiff files)
+
+    :param filename: path to image file (fullpath if ` dirname` =None)
+    :param CCDLabel: key of dict_CCD
+
+    :return: framedim, offsetheader, dtype (numpy dtype with byte order), fliprot
+    """
+    if CCDLabel in CCDLABELS_NOT_MEMMAPABLE:
+        raise ValueError("Binary data of %s image file can not be read as raw data" % CCDLabel)
+
+    (framedim, _, _, fliprot, offsetheader, formatdata, _, _) = DictLT.dict_CCD[CCDLabel]
+
+    if dirname is not None:
+        filename = os.path.join(dirname, filename)
+
+    dtype = np.dtype(formatdata)
+    if CCDLabel in CCDLABELS_BIGENDIAN:
+        dtype = dtype.newbyteorder(">")
+
+    nbbytes = framedim[0] * framedim[1] * dtype.itemsize
+    filesize = os.path.getsize(filename)
+    if filesize < nbbytes:
+        raise ValueError("File %s is too small for a %s image %s of %s"
+                                            % (filename, CCDLabel, str(framedim), formatdata))
+    if offsetheader < 0 or offsetheader + nbbytes != filesize:
+        offsetheader = filesize - nbbytes
+
+    return framedim, offsetheader, dtype, fliprot
+
+
+def memmapCCDimage(filename, CCDLabel="MARCCD165", dirname=None, applyfliprot=True):
+    r"""
+    returns a read-only memory mapped view of raw binary image data (zero copy)
+
+    Pixels are read from disk only when accessed: slicing a ROI only reads
+    the corresponding file pages. Frame transform (fliprot) is applied as a numpy view.
+
+    :param filename: path to image file (fullpath if ` dirname` =None)
+    :param CCDLabel: key of dict_CCD
+    :param applyfliprot: False, returns data as stored in file (no frame transform)
+
+    :return:
+        - dataimage, 2D read-only numpy memmap (view)
+        - framedim, iterable of 2 integers shape of raw data
+        - fliprot : string, key for CCD frame transform to orient image
+    """
+    framedim, offsetheader, dtype, fliprot = getrawimageformat(filename, CCDLabel=CCDLabel,
+                                                                                dirname=dirname)
+    if dirname is not None:
+        filename = os.path.join(dirname, filename)
+
+    dataimage = np.memmap(filename, dtype=dtype, mode="r", offset=offsetheader,
+                                                                        shape=tuple(framedim))
+    if applyfliprot:
+        dataimage = apply_fliprot(dataimage, fliprot)
+
     return dataimage, framedim, fliprot
 
 
@@ -811,11 +1259,6 @@ def readoneimage_crop_fast(filename, dirname=None, CCDLabel="MARCCD165",
     if dirname == None:
         dirname = os.curdir
 
-    # if formatdata in ("uint16",):
-    #     nbBytesPerElement = 2
-    # if formatdata in ("uint32",):
-    #     nbBytesPerElement = 4
-
     dataimage2D = np.zeros(framedim)
 
     # colFirstElemIndex = firstElemIndex % framedim[1]
@@ -823,21 +1266,11 @@ def readoneimage_crop_fast(filename, dirname=None, CCDLabel="MARCCD165",
     # colLastElemIndex = lastElemIndex % framedim[1]
     lineLastElemIndex = lastElemIndex // framedim[1]
 
-    band1D = readoneimage_band(filename,
-                            framedim=framedim,
-                            dirname=dirname,
-                            offset=offsetheader,
-                            line_startindex=lineFirstElemIndex,
-                            line_finalindex=lineLastElemIndex,
-                            formatdata=formatdata)
-
-    #     print "band1D.shape",band1D.shape
-    #     print "(lineLastElemIndex-lineFirstElemIndex,framedim[1])",(lineLastElemIndex-lineFirstElemIndex,framedim[1])
-    #     print "((lineLastElemIndex-lineFirstElemIndex)*framedim[1])",((lineLastElemIndex-lineFirstElemIndex)*framedim[1])
+    # only file pages of the band are read
+    rawdata = memmapCCDimage(filename, CCDLabel=CCDLabel, dirname=dirname, applyfliprot=False)[0]
 
-    band2D = band1D.reshape((lineLastElemIndex - lineFirstElemIndex + 1, framedim[1]))
-
-    dataimage2D[lineFirstElemIndex : lineLastElemIndex + 1, :] = band2D
+    dataimage2D[lineFirstElemIndex : lineLastElemIndex + 1, :] = rawdata[
+                                                lineFirstElemIndex : lineLastElemIndex + 1, :]
 
     return dataimage2D, framedim, fliprot
 
@@ -855,12 +1288,13 @@ def readrectangle_in_image(filename,
     centered on pixx, pixy
 
     :return: dataimage : 2D array, image data pixel intensity
+            (read-only view of the memory mapped file, copy it to modify values)
     """
     (framedim,
         _,
         _,
         fliprot,
-        offsetheader,
+        _,
         formatdata,
         _,
         _) = DictLT.dict_CCD[CCDLabel]
@@ -868,7 +1302,6 @@ def readrectangle_in_image(filename,
     if verbose:
         print("framedim read from DictLT.dict_CCD in readrectangle_in_image()", framedim)
         print("formatdata", formatdata)
-        print("offsetheader", offsetheader)
     # recompute headersize
     if dirname is not None:
         fullpathfilename = os.path.join(dirname, filename)
@@ -876,25 +1309,15 @@ def readrectangle_in_image(filename,
         dirname = os.curdir
         fullpathfilename = filename
 
-    if formatdata in ("uint16",):
-        nbBytesPerElement = 2
-    if formatdata in ("uint32",):
-        nbBytesPerElement = 4
-
     if verbose:
         print("fullpathfilename", fullpathfilename)
     try:
-        filesize = os.path.getsize(fullpathfilename)
+        # header size is calculated from file size if needed
+        rawdata = memmapCCDimage(fullpathfilename, CCDLabel=CCDLabel, applyfliprot=False)[0]
     except OSError:
         print("missing file {}\n".format(fullpathfilename))
         return None
 
-    # uint16
-    offsetheader = filesize - (framedim[0] * framedim[1]) * nbBytesPerElement
-
-    if verbose:
-        print("calculated offset of header from file size...", offsetheader)
-
     x = int(pixx)
     y = int(pixy)
 
@@ -904,40 +1327,18 @@ def readrectangle_in_image(filename,
     boxx = int(halfboxx)
     boxy = int(halfboxy)
 
-    xpixmin = x - boxx
+    xpixmin = max(x - boxx, 0)
     xpixmax = x + boxx
 
-    ypixmin = y - boxy
+    ypixmin = max(y - boxy, 0)
     ypixmax = y + boxy
 
-    #     ymin= (y-boxy)*framedim[1]
-    #     ymax= (y+boxy)*framedim[1]
-
-    lineFirstElemIndex = ypixmin
-    lineLastElemIndex = ypixmax
-
     if verbose:
-        print("lineFirstElemIndex", lineFirstElemIndex)
-        print("lineLastElemIndex", lineLastElemIndex)
+        print("lineFirstElemIndex", ypixmin)
+        print("lineLastElemIndex", ypixmax)
 
-    band = readoneimage_band(fullpathfilename,
-                                framedim=framedim,
-                                dirname=None,
-                                offset=offsetheader,
-                                line_startindex=lineFirstElemIndex,
-                                line_finalindex=lineLastElemIndex,
-                                formatdata=formatdata)
-
-    nblines = lineLastElemIndex - lineFirstElemIndex + 1
-
-    band2D = np.reshape(band, (nblines, framedim[1]))
-
-    # dataimage2D = np.zeros(framedim)
-
-    if verbose:
-        print("band2D.shape", band2D.shape)
-
-    rectangle2D = band2D[:, xpixmin : xpixmax + 1]
+    # zero copy: only file pages of the rectangle lines are read when data are accessed
+    rectangle2D = rawdata[ypixmin : ypixmax + 1, xpixmin : xpixmax + 1]
 
     if verbose:
         print("rectangle2D.shape", rectangle2D.shape)
@@ -985,7 +1386,8 @@ def readoneimage_manycrops(filename,
                             stackimageindex=-1,
                             CCDLabel="MARCCD165",
                             addImax=False,
-                            use_data_corrected=None):
+                            use_data_corrected=None,
+                            use_memmap=False):
     """
     reads 1 image and extract many regions
     centered on center_pixel with xyboxsize dimensions in pixel unit
@@ -998,9 +1400,14 @@ def readoneimage_manycrops(filename,
                          fulldata, framedim, fliprot
                          where fulldata is a numpy.ndarray
                          as output by :func:`readCCDimage`
+    use_memmap : True, image file is mapped in memory and crops are views of it
+                 (only pixels of the crops are read)
     boxsize : iterable 2 elements or integer
               boxsizes [in x, in y] direction or integer to set a square ROI
 
+    .. note::
+        readimages_manyROIs() extracts ROIs of a whole image series in one dense array
+
     Returns
     Data : list of 2D array pixel intensity
 
@@ -1030,7 +1437,8 @@ def readoneimage_manycrops(filename,
     else:
         fulldata, framedim, _ = readCCDimage(filename, stackimageindex=stackimageindex,
                                                             CCDLabel=CCDLabel,
-                                                            dirname=None)
+                                                            dirname=None,
+                                                            use_memmap=use_memmap)
 
     if isinstance(boxsize, int):
         boxsizex, boxsizey = boxsize, boxsize
@@ -1078,6 +1486,188 @@ def readoneimage_manycrops(filename,
         return Data
 
 
+def getROIsindices(rois, framedim, halfboxsize=None):
+    r"""
+    return pixel indices and validity mask to gather many ROIs of an image at once
+
+    :param rois: array like (n, 3) of (x, y, halfboxsize) or (n, 2) of ROI centers (x, y)
+        as 0-based array indices (pixel x is the column index, pixel y the row index of image
+        array)
+    :param framedim: shape of image array (nb rows, nb columns)
+    :param halfboxsize: half boxsize of all ROIs (integer) if rois contains only centers
+
+    :return: rows (n, h, 1), columns (n, 1, w) (clipped into frame) and mask (n, h, w) of
+        pixels belonging to each ROI and frame. h = w = 2 * max halfboxsize + 1
+    """
+    rois = np.asarray(rois)
+    if rois.ndim != 2 or rois.shape[1] not in (2, 3):
+        raise ValueError("rois must be an array of (x, y, halfboxsize) or (x, y) elements")
+    xcenters = np.round(rois[:, 0]).astype(np.int64)
+    ycenters = np.round(rois[:, 1]).astype(np.int64)
+    if rois.shape[1] == 3:
+        halfboxes = rois[:, 2].astype(np.int64)
+    elif halfboxsize is not None:
+        halfboxes = np.full(len(rois), int(halfboxsize), dtype=np.int64)
+    else:
+        raise ValueError("halfboxsize must be given when rois contain only centers")
+
+    maxhalfbox = int(halfboxes.max()) if len(rois) else 0
+    offsets = np.arange(-maxhalfbox, maxhalfbox + 1)
+
+    rows = ycenters[:, None, None] + offsets[None, :, None]
+    columns = xcenters[:, None, None] + offsets[None, None, :]
+    insidebox = np.abs(offsets)[None, :, None] <= halfboxes[:, None, None]
+    mask = ((insidebox & (rows >= 0) & (rows < framedim[0]))
+            & (np.transpose(insidebox, (0, 2, 1)) & (columns >= 0) & (columns < framedim[1])))
+
+    return (np.clip(rows, 0, framedim[0] - 1), np.clip(columns, 0, framedim[1] - 1), mask)
+
+
+def _read_ROIs_chunk(args):
+    r"""
+    gather ROIs in images of a list of files
+
+    :param args: (filenames, stackimageindices, rois, halfboxsize, CCDLabel, dirname, fillvalue)
+
+    :return: array (nb files, nb rois, h, w)
+    """
+    filenames, stackimageindices, rois, halfboxsize, CCDLabel, dirname, fillvalue = args
+
+    Data = None
+    for k, (filename, stackimageindex) in enumerate(zip(filenames, stackimageindices)):
+        dataimage = readCCDimage(filename, CCDLabel=CCDLabel, dirname=dirname,
+                                                    stackimageindex=stackimageindex,
+                                                    use_memmap=True)[0]
+        if Data is None:
+            rows, columns, mask = getROIsindices(rois, dataimage.shape, halfboxsize=halfboxsize)
+            Data = np.empty((len(filenames),) + mask.shape, dtype=dataimage.dtype)
+            outside = ~mask
+        # single fancy indexing: only pages of mapped file containing ROIs pixels are read
+        Data[k] = dataimage[rows, columns]
+        Data[k][outside] = fillvalue
+
+    return Data
+
+
+def readimages_manyROIs(filenames, rois, halfboxsize=None, CCDLabel="MARCCD165",
+                                                            dirname=None,
+                                                            stackimageindices=None,
+                                                            nb_of_cpu=1,
+                                                            fillvalue=0):
+    r"""
+    extract many ROIs (boxes around fixed pixel positions) in a series of images
+
+    Each image file is mapped in memory (when possible, see memmapCCDimage) and all its ROIs
+    are gathered with a single fancy indexing operation. With nb_of_cpu > 1 images are split
+    into contiguous chunks read in parallel processes.
+
+    :param filenames: list of image filenames
+    :param rois: array like (n, 3) of (x, y, halfboxsize) or (n, 2) of ROI centers (x, y)
+        as 0-based array indices of image (x column index, y row index, see getROIsindices()).
+        Pixel (X, Y) of LaueTools pixel frame (as displayed and in peak lists) is (X - 1, Y - 1)
+    :param halfboxsize: half boxsize of all ROIs if rois contains only centers
+    :param CCDLabel: key of dict_CCD
+    :param dirname: folder of images (None if filenames are full paths)
+    :param stackimageindices: list of image position in stacked hdf5 files (one per filename)
+    :param nb_of_cpu: nb of processes
+    :param fillvalue: value of pixels outside frame or outside ROI smaller than the largest one
+
+    :return: array (nb images, nb rois, h, w) with h = w = 2 * largest halfboxsize + 1.
+        Data[k, j, halfbox, halfbox] is the pixel at center of ROI j in image k
+    """
+    filenames = list(filenames)
+    nbfiles = len(filenames)
+    if nbfiles == 0:
+        raise ValueError("No image to read")
+    if stackimageindices is None:
+        stackimageindices = [-1] * nbfiles
+
+    nb_of_cpu = max(1, min(nb_of_cpu, nbfiles))
+    bounds = [nbfiles * k // nb_of_cpu for k in list(range(nb_of_cpu + 1))]
+    chunks = [(filenames[bounds[k]:bounds[k + 1]], stackimageindices[bounds[k]:bounds[k + 1]],
+                rois, halfboxsize, CCDLabel, dirname, fillvalue) for k in list(range(nb_of_cpu))]
+
+    if nb_of_cpu == 1:
+        return _read_ROIs_chunk(chunks[0])
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool(nb_of_cpu)
+    try:
+        return np.concatenate(pool.map(_read_ROIs_chunk, chunks))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def readimageseries_manyROIs(prefixname, ind_start, ind_end, rois, halfboxsize=None,
+                                                            suffixname=None,
+                                                            nbdigits=4,
+                                                            CCDLabel="MARCCD165",
+                                                            dirname=None,
+                                                            nb_of_cpu=1,
+                                                            fillvalue=0):
+    r"""
+    extract many ROIs in images prefixname + index + suffixname with index from ind_start
+    to ind_end (included)
+
+    :param suffixname: end of filename (default: '.' + CCDLabel extension in dict_CCD)
+    :param nbdigits: nb of digits of index in filename (zero padded)
+
+    see readimages_manyROIs() for other parameters and output
+    """
+    if suffixname is None:
+        suffixname = "." + DictLT.dict_CCD[CCDLabel][7]
+    filenames = ["{}{}{}".format(prefixname, str(k).zfill(nbdigits), suffixname)
+                    for k in list(range(ind_start, ind_end + 1))]
+    return readimages_manyROIs(filenames, rois, halfboxsize=halfboxsize, CCDLabel=CCDLabel,
+                                                                dirname=dirname,
+                                                                nb_of_cpu=nb_of_cpu,
+                                                                fillvalue=fillvalue)
+
+
+def fitROIs_batch(Data, startingparams, fitfunc="gaussian", xtol=0.00000001,
+                                                        saturation_value=False):
+    r"""
+    fit a 2D gaussian (or lorentzian) in each ROI of Data. ROIs of the same shape are stacked
+    and fitted together by fit2d.gaussfit_batch()
+
+    Data : list of n 2D arrays
+    startingparams : array (n, 7) of starting parameters
+                     (bkg, amplitude, i, j, std1, std2, angle), as in fit2d.gaussfit()
+    saturation_value : if not False, pixels with intensity above or equal have a zero weight
+                       (gaussian fit only, as in readoneimage_multiROIfit())
+
+    returns list of n (params, cov, infodict, errmsg) as returned by fit2d.gaussfit(return_all=1)
+    """
+    startingparams = np.asarray(startingparams, dtype=float)
+    if fitfunc == "gaussian":
+        modelfunc = fit2d.twodgaussian_batch
+        Acceptable_HighestValue, Acceptable_LowestValue = saturation_value, 0
+    elif fitfunc == "lorentzian":
+        modelfunc = fit2d_l.twodlorentzian_batch
+        Acceptable_HighestValue, Acceptable_LowestValue = False, False
+    else:
+        raise ValueError("fitfunc %s not implemented in fitROIs_batch()" % fitfunc)
+
+    groups = collections.OrderedDict()
+    for k, dd in enumerate(Data):
+        groups.setdefault(np.shape(dd), []).append(k)
+
+    FitResults = [None] * len(Data)
+    for indices in groups.values():
+        res = fit2d.gaussfit_batch(np.array([Data[k] for k in indices]),
+                                    startingparams[indices],
+                                    xtol=xtol,
+                                    Acceptable_HighestValue=Acceptable_HighestValue,
+                                    Acceptable_LowestValue=Acceptable_LowestValue,
+                                    modelfunc=modelfunc)
+        for pos, k in enumerate(indices):
+            FitResults[k] = tuple(elem[pos] for elem in res)
+
+    return FitResults
+
+
 def readoneimage_multiROIfit(filename,
                             centers,
                             boxsize,
@@ -1094,7 +1684,8 @@ def readoneimage_multiROIfit(filename,
                             verbose=0,
                             xtol=0.00000001,
                             addImax=False,
-                            use_data_corrected=None):
+                            use_data_corrected=None,
+                            batchfit=True):
     r"""
     Fit several peaks in one image
 
@@ -1128,6 +1719,11 @@ def readoneimage_multiROIfit(filename,
                          fulldata, framedim, fliprot
                          where fulldata is a ndarray
 
+    batchfit : boolean
+               True: ROIs of the same shape are fitted all together by a vectorized
+               Levenberg-Marquardt with analytic derivatives (see fitROIs_batch())
+               False: one scipy leastsq fit (numerical derivatives) per ROI
+
     returns
     params_sol : list of results
                  bkg,  amp  (gaussian height-bkg), X , Y ,
@@ -1245,6 +1841,12 @@ def readoneimage_multiROIfit(filename,
     if verbose:
         print("startingparams_zip", startingparams_zip.T)
 
+    if batchfit and fitfunc in ("gaussian", "lorentzian"):
+        FitResults = fitROIs_batch(Data, startingparams_zip.T, fitfunc=fitfunc, xtol=xtol,
+                                                        saturation_value=saturation_value)
+    else:
+        FitResults = None
+
     # consider that ROi shape will be constant over all ROIs,
     # so no need to recompute np.indices in gaussfit
     ROIshape = Data[0].shape
@@ -1255,7 +1857,10 @@ def readoneimage_multiROIfit(filename,
         # if (k_image%25) == 0: print "%d/%d"%(k_image,nb_Images)
         if verbose:
             print("startingparams", startingparams)
-        if fitfunc == "gaussian":
+        if FitResults is not None:
+            params, cov, infodict, errmsg = FitResults[k_image]
+
+        elif fitfunc == "gaussian":
             if Data[k_image].shape != ROIshape:
                 ijindices_array = None
 
@@ -1443,6 +2048,12 @@ def fitPeakMultiROIs(Data, centers, FittingParametersDict, showfitresults=True,
     if verbose:
         print("startingparams_zip", startingparams_zip.T)
 
+    if FittingParametersDict.get("batchfit", True) and fitfunc in ("gaussian", "lorentzian"):
+        FitResults = fitROIs_batch(Data, startingparams_zip.T, fitfunc=fitfunc, xtol=xtol,
+                                                        saturation_value=saturation_value)
+    else:
+        FitResults = None
+
     # consider that ROi shape will be constant over all ROIs,
     # so no need to recompute np.indices in gaussfit
     ROIshape = Data[0].shape
@@ -1453,7 +2064,10 @@ def fitPeakMultiROIs(Data, centers, FittingParametersDict, showfitresults=True,
         # if (k_image%25) == 0: print "%d/%d"%(k_image,nb_Images)
         if verbose:
             print("startingparams", startingparams)
-        if fitfunc == "gaussian":
+        if FitResults is not None:
+            params, cov, infodict, errmsg = FitResults[k_image]
+
+        elif fitfunc == "gaussian":
             if Data[k_image].shape != ROIshape:
                 ijindices_array = None
 
@@ -1662,13 +2276,180 @@ def write_rawbinary(outputname, data, dataformat=np.uint16):
     print("image written in ", outputname)
 
 
+IMAGEREDUCTION_OPERATIONS = ("sum", "mean", "max", "min", "std")
+
+
+def _init_imagereduction(data):
+    r"""
+    return empty partial reduction (accumulators) for images like data
+
+    Accumulators of integer images are integers (exact sums of any nb of frames),
+    sum of squares of images with more than 16 bits per pixel are accumulated in float64
+    """
+    if np.issubdtype(data.dtype, np.integer):
+        sumdtype = np.int64
+        sumsqdtype = np.int64 if data.dtype.itemsize <= 2 else np.float64
+    else:
+        sumdtype = sumsqdtype = np.float64
+
+    return {"nbimages": 0,
+            "sum": np.zeros(data.shape, dtype=sumdtype),
+            "sumsq": np.zeros(data.shape, dtype=sumsqdtype),
+            "max": np.array(data, copy=True),
+            "min": np.array(data, copy=True)}
+
+
+def _reduce_imagechunk(args):
+    r"""
+    accumulate sum, sum of squares, max and min of images of a list of files
+
+    :param args: (filenames, CCDLabel, dirname, use_memmap)
+
+    :return: partial reduction dict (see _init_imagereduction) or None if filenames is empty
+    """
+    filenames, CCDLabel, dirname, use_memmap = args
+
+    partial = None
+    buffer = None
+    for filename in filenames:
+        data = readCCDimage(filename, CCDLabel=CCDLabel, dirname=dirname,
+                                        use_memmap=use_memmap, verbose=0)[0]
+        if partial is None:
+            partial = _init_imagereduction(data)
+            buffer = np.empty(data.shape, dtype=partial["sumsq"].dtype)
+
+        np.add(partial["sum"], data, out=partial["sum"], casting="unsafe")
+        np.multiply(data, data, out=buffer, dtype=buffer.dtype)
+        np.add(partial["sumsq"], buffer, out=partial["sumsq"])
+        np.maximum(partial["max"], data, out=partial["max"])
+        np.minimum(partial["min"], data, out=partial["min"])
+        partial["nbimages"] += 1
+
+    return partial
+
+
+def _merge_imagereductions(partial1, partial2):
+    r"""
+    merge partial reduction partial2 into partial1 (in place) and return partial1
+    """
+    if partial1 is None:
+        return partial2
+    if partial2 is None:
+        return partial1
+    for key in ("sum", "sumsq"):
+        np.add(partial1[key], partial2[key], out=partial1[key])
+    np.maximum(partial1["max"], partial2["max"], out=partial1["max"])
+    np.minimum(partial1["min"], partial2["min"], out=partial1["min"])
+    partial1["nbimages"] += partial2["nbimages"]
+    return partial1
+
+
+def reduce_images(filenames, CCDLabel="MARCCD165", dirname=None,
+                                                operations=IMAGEREDUCTION_OPERATIONS,
+                                                nb_of_cpu=1,
+                                                use_memmap=True):
+    r"""
+    compute pixelwise sum, mean, max, min and standard deviation of a set of images
+
+    Images are read one by one and accumulated in place (integer accumulators for integer
+    images). With nb_of_cpu > 1, the list of files is split into contiguous chunks reduced
+    in parallel processes and partial results are merged pairwise (tree reduction).
+
+    :param filenames: list of image filenames
+    :param CCDLabel: key of dict_CCD
+    :param dirname: folder of images (None if filenames are full paths)
+    :param operations: iterable of quantities to return among IMAGEREDUCTION_OPERATIONS
+    :param nb_of_cpu: nb of processes
+    :param use_memmap: True to map raw image files in memory instead of reading them
+
+    :return: dict with keys 'nbimages' and operations. sum is int64 (float64 for float
+        images), max and min have the dtype of images, mean and std are float64
+    """
+    for operation in operations:
+        if operation not in IMAGEREDUCTION_OPERATIONS:
+            raise ValueError("Unknown image reduction %s. Choose among %s"
+                                            % (operation, IMAGEREDUCTION_OPERATIONS))
+    filenames = list(filenames)
+    nbfiles = len(filenames)
+    if nbfiles == 0:
+        raise ValueError("No image to reduce")
+
+    nb_of_cpu = max(1, min(nb_of_cpu, nbfiles))
+    bounds = [nbfiles * k // nb_of_cpu for k in list(range(nb_of_cpu + 1))]
+    chunks = [(filenames[bounds[k]:bounds[k + 1]], CCDLabel, dirname, use_memmap)
+                                                        for k in list(range(nb_of_cpu))]
+
+    if nb_of_cpu == 1:
+        partials = [_reduce_imagechunk(chunks[0])]
+    else:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(nb_of_cpu)
+        try:
+            partials = pool.map(_reduce_imagechunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    # tree reduction
+    while len(partials) > 1:
+        partials = [_merge_imagereductions(*partials[k:k + 2]) if k + 1 < len(partials)
+                                                                    else partials[k]
+                    for k in list(range(0, len(partials), 2))]
+    partial = partials[0]
+
+    nbimages = partial["nbimages"]
+    result = {"nbimages": nbimages}
+    for operation in ("sum", "max", "min"):
+        if operation in operations:
+            result[operation] = partial[operation]
+    if "mean" in operations or "std" in operations:
+        mean = partial["sum"] / float(nbimages)
+        if "mean" in operations:
+            result["mean"] = mean
+        if "std" in operations:
+            variance = partial["sumsq"] / float(nbimages) - mean ** 2
+            result["std"] = np.sqrt(np.clip(variance, 0, None))
+
+    return result
+
+
+def reduce_imageseries(prefixname, ind_start, ind_end, suffixname=None,
+                                                        nbdigits=4,
+                                                        CCDLabel="MARCCD165",
+                                                        dirname=None,
+                                                        operations=IMAGEREDUCTION_OPERATIONS,
+                                                        nb_of_cpu=1,
+                                                        use_memmap=True):
+    r"""
+    compute pixelwise sum, mean, max, min and standard deviation of images
+    prefixname + index + suffixname with index from ind_start to ind_end (included)
+
+    :param suffixname: end of filename (default: '.' + CCDLabel extension in dict_CCD)
+    :param nbdigits: nb of digits of index in filename (zero padded)
+
+    see reduce_images() for other parameters and output
+    """
+    if suffixname is None:
+        suffixname = "." + DictLT.dict_CCD[CCDLabel][7]
+    filenames = ["{}{}{}".format(prefixname, str(k).zfill(nbdigits), suffixname)
+                    for k in list(range(ind_start, ind_end + 1))]
+    return reduce_images(filenames, CCDLabel=CCDLabel, dirname=dirname,
+                                                    operations=operations,
+                                                    nb_of_cpu=nb_of_cpu,
+                                                    use_memmap=use_memmap)
+
+
 def SumImages(prefixname, suffixname, ind_start, ind_end, dirname=None,
                                                             plot=0,
                                                             output_filename=None,
                                                             CCDLabel=None,
-                                                            nbdigits=0):
+                                                            nbdigits=0,
+                                                            nb_of_cpu=1):
     """
     sum images and write image with 32 bits per pixel format (4 bytes)
+
+    see reduce_imageseries() for parallel computation of other statistics
     """
     #     prefixname = 'HN08_'
     #     suffixname = '.tif'
@@ -1679,8 +2460,6 @@ def SumImages(prefixname, suffixname, ind_start, ind_end, dirname=None,
 
     filename = "{}{:04d}{}".format(prefixname, ind_start, suffixname)
 
-    data, shape, _ = readCCDimage(filename, CCDLabel=CCDLabel, dirname=dirname)
-
     if CCDLabel == "ImageStar_raw":
         # Add addition of 32 bits image => replace 2 by 4  nb of bytes per pixel
         filesize = os.path.getsize(os.path.join(dirname, filename))
@@ -1692,19 +2471,13 @@ def SumImages(prefixname, suffixname, ind_start, ind_end, dirname=None,
         # Add addition of 32 bits image => replace 2 by 4  nb of bytes per pixel
         filesize = os.path.getsize(os.path.join(dirname, filename))
         offsetheader = filesize - 2048 * 2048 * 2
-    # print "shape = ", np.shape(datastart)
-    datasum = np.zeros(shape, dtype=np.uint32)
-
-    #     nb_images = ind_end - ind_start + 1
-
-    indexscanlist = list(range(ind_start, ind_end + 1, 1))
-    for k in indexscanlist:
-        # print k
-        filename = "{}{:04d}{}".format(prefixname, k, suffixname)
-        # print filename1
-        data, shape, _ = readCCDimage(filename, CCDLabel=CCDLabel, dirname=dirname)
-        # print max(data1), np.argmax(data1)
-        datasum = data + datasum
+    datasum = reduce_imageseries(prefixname, ind_start, ind_end, suffixname=suffixname,
+                                                    CCDLabel=CCDLabel,
+                                                    dirname=dirname,
+                                                    operations=("sum",),
+                                                    nb_of_cpu=nb_of_cpu)["sum"]
+    datasum = datasum.astype(np.uint32)
+    filename = "{}{:04d}{}".format(prefixname, ind_end, suffixname)
 
     if output_filename:
         outputfilename = output_filename
@@ -1725,33 +2498,21 @@ def Add_Images2(prefixname,
                 plot=0,
                 writefilename=None,
                 CCDLabel="MARCCD165",
-                average=True):
+                average=True,
+                nb_of_cpu=1):
     """
-    in dev
+    add (or average) continuous sequence of images and return 16 bits image
 
+    see reduce_imageseries()
     """
     suffixname = "." + DictLT.dict_CCD[CCDLabel][-1]
 
-    filename = prefixname + stringint(ind_start, 4) + suffixname
-    datastart, _, _ = readCCDimage(filename, CCDLabel)
-
-    # print "shape = ", np.shape(datastart)
-    datastart = np.array(datastart, dtype=float)
-
-    indexscanlist = list(range(ind_start + 1, ind_end + 1, 1))
-    for k in indexscanlist:
-        # print k
-        filename1 = prefixname + stringint(k, 4) + suffixname
-        # print filename1
-        data1, _, _ = readCCDimage(filename1, CCDLabel)
-        # print max(data1), np.argmax(data1)
-        datastart = np.array(data1, dtype=float) + datastart
-    # datastart= datastart/((len(indexscanlist)+1)*1.)
-    # print "final"
-    # print max(datastart), np.argmax(datastart)
-    if average:
-        datastart = datastart / (float(len(indexscanlist)) + 1.0)
-    # print max(datastart), np.argmax(datastart)
+    filename1 = prefixname + stringint(ind_end, 4) + suffixname
+    operation = "mean" if average else "sum"
+    datastart = reduce_imageseries(prefixname, ind_start, ind_end, suffixname=suffixname,
+                                                        CCDLabel=CCDLabel,
+                                                        operations=(operation,),
+                                                        nb_of_cpu=nb_of_cpu)[operation]
     datastart = np.array(datastart, dtype=np.uint16)
     # print max(datastart), np.argmax(datastart)
     if writefilename:
@@ -1793,24 +2554,11 @@ def Add_Images(prefixname, ind_start, ind_end, plot=0, writefilename=None):
     """
     suffixname = ".mccd"
 
-    datastart = readoneimage(prefixname + stringint(ind_start, 4) + suffixname)
-    # print "shape = ", np.shape(datastart)
-    datastart = np.array(datastart, dtype=float)
-
-    indexscanlist = list(range(ind_start + 1, ind_end + 1, 1))
-    for k in indexscanlist:
-        # print k
-        filename1 = prefixname + stringint(k, 4) + suffixname
-        # print filename1
-        data1 = readoneimage(filename1)
-        # print max(data1), np.argmax(data1)
-        datastart = np.array(data1, dtype=float) + datastart
-    # datastart= datastart/((len(indexscanlist)+1)*1.)
-    # print "final"
-    # print max(datastart), np.argmax(datastart)
-    datastart = datastart / (float(len(indexscanlist)) + 1.0)
-    # print max(datastart), np.argmax(datastart)
-    datastart = np.array(datastart, dtype=np.uint16)
+    filename1 = prefixname + stringint(ind_end, 4) + suffixname
+    datastart = reduce_imageseries(prefixname, ind_start, ind_end, suffixname=suffixname,
+                                                        CCDLabel="MARCCD165",
+                                                        operations=("mean",))["mean"]
+    datastart = np.array(datastart.ravel(), dtype=np.uint16)
     # print max(datastart), np.argmax(datastart)
     if writefilename:
         outputfilename = writefilename
@@ -2147,7 +2895,7 @@ def radialArr(shape, func, orig=None, wrap=False, dtype=np.float32):
         shape = (shape,)
 
     if orig is None:
-        orig = (np.array(shape, dtype=np.float) - 1) / 2.0
+        orig = (np.array(shape, dtype=float) - 1) / 2.0
     else:
         try:
             oo = float(orig)
@@ -2213,6 +2961,80 @@ def radialArr(shape, func, orig=None, wrap=False, dtype=np.float32):
 
 
 # --- --------------------  Local Maxima or Local Hot pixels search
+def apply_by_tiles(func, Data, halo, outdtype, tilesize=LOCALMAXIMA_TILESIZE, nbthreads=2):
+    r"""
+    apply an image to image function on overlapping tiles of Data processed in a pool of threads
+
+    Each tile is extended by `halo` pixels on each side (within the frame) before applying func
+    and only its central part is kept. The result is identical to func(Data) when the value
+    of each output pixel only depends on input pixels closer than `halo` and on the
+    distance to frame borders (e.g. convolution, shift arrays comparison).
+
+    :param func: function of a 2D array returning an array of the same shape
+    :param Data: 2D array
+    :param halo: nb of pixels of tiles overlap
+    :param outdtype: dtype of output array
+    :param tilesize: approximate side length of tiles (tiles are larger than 4 * halo)
+    :param nbthreads: nb of threads
+
+    :return: 2D array of shape Data.shape
+    """
+    tilesize = max(int(tilesize), 4 * halo + 1)
+    nrows, ncols = Data.shape[:2]
+    nbrowtiles = max(1, int(np.ceil(nrows / float(tilesize))))
+    nbcoltiles = max(1, int(np.ceil(ncols / float(tilesize))))
+    rowcuts = [nrows * k // nbrowtiles for k in list(range(nbrowtiles + 1))]
+    colcuts = [ncols * k // nbcoltiles for k in list(range(nbcoltiles + 1))]
+
+    output = np.empty(Data.shape, dtype=outdtype)
+
+    def processtile(tile):
+        r0, r1, c0, c1 = tile
+        er0, er1 = max(r0 - halo, 0), min(r1 + halo, nrows)
+        ec0, ec1 = max(c0 - halo, 0), min(c1 + halo, ncols)
+        res = func(Data[er0:er1, ec0:ec1])
+        output[r0:r1, c0:c1] = res[r0 - er0: r1 - er0, c0 - ec0: c1 - ec0]
+
+    tiles = [(rowcuts[i], rowcuts[i + 1], colcuts[j], colcuts[j + 1])
+                for i in list(range(nbrowtiles)) for j in list(range(nbcoltiles))]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(int(nbthreads), 1)) as executor:
+        # raise exception of any tile
+        list(executor.map(processtile, tiles))
+
+    return output
+
+
+def blobs_maximum_position(Data, labels, nblabels):
+    r"""
+    return position of the hottest pixel of each blob labelled in labels (1 to nblabels)
+
+    as ndimage.maximum_position(Data, labels, np.arange(1, nblabels + 1)) but only pixels
+    belonging to blobs are read and sorted (no full frame copies, index arrays or sorting).
+
+    Among pixels of same highest intensity (e.g. saturated plateau), the last one in C order
+    is chosen: it is the choice of ndimage.maximum_position() with a stable sort. ndimage
+    itself sorts the whole frame with an unstable sort, so its choice among equal maxima
+    is arbitrary (it depends on the whole frame and on numpy sort implementation).
+
+    :param Data: 2D array
+    :param labels: array of int (same shape as Data) as returned by ndimage.label()
+    :param nblabels: nb of labels
+
+    :return: array (nblabels, 2) of int (i, j)
+    """
+    if nblabels == 0:
+        return np.zeros((0, 2), dtype=int)
+
+    i, j = np.nonzero(labels)
+    blobs = labels[i, j]
+    # sort by blob, then intensity, then pixel index: last pixel of each blob is the one
+    order = np.lexsort((np.ravel_multi_index((i, j), labels.shape), Data[i, j], blobs))
+    last = np.searchsorted(blobs[order], np.arange(1, nblabels + 1), side="right") - 1
+
+    return np.array([i[order[last]], j[order[last]]]).T
+
+
 def LocalMaxima_ndimage(Data,
                         peakVal=4,
                         boxsize=5,
@@ -2220,7 +3042,8 @@ def LocalMaxima_ndimage(Data,
                         threshold=1000,
                         connectivity=1,
                         returnfloatmeanpos=0,
-                        autothresholdpercentage=None):
+                        autothresholdpercentage=None,
+                        nbthreads=1):
 
     r"""
     returns (float) i,j positions in array of each blob
@@ -2245,18 +3068,23 @@ def LocalMaxima_ndimage(Data,
     autothresholdpercentage :
         threshold in filtered image with respect to the maximum intensity in filtered image
 
+    nbthreads :
+        nb of threads computing convolution by tiles (see ConvolvebyKernel)
+
     output:
     array (n,2): array of 2 indices
     """
-    aa = ConvolvebyKernel(Data, peakVal=peakVal, boxsize=boxsize, central_radius=central_radius)
+    aa = ConvolvebyKernel(Data, peakVal=peakVal, boxsize=boxsize, central_radius=central_radius,
+                                                                            nbthreads=nbthreads)
 
     print("Histogram after convolution with Mexican Hat")
     print(np.histogram(aa))
 
+    # boolean masks (1 byte per pixel)
     if autothresholdpercentage is None:
-        thraa = np.where(aa > threshold, 1, 0)
+        thraa = aa > threshold
     else:
-        thraa = np.where(aa > (autothresholdpercentage / 100.0) * np.amax(aa), 1, 0)
+        thraa = aa > (autothresholdpercentage / 100.0) * np.amax(aa)
 
     if connectivity == 0:
         star = np.eye(3)
@@ -2274,16 +3102,142 @@ def LocalMaxima_ndimage(Data,
     #                                                     np.arange(1, nf + 1)),
     #                                                     dtype=np.float)
 
-    meanpos = np.array(ndimage.measurements.maximum_position(thraa, ll, np.arange(1, nf + 1)),
-                                                                                    dtype=np.float)
+    # hottest pixel of each blob in convolved Data
+    meanpos = np.array(blobs_maximum_position(aa, ll, nf), dtype=float)
 
     if returnfloatmeanpos:
         return meanpos
     else:
-        return np.array(meanpos, dtype=np.int)
+        return np.array(meanpos, dtype=int)
 
 
-def ConvolvebyKernel(Data, peakVal=4, boxsize=5, central_radius=2):
+class KernelFilter(object):
+    r"""
+    2D convolution of images by a fixed kernel, by the fastest of three equivalent methods
+    (same boundary conditions as ndimage.convolve(mode='reflect')):
+
+    - 'direct': ndimage.convolve()
+    - 'separable': sum of 1D convolutions along rows and columns (kernel of low rank, from its SVD)
+    - 'fft': product of spectra of padded image and kernel. Kernel spectra are cached by frame shape
+
+    :param kernel: 2D array
+    :param dtype: float type of computations and result (np.float32 halves memory traffic)
+
+    usage::
+
+        mexicanhat = getMexicanHatFilter(4, 10, 2)
+        convolved = mexicanhat.convolve(dataimage)
+    """
+    def __init__(self, kernel, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        self.kernel = np.asarray(kernel, dtype=self.dtype)
+
+        u, sv, vt = np.linalg.svd(np.asarray(kernel, dtype=np.float64))
+        rank = int(np.sum(sv > sv[0] * 1e-7)) if sv[0] > 0 else 0
+        self.separablefactors = [((u[:, r] * sv[r]).astype(self.dtype), vt[r].astype(self.dtype))
+                                    for r in list(range(rank))]
+
+        self._fftkernels = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def getmethod(self, shape):
+        r"""
+        returns the fastest method ('direct', 'separable' or 'fft') for an image of shape
+        (see KERNELFILTER_COST_* constants)
+        """
+        costs = {"direct": KERNELFILTER_COST_DIRECT * self.kernel.size,
+                "separable": (KERNELFILTER_COST_SEPARABLE[0] + KERNELFILTER_COST_SEPARABLE[1]
+                                        * len(self.separablefactors) * sum(self.kernel.shape))}
+        if sfft is not None:
+            nbpixels = np.prod([n + 3 * k for n, k in zip(shape, self.kernel.shape)])
+            costs["fft"] = KERNELFILTER_COST_FFT * np.log2(nbpixels)
+
+        return min(costs, key=costs.get)
+
+    def _getfftkernel(self, paddedshape):
+        with self._lock:
+            if paddedshape in self._fftkernels:
+                self._fftkernels.move_to_end(paddedshape)
+                return self._fftkernels[paddedshape]
+
+        fftkernel = sfft.rfft2(self.kernel, paddedshape)
+        with self._lock:
+            self._fftkernels[paddedshape] = fftkernel
+            while len(self._fftkernels) > KERNELFILTER_MAXFFTSHAPES:
+                self._fftkernels.popitem(last=False)
+        return fftkernel
+
+    def convolve(self, Data, method=None, workers=1):
+        r"""
+        returns Data convolved by kernel (array of self.dtype, same shape as Data)
+
+        :param method: None (fastest for Data shape), 'direct', 'separable' or 'fft'
+        :param workers: nb of threads computing FFTs ('fft' method)
+        """
+        Data = np.asarray(Data)
+        if not np.issubdtype(Data.dtype, np.integer):
+            Data = Data.astype(self.dtype, copy=False)
+        # integer data (e.g. uint16 detector frames) are not promoted: ndimage converts
+        # them line by line, and only the padded frame is cast for the FFTs
+        if method is None:
+            method = self.getmethod(Data.shape)
+
+        if method == "direct":
+            return ndimage.convolve(Data, self.kernel, output=self.dtype)
+
+        elif method == "separable":
+            result = np.zeros(Data.shape, dtype=self.dtype)
+            for columnfactor, rowfactor in self.separablefactors:
+                result += ndimage.convolve1d(ndimage.convolve1d(Data, columnfactor, axis=0,
+                                                                            output=self.dtype),
+                                                                            rowfactor, axis=1)
+            return result
+
+        elif method == "fft":
+            # 'symmetric' padding is ndimage 'reflect' mode
+            pad = self.kernel.shape
+            paddeddata = np.pad(Data, [(k, k) for k in pad], mode="symmetric").astype(self.dtype,
+                                                                                    copy=False)
+            paddedshape = tuple(sfft.next_fast_len(n + k - 1, real=True)
+                                                    for n, k in zip(paddeddata.shape, pad))
+            spectrum = sfft.rfft2(paddeddata, paddedshape, workers=workers)
+            spectrum *= self._getfftkernel(paddedshape)
+            full = sfft.irfft2(spectrum, paddedshape, workers=workers)
+            # center of kernel is element k // 2 (as in ndimage.convolve)
+            i0, j0 = [k + k // 2 for k in pad]
+            return full[i0:i0 + Data.shape[0], j0:j0 + Data.shape[1]].astype(self.dtype,
+                                                                                copy=False)
+
+        raise ValueError("Unknown convolution method %s in KernelFilter" % method)
+
+
+_KERNELFILTERS = collections.OrderedDict()
+
+
+def getMexicanHatFilter(peakVal=4, boxsize=5, central_radius=2, dtype=np.float32):
+    r"""
+    return cached KernelFilter of mexican hat kernel (LoGArr()) used by ConvolvebyKernel()
+    """
+    key = (peakVal, boxsize, central_radius, np.dtype(dtype).str)
+    if key in _KERNELFILTERS:
+        _KERNELFILTERS.move_to_end(key)
+        return _KERNELFILTERS[key]
+
+    mexicanhat = LoGArr((boxsize, boxsize), r0=central_radius, peakVal=peakVal)
+    # (sum of python: mean of each kernel column is removed)
+    mexicanhat = mexicanhat - sum(mexicanhat) / mexicanhat.size
+
+    kernelfilter = KernelFilter(mexicanhat, dtype=dtype)
+    _KERNELFILTERS[key] = kernelfilter
+    while len(_KERNELFILTERS) > KERNELFILTER_MAXITEMS:
+        _KERNELFILTERS.popitem(last=False)
+    return kernelfilter
+
+
+def ConvolvebyKernel(Data, peakVal=4, boxsize=5, central_radius=2, nbthreads=1,
+                                                                tilesize=LOCALMAXIMA_TILESIZE,
+                                                                method=None,
+                                                                dtype=np.float32):
     """
     Convolve Data array witn mexican-hat kernel
 
@@ -2292,6 +3246,11 @@ def ConvolvebyKernel(Data, peakVal=4, boxsize=5, central_radius=2):
     peakVal > central_radius        : defines pixel distance from box center where weights are positive
                                     (in the middle) and negative farther to converge back to zero
     boxsize                            : size of the box
+    nbthreads                       : if > 1, convolve overlapping tiles of Data in parallel threads
+                                      (see apply_by_tiles()), or compute FFTs with threads
+                                      ('fft' method). Same result as nbthreads=1
+    method                          : None (fastest), 'direct', 'separable' or 'fft' (see KernelFilter)
+    dtype                           : float type of result
 
     ouput:
     array  (same shape as Data)
@@ -2308,9 +3267,24 @@ def ConvolvebyKernel(Data, peakVal=4, boxsize=5, central_radius=2):
     # bb=ndimage.morphology.white_tophat(Data,(boxsize,boxsize))
     # mexicanhat = array(LoGArr((10,10),r0=6,peakVal=4),dtype= int16)
 
-    mexicanhat = LoGArr((boxsize, boxsize), r0=central_radius, peakVal=peakVal)
-    mexicanhat = mexicanhat - sum(mexicanhat) / mexicanhat.size
-    bb = ndimage.convolve(np.array(Data, dtype=np.float32), mexicanhat)
+    # kernel (and its spectra) built once for all images
+    mexicanhat = getMexicanHatFilter(peakVal, boxsize, central_radius, dtype=dtype)
+
+    if method is None:
+        method = mexicanhat.getmethod(np.shape(Data))
+
+    if nbthreads > 1 and method == "fft":
+        # FFTs of the whole Data computed by threads
+        return mexicanhat.convolve(Data, method=method, workers=nbthreads)
+
+    if nbthreads > 1:
+        # same method for all tiles as for the whole Data (identical results)
+        return apply_by_tiles(lambda tile: mexicanhat.convolve(tile, method=method),
+                                Data, max(mexicanhat.kernel.shape), mexicanhat.dtype,
+                                tilesize=tilesize,
+                                nbthreads=nbthreads)
+
+    bb = mexicanhat.convolve(Data, method=method)
 
     return bb
 
@@ -2322,7 +3296,8 @@ def LocalMaxima_KernelConvolution(Data, framedim=(2048, 2048),
                             IntensityThreshold=500,
                             boxsize_for_probing_minimal_value_background=30,
                             return_nb_raw_blobs=0,
-                            peakposition_definition="max"):  # full side length
+                            peakposition_definition="max",
+                            nbthreads=1):  # full side length
     r"""
     return local maxima (blobs) position and amplitude in Data by using
     convolution with a mexican hat like kernel.
@@ -2354,6 +3329,8 @@ def LocalMaxima_KernelConvolution(Data, framedim=(2048, 2048),
                               key to assign to the blob position its hottest pixel position
                               or its center (no weight)
 
+    nbthreads : nb of threads convolving tiles of Data (same results as nbthreads=1)
+
     Returns:
     --
 
@@ -2375,9 +3352,10 @@ def LocalMaxima_KernelConvolution(Data, framedim=(2048, 2048),
                                 central_radius=central_radiusConvolve,
                                 threshold=thresholdConvolve,
                                 connectivity=connectivity,
-                                returnfloatmeanpos=0)
+                                returnfloatmeanpos=0,
+                                nbthreads=nbthreads)
 
-    if not peak:
+    if len(peak) == 0:
         return None
 
     peak = (peak[:, 0], peak[:, 1])
@@ -2526,20 +3504,80 @@ def LocalMaxima_KernelConvolution(Data, framedim=(2048, 2048),
 #         return np.fliplr(th_peaklist), Ipixmax
 
 
+def clusterClosePixels(pixels, pixeldistance):
+    r"""
+    gather pixels in clusters: two pixels closer than pixeldistance belong to the same cluster
+    (see spatialindex.clusterClosePoints())
+
+    :param pixels: array (n, 2) of pixel indices
+    :param pixeldistance: (strict) maximum distance between two neighbouring pixels of a cluster
+
+    :return: labels, nbclusters. labels is an array of n cluster indices. Clusters are numbered
+             by increasing index of their first pixel in pixels
+    """
+    return SI.clusterClosePoints(pixels, pixeldistance)
+
+
+def meanpos_ClosePixels(pixels, pixeldistance):
+    r"""
+    return integer mean position of each cluster of close pixels (see clusterClosePixels())
+
+    :param pixels: array (n, 2) of pixel indices
+    :param pixeldistance: (strict) maximum distance between two neighbouring pixels of a cluster
+
+    :return: array (nbclusters, 2) of int
+    """
+    pixels = np.asarray(pixels)
+    labels, nbclusters = clusterClosePixels(pixels, pixeldistance)
+    nbpixels_in_cluster = np.bincount(labels, minlength=nbclusters)
+    meanpos = np.column_stack([np.bincount(labels, weights=pixels[:, k], minlength=nbclusters)
+                                for k in (0, 1)]) / nbpixels_in_cluster[:, None]
+
+    return meanpos.astype(int)
+
+
+def LocalMaxima_fromSeeds(Data, seeds, maxshift=SEEDEDPEAKSEARCH_MAXSHIFT):
+    r"""
+    return hottest pixel around each seed position (e.g. peaks of a neighbouring image of a map)
+
+    :param Data: 2D array
+    :param seeds: array (n, 2) of (X, Y) positions (X column index, Y row index of Data)
+    :param maxshift: half side length (pixel) of the square box around each seed
+
+    :return: peaklist (n, 2) of (X, Y) integer positions of hottest pixels, Ipixmax (n) their intensity,
+            minimum intensity (n) in each box
+    """
+    seeds = np.asarray(seeds, dtype=float).reshape((-1, 2))
+    rows, columns, mask = getROIsindices(seeds, Data.shape, halfboxsize=maxshift)
+
+    boxes = np.where(mask, Data[rows, columns], np.amin(Data))
+    hottest = np.argmax(boxes.reshape((len(seeds), -1)), axis=1)
+    i_hot, j_hot = np.unravel_index(hottest, boxes.shape[1:])
+    nbseeds = np.arange(len(seeds))
+
+    peaklist = np.array([columns[nbseeds, 0, j_hot], rows[nbseeds, i_hot, 0]]).T
+    Ipixmax = boxes[nbseeds, i_hot, j_hot]
+    Ipixmin = np.amin(np.where(mask, boxes, Ipixmax[:, None, None]), axis=(1, 2))
+
+    return peaklist, Ipixmax, Ipixmin
+
+
 def LocalMaxima_ShiftArrays(Data, framedim=(2048, 2048), IntensityThreshold=500,
                                 Saturation_value=65535,
                                 boxsize_for_probing_minimal_value_background=30,  # full side length
                                 nb_of_shift=25,
                                 pixeldistance_remove_duplicates=25,
-                                verbose=0):
+                                verbose=0,
+                                nbthreads=1):
+    r"""
+    return local maxima position and amplitude in Data found by comparison of each pixel
+    with its neighbours up to nb_of_shift pixels (see localmaxima())
 
-    try:
-        import networkx as NX
-    except ImportError:
-        print("\n***********************************************************")
-        print("networkx module is missing! Some functions may not work...\nPlease install it at http://networkx.github.io/")
-        print("***********************************************************\n")
+    nbthreads : nb of threads searching local maxima in tiles of Data (same results as nbthreads=1)
 
+    saturated pixels (>= Saturation_value) closer than 20 pixels are merged into a single peak
+    located at their mean position (see meanpos_ClosePixels())
+    """
     # time_0 = ttt.time()
     # pilimage,dataimage=readoneimage_full(filename)
 
@@ -2561,7 +3599,7 @@ def LocalMaxima_ShiftArrays(Data, framedim=(2048, 2048), IntensityThreshold=500,
 
     print("searching local maxima for non saturated consecutive pixels")
 
-    peak = localmaxima(dataimage_ROI, nb_of_shift, diags=1)
+    peak = localmaxima(dataimage_ROI, nb_of_shift, diags=1, nbthreads=nbthreads)
 
     print("Done...!")
     print(peak)
@@ -2592,31 +3630,9 @@ def LocalMaxima_ShiftArrays(Data, framedim=(2048, 2048), IntensityThreshold=500,
         if verbose:
             print("positions of saturated pixels \n", sat_pix)
 
-        # use of graph algorithms
+        # clusters of close saturated pixels and their average pixel
         sat_pix = np.column_stack(sat_pix)
-
-        disttable_sat = ssd.pdist(sat_pix, "euclidean")
-        sqdistmatrix_sat = ssd.squareform(disttable_sat)
-        # building adjencymat
-
-        a, b = np.indices(sqdistmatrix_sat.shape)
-        indymat = np.triu(b) + np.tril(a)
-        cond2 = np.logical_and(sqdistmatrix_sat < Size_of_pixelconnection, sqdistmatrix_sat > 0)
-        adjencymat = np.where(cond2, indymat, 0)
-
-        # print "before networkx"
-        print("networkx version", NX.__version__)
-        GGraw = NX.to_networkx_graph(adjencymat, create_using=NX.Graph())
-        list_of_cliques = NX.find_cliques(GGraw)
-        # print "after networkx"
-
-        # now find average pixel of each clique
-        sat_pix_mean = []
-        for clique in list_of_cliques:
-            ii, jj = np.mean(sat_pix[clique], axis=0)
-            sat_pix_mean.append([int(ii), int(jj)])
-
-        sat_pix_mean = np.array(sat_pix_mean)
+        sat_pix_mean = meanpos_ClosePixels(sat_pix, Size_of_pixelconnection)
         print("Mean position of saturated pixels blobs = \n", sat_pix_mean)
 
         # if 0:  # of scipy.ndimage
@@ -2769,15 +3785,14 @@ def LocalMaxima_from_thresholdarray(Data, IntensityThreshold=400, rois=None, fra
             # print('max intensity in dataroi  2  :  ', np.amax(dataroi))
 
             # blob seach in dataroi
-            thrData_for_label = np.where(dataroi > IntensityThreshold, 1, 0)
+            thrData_for_label = dataroi > IntensityThreshold
 
             ll, nf = ndimage.label(thrData_for_label)
             if nf == 0:
                 print('sad! No blobs there in this roi...')
                 continue
 
-            meanpos_roi = np.array(ndimage.measurements.maximum_position(dataroi, ll, np.arange(1, nf + 1)),
-                dtype=float)
+            meanpos_roi = np.array(blobs_maximum_position(dataroi, ll, nf), dtype=float)
 
             if len(np.shape(meanpos_roi)) > 1:
                 meanpos_roi = np.fliplr(meanpos_roi)
@@ -2795,7 +3810,8 @@ def LocalMaxima_from_thresholdarray(Data, IntensityThreshold=400, rois=None, fra
 
     # single ROI is whole Data
     else:
-        thrData_for_label = np.where(Data > IntensityThreshold, 1, 0)
+        # boolean mask: Data are not promoted
+        thrData_for_label = Data > IntensityThreshold
 
         #     thrData = np.where(Data > IntensityThreshold, Data, 0)
 
@@ -2809,8 +3825,7 @@ def LocalMaxima_from_thresholdarray(Data, IntensityThreshold=400, rois=None, fra
         if nf == 0:
             return None
 
-        meanpos = np.array(ndimage.measurements.maximum_position(Data, ll, np.arange(1, nf + 1)),
-            dtype=float)
+        meanpos = np.array(blobs_maximum_position(Data, ll, nf), dtype=float)
 
         if len(np.shape(meanpos)) > 1:
             meanpos = np.fliplr(meanpos)
@@ -2822,7 +3837,7 @@ def LocalMaxima_from_thresholdarray(Data, IntensityThreshold=400, rois=None, fra
 
 
 
-def localmaxima(DataArray, n, diags=1, verbose=0):
+def localmaxima(DataArray, n, diags=1, verbose=0, nbthreads=1, tilesize=LOCALMAXIMA_TILESIZE):
     """
     from DataArray 2D  returns (array([i1,i2,...,ip]),array([j1,j2,...,jp]))
     of indices where pixels value is higher in two direction up to n pixels
@@ -2839,9 +3854,23 @@ def localmaxima(DataArray, n, diags=1, verbose=0):
                 (array2d <= np.roll(array2d, -1, 1)))
 
     WARNING: flat top peak are not detected !!
+
+    nbthreads > 1: search in overlapping tiles of DataArray in parallel threads (same result)
     """
     dim = len(np.shape(DataArray))
 
+    if nbthreads > 1 and dim == 2:
+
+        def localmaxima_flags(tile):
+            flags = np.zeros(tile.shape, dtype=bool)
+            flags[localmaxima(tile, n, diags=diags)] = True
+            return flags
+
+        flags = apply_by_tiles(localmaxima_flags, DataArray, n, bool, tilesize=tilesize,
+                                                                        nbthreads=nbthreads)
+        # same (row major) order as untiled search
+        return np.nonzero(flags)
+
     if diags:
         c, alll, allr, alld, allu, diag11, diag12, diag21, diag22 = shiftarrays_accum(
             DataArray, n, dimensions=dim, diags=diags)
@@ -3049,7 +4078,8 @@ def fitoneimage_manypeaks(filename, peaklist, boxsize, stackimageindex=-1,
                                                     ComputeIpixmax=False,
                                                     use_data_corrected=None,
                                                     reject_negative_baseline=True,
-                                                    purgeDuplicates=True):
+                                                    purgeDuplicates=True,
+                                                    batchfit=True):
 
     """
     fit multiple ROI data to get peaks position in a single image
@@ -3063,6 +4093,9 @@ def fitoneimage_manypeaks(filename, peaklist, boxsize, stackimageindex=-1,
 
     purgeDuplicates    : True   remove duplicates that are close within pixel distance of 'boxsize' and keep the most intense peak
 
+    batchfit   : True  all ROIs are fitted together (vectorized fit with analytic derivatives)
+                 False  one scipy leastsq fit per ROI (see readoneimage_multiROIfit())
+
     use_data_corrected   :  enter data instead of reading data from file
                         must be a tuple of 3 elements:
                         fulldata, framedim, fliprot
@@ -3099,7 +4132,8 @@ def fitoneimage_manypeaks(filename, peaklist, boxsize, stackimageindex=-1,
                                         fitfunc=type_of_function,
                                         xtol=xtol,
                                         addImax=ComputeIpixmax,
-                                        use_data_corrected=use_data_corrected)
+                                        use_data_corrected=use_data_corrected,
+                                        batchfit=batchfit)
 
     print("fitting time for {} peaks is : {:.4f}".format(len(peaklist), ttt.time() - tstart))
     print("nb of results: ", len(ResFit[0]))
@@ -3267,6 +4301,64 @@ def fitoneimage_manypeaks(filename, peaklist, boxsize, stackimageindex=-1,
     return tabIsorted, par, peaklist
 
 
+class PeakMemoryTracer(object):
+    r"""
+    context manager measuring peak memory (python and numpy allocations traced by tracemalloc)
+    of a block of code
+
+    usage::
+
+        with PeakMemoryTracer() as tracer:
+            PeakSearch(filename, ...)
+        print(tracer.peakmemory_MB)
+
+    Tracing slows down python code. If tracemalloc is already tracing (nested tracers), peak is
+    measured relatively to the traced memory at entry and tracing is not stopped at exit.
+    """
+    def __init__(self):
+        self.peakmemory = 0
+        self._started = False
+        self._memory_at_entry = 0
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            self._memory_at_entry = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, "reset_peak"):  # python >= 3.9
+                tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+            self._started = True
+        return self
+
+    def __exit__(self, *args):
+        self.peakmemory = tracemalloc.get_traced_memory()[1] - self._memory_at_entry
+        if self._started:
+            tracemalloc.stop()
+        return False
+
+    @property
+    def peakmemory_MB(self):
+        return self.peakmemory / 2.0 ** 20
+
+
+def reportpeakmemory(func):
+    r"""
+    decorator printing peak memory of func call when it is called with write_peak_memory=1
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not kwargs.get("write_peak_memory", 0):
+            return func(*args, **kwargs)
+
+        with PeakMemoryTracer() as tracer:
+            result = func(*args, **kwargs)
+        print("{}. Peak memory : {:.1f} MB".format(func.__name__, tracer.peakmemory_MB))
+        return result
+
+    return wrapper
+
+
+@reportpeakmemory
 def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
                                                 boxsizeROI=(200, 200),  # use only if center != None
                                                 PixelNearRadius=5,
@@ -3295,10 +4387,20 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
                                                 NumberMaxofFits=5000,
                                                 reject_negative_baseline=True,
                                                 formulaexpression="A-1.1*B",
-                                                listrois=None):
+                                                listrois=None,
+                                                dataimage=None,
+                                                rollingbackground=None,
+                                                nbthreads=1,
+                                                seedpeaks=None,
+                                                seed_maxshift=SEEDEDPEAKSEARCH_MAXSHIFT,
+                                                write_peak_memory=0):
     """
     Find local intensity maxima as starting position for fittinng and return peaklist.
 
+    Image data are kept in their native dtype (e.g. uint16) for thresholding and local maxima
+    search (methods 0 and 1 and seeded search). Only small ROIs around peaks are promoted
+    to float for fitting. Method 2 needs a float32 convolved image.
+
     Parameters
     filename : string
                full path to image data file
@@ -3385,6 +4487,8 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
                                 (and not necessarly for peaks fitting procedure):
                               -  ndarray     = array data
                               - 'auto_background'  = calculate and remove background computed from image data itself (read in file 'filename')
+                              - 'rolling_background'  = remove background estimated from previous images of the series
+                                                        (see 'rollingbackground')
                               - path to image file (string)  = B image to be used in a mathematical operation with Ato current image
 
     Fit_with_Data_for_localMaxima    : use 'Data_for_localMaxima' object as image when refining peaks position and shape
@@ -3399,6 +4503,25 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
     reject_negative_baseline        :  True  reject refined peak result if intensity baseline (local background) is negative
                                         (2D model is maybe not suitable)
 
+    dataimage   :  None, or tuple (data array, framedim, fliprot) as returned by readCCDimage(filename)
+                    when image has already been read (e.g. by ImagePrefetcher). Image file is then
+                    not read again (neither for local maxima search nor for peaks fitting)
+
+    rollingbackground   :  RollingBackground object shared by successive calls on images of a series
+                            when Data_for_localMaxima = 'rolling_background'
+
+    nbthreads   :  nb of threads for local maxima search (methods 1 and 2). If > 1, image is
+                    processed by overlapping tiles in parallel (same results as nbthreads=1)
+
+    seedpeaks   :  None, or array (n, 2) of X, Y peaks positions (same convention as output,
+                    e.g. peaks found in a neighbouring image of a map). Local maxima are then
+                    only the hottest pixels within seed_maxshift pixels of each seed
+                    (see LocalMaxima_fromSeeds()) instead of a search in the whole image.
+                    position_definition must be 0, 1 or 2 (ValueError otherwise)
+
+    write_peak_memory   :  1 to print peak memory of the call (see PeakMemoryTracer).
+                            Tracing memory slows down the peak search
+
     returns:
 
     peak list sorted by decreasing (integrated intensity - fitted bkg)
@@ -3410,6 +4533,7 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
 
     nb of output elements depends on 'return_histo' argument
     """
+    resolvePackedStackCCDLabel(CCDLabel)
 
     if return_histo in (0, 1):
         return_nb_raw_blobs = 0
@@ -3426,17 +4550,21 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
         #         print "min, max intensity", np.amin(Data), np.amax(Data)
         # TODO to test with VHR
         framedim = Data.shape
+        fliprot = DictLT.dict_CCD[CCDLabel][3]
         ttread = ttt.time()
 
     # Data are read from image file
     elif isinstance(Data_for_localMaxima, str) or Data_for_localMaxima is None:
 
-        Data, framedim, fliprot = readCCDimage(filename,
+        if dataimage is not None:
+            Data, framedim, fliprot = dataimage
+        else:
+            Data, framedim, fliprot = readCCDimage(filename,
                                                 stackimageindex=stackimageindex,
                                                 CCDLabel=CCDLabel,
                                                 dirname=None,
                                                 verbose=1)
-        print("image from filename {} read!".format(filename))
+            print("image from filename {} read!".format(filename))
 
         # peak search in a single and particular region of image
         if center is not None:
@@ -3467,18 +4595,33 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
         # compute and remove background from this image
         if Data_for_localMaxima == "auto_background":
             print("computing background from current image ", filename)
-            backgroundimage = compute_autobackground_image(Data, boxsizefilter=10)
+            if center is None and filename is not None and os.path.isfile(filename):
+                # filtered once per image file (e.g. for successive peak searches of the same image)
+                backgroundimage = getBackgroundCache().getfilteredimage(filename,
+                                                                CCDLabel=CCDLabel,
+                                                                stackimageindex=stackimageindex,
+                                                                boxsizefilter=10,
+                                                                dataimage=Data)
+            else:
+                backgroundimage = compute_autobackground_image(Data, boxsizefilter=10)
             # basic substraction
             usemask = True
+        elif Data_for_localMaxima == "rolling_background":
+            if rollingbackground is None:
+                rollingbackground = RollingBackground(boxsizefilter=10)
+            backgroundimage = rollingbackground.getbackground(Data)
+            usemask = True
         # path to a background image file
         else:
-            if stackimageindex == -1:
+            if stackimageindex != -1:
                 raise ValueError("Use stacked images as background is not implement")
             path_to_bkgfile = Data_for_localMaxima
             print("Using image file {} as background".format(path_to_bkgfile))
             try:
-                backgroundimage, _, _ = readCCDimage(path_to_bkgfile,
-                                                                        CCDLabel=CCDLabel)
+                # decoded once for all images of a series
+                backgroundimage = getBackgroundCache().getimage(path_to_bkgfile,
+                                                                CCDLabel=CCDLabel,
+                                                                dtype=np.float32)
             except IOError:
                 raise ValueError("{} does not seem to be a path file ".format(path_to_bkgfile))
 
@@ -3491,8 +4634,36 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
     print("Data.shape for local maxima", Data.shape)
 
     # --- PRE SELECTION OF HOT PIXELS as STARTING POINTS FOR FITTING ---------
+    # seeded search ---------- "hottest pixels close to given peaks"
+    if seedpeaks is not None:
+        if center is not None:
+            raise ValueError("seedpeaks can not be used with a peak search in a ROI (center)")
+
+        print("Using {} seed peaks to find local maxima".format(len(seedpeaks)))
+        # back to array indices: inverse of the offsets applied to output peaks
+        seeds = np.array(seedpeaks, dtype=float)[:, :2]
+        if position_definition == 1:  # XMAS like offset
+            seeds = seeds - 1.
+        elif position_definition == 2:
+            if fit_peaks_gaussian == 0:  # fit2D offset
+                seeds[:, 0] = seeds[:, 0] - 0.5
+                seeds[:, 1] = framedim[0] - seeds[:, 1] + 0.5
+            # fitted peaks positions are not offset with position_definition = 2
+        elif position_definition != 0:
+            raise ValueError("position_definition %s not supported with seedpeaks"
+                                                                    % str(position_definition))
+        peaklist, Ipixmax, Ipixmin = LocalMaxima_fromSeeds(Data, seeds, maxshift=seed_maxshift)
+
+        # thresholding on amplitude above local background as for other methods
+        abovethreshold = (Ipixmax - Ipixmin) > IntensityThreshold
+        peaklist, Ipixmax = peaklist[abovethreshold], Ipixmax[abovethreshold]
+        print("{} local maxima found after thresholding above {} amplitude above local "
+                                "background".format(len(peaklist), IntensityThreshold))
+
+        ComputeIpixmax = True
+
     # first method ---------- "Basic Intensity Threshold"
-    if local_maxima_search_method in (0, "0"):
+    elif local_maxima_search_method in (0, "0"):
 
         print("Using simple intensity thresholding to detect local maxima (method 1/3)")
         peaklist = LocalMaxima_from_thresholdarray(Data, IntensityThreshold=IntensityThreshold,
@@ -3507,7 +4678,7 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
             ComputeIpixmax = False
 
     # second method ----------- "Local Maxima in a box by shift array method"
-    if local_maxima_search_method in (1, "1"):
+    elif local_maxima_search_method in (1, "1"):
         # flat top peaks (e.g. saturation) are NOT well detected
         print("Using shift arrays to detect local maxima (method 2/3)")
         peaklist, Ipixmax = LocalMaxima_ShiftArrays(Data,
@@ -3516,12 +4687,13 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
                                         Saturation_value=Saturation_value_flatpeak,
                                         boxsize_for_probing_minimal_value_background=boxsize,  # 30
                                         pixeldistance_remove_duplicates=PixelNearRadius,  # 25
-                                        nb_of_shift=boxsize)  # 25
+                                        nb_of_shift=boxsize,  # 25
+                                        nbthreads=nbthreads)
 
         ComputeIpixmax = True
 
     # third method: ------------ "Convolution by a gaussian kernel"
-    if local_maxima_search_method in (2, "2"):
+    elif local_maxima_search_method in (2, "2"):
 
         print("Using mexican hat convolution to detect local maxima (method 3/3)")
 
@@ -3537,7 +4709,8 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
                                         IntensityThreshold=IntensityThreshold,
                                         boxsize_for_probing_minimal_value_background=PixelNearRadius,
                                         return_nb_raw_blobs=return_nb_raw_blobs,
-                                        peakposition_definition=peakposition_definition)
+                                        peakposition_definition=peakposition_definition,
+                                        nbthreads=nbthreads)
 
         if Candidates is None:
             print("No local maxima found, change peak search parameters !!!")
@@ -3692,7 +4865,8 @@ def PeakSearch(filename, stackimageindex=-1, CCDLabel="PRINCETON", center=None,
     if Fit_with_Data_for_localMaxima:
         Data_to_Fit = (Data, framedim, fliprot)
     else:
-        Data_to_Fit = None
+        # None: data are read from file
+        Data_to_Fit = dataimage
 
     return fitoneimage_manypeaks(filename,
                                 peaklist,
@@ -3744,8 +4918,9 @@ def peaksearch_on_Image(filename_in, pspfile, background_flag="no", blacklistpea
 
     # flag_for_backgroundremoval is a file path to an imagefile
     # create background data: dataimage_bkg
-    if flag_for_backgroundremoval not in ("auto_background", None) and not isinstance(
-        flag_for_backgroundremoval, np.ndarray):
+    if flag_for_backgroundremoval not in ("auto_background", "rolling_background", None
+                                            ) and not isinstance(flag_for_backgroundremoval,
+                                                                                np.ndarray):
 
         fullpath_backgroundimage = psdict_Convolve["Data_for_localMaxima"]
 
@@ -3967,6 +5142,8 @@ def read_background_flag(background_flag):
 
     if background_flag in ("auto", "AUTO", "yes", "YES", "y"):
         Data_for_localMaxima = "auto_background"
+    elif background_flag in ("rolling", "ROLLING"):
+        Data_for_localMaxima = "rolling_background"
     elif background_flag in ("n", "no", "NO", None, "None", "NONE"):
         Data_for_localMaxima = None
     else:
@@ -4080,8 +5257,9 @@ def applyformula_on_images(A, B, formulaexpression="A-B", SaturationLevel=None,
     if A.shape != B.shape:
         raise ValueError("input arrays in applyformula_on_images() have not the same shape.")
 
-    A = np.array(A, dtype="float32")
-    B = np.array(B, dtype="float32")
+    # no copy of float32 arrays (e.g. cached background), formula does not modify A and B
+    A = np.asarray(A, dtype="float32")
+    B = np.asarray(B, dtype="float32")
 
     #        nbpix = A.shape[0] * A.shape[1]
     #        resformula = np.zeros_like(A)
@@ -4104,6 +5282,80 @@ def applyformula_on_images(A, B, formulaexpression="A-B", SaturationLevel=None,
 
 
 # --- -------------- multiple file peak search
+class ImagePrefetcher(object):
+    r"""
+    iterator over images of a list of files, reading next images in background threads
+
+    At most `nbprefetch` images (and at most `maxmemory` bytes of image data) are read in
+    advance so that disk or network latency overlaps with the processing of current image.
+
+    :param filenames: list of image files paths
+    :param CCDLabel: key of dict_CCD
+    :param nbprefetch: max nb of images read in advance
+    :param maxmemory: max size in bytes of images read in advance
+    :param nbthreads: nb of reading threads
+
+    :return: iterator of (filename, (dataimage, framedim, fliprot)) as returned by readCCDimage()
+        (reading exception of a file is raised when its item is requested)
+    """
+    def __init__(self, filenames, CCDLabel="MARCCD165", nbprefetch=PREFETCH_NBIMAGES,
+                                                        maxmemory=PREFETCH_MAXMEMORY,
+                                                        nbthreads=PREFETCH_NBTHREADS):
+        self.filenames = list(filenames)
+        self.CCDLabel = resolvePackedStackCCDLabel(CCDLabel)
+
+        framedim, _, _, _, _, formatdata = DictLT.dict_CCD[CCDLabel][:6]
+        try:
+            framebytes = framedim[0] * framedim[1] * np.dtype(formatdata).itemsize
+        except (TypeError, IndexError):  # frame size read in file header
+            framebytes = 2048 * 2048 * 4
+        self.nbprefetch = max(1, min(int(nbprefetch), int(maxmemory // framebytes)))
+        self.nbthreads = max(1, min(int(nbthreads), self.nbprefetch))
+
+    def _read(self, filename):
+        return readCCDimage(filename, CCDLabel=self.CCDLabel, dirname=None)
+
+    def __iter__(self):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.nbthreads)
+        queue = collections.deque()
+        filenames = iter(self.filenames)
+        try:
+            for filename in itertools.islice(filenames, self.nbprefetch):
+                queue.append((filename, executor.submit(self._read, filename)))
+
+            while queue:
+                filename, future = queue.popleft()
+                for nextfilename in itertools.islice(filenames, 1):
+                    queue.append((nextfilename, executor.submit(self._read, nextfilename)))
+                yield filename, future.result()
+        finally:
+            for _, future in queue:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+def update_seedpeaks(seedpeaks, Res, maxdistance=SEEDEDPEAKSEARCH_MAXSHIFT):
+    r"""
+    update seeds of seeded peak search with the peaks found from them
+
+    :param seedpeaks: array (n, 2) of X, Y seeds positions
+    :param Res: output of PeakSearch(seedpeaks=seedpeaks)
+    :param maxdistance: max distance (pixel) between a seed and its peak
+
+    :return: new seeds (peaks found, followed by seeds without peak that are kept for next images),
+            nb of seeds associated to a peak (see spottracking.matchSpots())
+    """
+    if Res in (False, None) or Res[0] is None:
+        return seedpeaks, 0
+
+    peaks_XY = np.array(Res[0])[:, :2]
+    correspondence, nocorrespondence = ST.matchSpots(seedpeaks, peaks_XY,
+                                                    maxdistancetolerance=maxdistance,
+                                                    minimum_seconddistance=0)
+
+    return np.vstack((peaks_XY, seedpeaks[nocorrespondence])), len(correspondence)
+
+
 def peaksearch_fileseries(fileindexrange,
                             filenameprefix,
                             suffix="",
@@ -4113,11 +5365,27 @@ def peaksearch_fileseries(fileindexrange,
                             dirname_out=None,
                             CCDLABEL="MARCCD165",
                             KF_DIRECTION="Z>0",  # not used yet
-                            dictPeakSearch=None):
+                            dictPeakSearch=None,
+                            nbprefetch=PREFETCH_NBIMAGES,
+                            prefetch_maxmemory=PREFETCH_MAXMEMORY,
+                            seeded=False,
+                            fullsearch_period=SEEDEDPEAKSEARCH_FULLSEARCHPERIOD):
     """
     peaksearch function to be called for multi or single processing
+
+    :param nbprefetch: nb of next images read in background threads (see ImagePrefetcher)
+                        during peak search of current image. 0 to read images sequentially
+    :param prefetch_maxmemory: max memory (bytes) of images read in advance
+    :param seeded: True, for series of spatially adjacent images (map): peaks of previous image
+                    are used as seeds of the peak search (see PeakSearch(seedpeaks)) and only their
+                    ROIs are fitted. A peak search in the whole image is performed every
+                    fullsearch_period images, or when less than SEEDEDPEAKSEARCH_MINFRACTION of
+                    seeds are found again
+    :param fullsearch_period: nb of images between two peak searches in the whole image
+                    (seeded mode)
     """
     print('\n\n ***** Starting peaksearch_fileseries()  *****\n\n')
+    resolvePackedStackCCDLabel(CCDLABEL)
     # peak search Parameters update from .psp file
     if isinstance(dictPeakSearch, dict):
         for key, val in list(dictPeakSearch.items()):
@@ -4171,8 +5439,9 @@ def peaksearch_fileseries(fileindexrange,
 
     # flag_for_backgroundremoval is a file path to an imagefile
     # create background data: dataimage_bkg
-    if flag_for_backgroundremoval not in ("auto_background", None) and not isinstance(
-        flag_for_backgroundremoval, np.ndarray):
+    if flag_for_backgroundremoval not in ("auto_background", "rolling_background", None
+                                            ) and not isinstance(flag_for_backgroundremoval,
+                                                                                np.ndarray):
 
         fullpath_backgroundimage = PEAKSEARCHDICT_Convolve["Data_for_localMaxima"]
 
@@ -4187,15 +5456,35 @@ def peaksearch_fileseries(fileindexrange,
 
         BackgroundImageCreated = True
 
-    for fileindex in list(range(fileindexrange[0],
-                        fileindexrange[1] + 1,
-                        fileindexrange[2])):
+    # background estimated from previous images of the series
+    rollingbackground = None
+    if isinstance(flag_for_backgroundremoval, str) and flag_for_backgroundremoval == "rolling_background":
+        rollingbackground = RollingBackground(boxsizefilter=10)
+
+    fileindices = list(range(fileindexrange[0], fileindexrange[1] + 1, fileindexrange[2]))
+    filenames_in = []
+    for fileindex in fileindices:
         # TODO to move this branching elsewhere (readmccd)
         if suffix.endswith("_mar.tif"):
             filename_in = setfilename(filenameprefix_in + "{}".format(fileindex) + suffix, fileindex)
         else:
             #             filename_in = filenameprefix_in + encodingdigits % fileindex + suffix
             filename_in = filenameprefix_in + str(fileindex).zfill(nbdigits) + suffix
+        filenames_in.append(filename_in)
+
+    # images are read in background threads while peaks are searched in current image
+    if nbprefetch > 0:
+        images = iter(ImagePrefetcher(filenames_in, CCDLabel=CCDLABEL,
+                                                    nbprefetch=nbprefetch,
+                                                    maxmemory=prefetch_maxmemory))
+    else:
+        images = ((filename_in, None) for filename_in in filenames_in)
+
+    # seeded mode: peaks positions of previous images, nb of images since last full search
+    seedpeaks = None
+    nb_seededsearches = 0
+
+    for fileindex, filename_in in zip(fileindices, filenames_in):
 
         tirets = "-" * 15
         print("\n\n {} PeakSearch on filename {}\n{}\n{}{}{}n\n".format(
@@ -4205,6 +5494,8 @@ def peaksearch_fileseries(fileindexrange,
             raise ValueError("\n\n*******\nSomething wrong with the filename: {}. Please check "
                                             "carefully the filename!".format(filename_in))
 
+        dataimage = next(images)[1]
+
         # remove a single image (considered as background) to current image
         if BackgroundImageCreated:
 
@@ -4244,11 +5535,40 @@ def peaksearch_fileseries(fileindexrange,
         # --------------------------
         # launch peaksearch
         # -----------------------
-        Res = PeakSearch(filename_in,
-                            CCDLabel=CCDLABEL,
-                            Saturation_value=DictLT.dict_CCD[CCDLABEL][2],
-                            Saturation_value_flatpeak=DictLT.dict_CCD[CCDLABEL][2],
-                            **PEAKSEARCHDICT_Convolve)
+        Res = None
+        if seeded and seedpeaks is not None and nb_seededsearches < fullsearch_period - 1:
+            Res = PeakSearch(filename_in,
+                                CCDLabel=CCDLABEL,
+                                Saturation_value=DictLT.dict_CCD[CCDLABEL][2],
+                                Saturation_value_flatpeak=DictLT.dict_CCD[CCDLABEL][2],
+                                dataimage=dataimage,
+                                rollingbackground=rollingbackground,
+                                seedpeaks=seedpeaks,
+                                **PEAKSEARCHDICT_Convolve)
+
+            nbseeds = len(seedpeaks)
+            seedpeaks, nbfound = update_seedpeaks(seedpeaks, Res)
+            if nbfound < SEEDEDPEAKSEARCH_MINFRACTION * nbseeds:
+                print("Only {} over {} seed peaks found. Peak search in the whole image".format(
+                                                                                nbfound, nbseeds))
+                Res = None
+            else:
+                nb_seededsearches += 1
+
+        if Res is None:
+            Res = PeakSearch(filename_in,
+                                CCDLabel=CCDLABEL,
+                                Saturation_value=DictLT.dict_CCD[CCDLABEL][2],
+                                Saturation_value_flatpeak=DictLT.dict_CCD[CCDLABEL][2],
+                                dataimage=dataimage,
+                                rollingbackground=rollingbackground,
+                                **PEAKSEARCHDICT_Convolve)
+            if seeded:
+                seedpeaks = None
+                if Res not in (False, None) and Res[0] is not None:
+                    seedpeaks = np.array(Res[0])[:, :2]
+                nb_seededsearches = 0
+        dataimage = None
 
         if Res in (False, None):
             print("No peak found for image file: ", filename_in)
@@ -4288,9 +5608,12 @@ def peaksearch_multiprocessing(fileindexrange, filenameprefix, suffix="",
                                                     CCDLABEL="MARCCD165",
                                                     KF_DIRECTION="Z>0",
                                                     dictPeakSearch=None,
-                                                    nb_of_cpu=2):
+                                                    nb_of_cpu=2,
+                                                    seeded=False):
     """
     launch several processes in parallel
+
+    seeded : seeded peak search in each (contiguous) part of the file series (see peaksearch_fileseries)
     """
     import multiprocessing
 
@@ -4324,7 +5647,8 @@ def peaksearch_multiprocessing(fileindexrange, filenameprefix, suffix="",
                                             dirname_out,
                                             CCDLABEL,
                                             KF_DIRECTION,
-                                            dictPeakSearch))
+                                            dictPeakSearch),
+                                        kwargs={"seeded": seeded})
         jobs.append(proc)
         proc.start()
 
@@ -4393,6 +5717,139 @@ def circularMask(center, radius, arrayshape):
     return cond
 
 
+class BackgroundCache(object):
+    r"""
+    least recently used cache of background arrays used in peak search of image series
+
+    Cached arrays are read-only: image files used as background (decoded once per file
+    modification time), their minimum filtered versions, and circular masks.
+
+    :param maxitems: max nb of cached arrays
+
+    usage::
+
+        bkgcache = getBackgroundCache()
+        B = bkgcache.getimage("dark.mccd", CCDLabel="MARCCD165", dtype=np.float32)
+    """
+    def __init__(self, maxitems=BACKGROUNDCACHE_MAXITEMS):
+        self.maxitems = max(int(maxitems), 1)
+        self.cache = collections.OrderedDict()
+
+    def _get(self, key, compute):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        array = compute()
+        array.flags.writeable = False
+        self.cache[key] = array
+        while len(self.cache) > self.maxitems:
+            self.cache.popitem(last=False)
+        return array
+
+    @staticmethod
+    def _filekey(filename, CCDLabel, stackimageindex):
+        filestat = os.stat(filename)
+        return (os.path.abspath(filename), filestat.st_mtime, filestat.st_size, CCDLabel,
+                                                                            stackimageindex)
+
+    def getimage(self, filename, CCDLabel="MARCCD165", stackimageindex=-1, dtype=None):
+        r"""
+        returns image data of filename (as read by readCCDimage) converted to dtype if not None
+        """
+        key = self._filekey(filename, CCDLabel, stackimageindex) + ("image", dtype)
+
+        def compute():
+            dataimage = readCCDimage(filename, CCDLabel=CCDLabel, dirname=None,
+                                                        stackimageindex=stackimageindex)[0]
+            if dtype is not None:
+                dataimage = dataimage.astype(dtype)
+            return dataimage
+
+        return self._get(key, compute)
+
+    def getfilteredimage(self, filename, CCDLabel="MARCCD165", stackimageindex=-1,
+                                                                        boxsizefilter=10,
+                                                                        dataimage=None):
+        r"""
+        returns background computed by compute_autobackground_image() on image of filename
+
+        :param dataimage: image data of filename if already read (file is then not read)
+        """
+        key = self._filekey(filename, CCDLabel, stackimageindex) + ("minimum", boxsizefilter)
+
+        def compute():
+            if dataimage is None:
+                return compute_autobackground_image(self.getimage(filename, CCDLabel,
+                                                                    stackimageindex),
+                                                    boxsizefilter=boxsizefilter)
+            return compute_autobackground_image(dataimage, boxsizefilter=boxsizefilter)
+
+        return self._get(key, compute)
+
+    def getmask(self, center, radius, arrayshape):
+        r"""
+        returns boolean array of pixels inside circle (see circularMask())
+        """
+        key = ("mask", tuple(center), radius, tuple(arrayshape))
+        return self._get(key, lambda: circularMask(center, radius, arrayshape))
+
+    def clear(self):
+        self.cache.clear()
+
+
+_BACKGROUNDCACHE = None
+
+
+def getBackgroundCache():
+    r""" returns background cache shared by module functions (created at first call) """
+    global _BACKGROUNDCACHE
+    if _BACKGROUNDCACHE is None:
+        _BACKGROUNDCACHE = BackgroundCache()
+    return _BACKGROUNDCACHE
+
+
+class RollingBackground(object):
+    r"""
+    background of successive images of a series estimated from neighbouring (previous) frames
+
+    Background (minimum filter, see compute_autobackground_image()) is computed only every
+    `updateperiod` frames and averaged over the last `nbestimates` computations, so that
+    background removal of other frames is a simple array subtraction.
+    With updateperiod=1 and nbestimates=1, background is the one of 'auto_background'.
+
+    :param boxsizefilter: size of minimum filter
+    :param updateperiod: nb of frames between two computations of background
+    :param nbestimates: nb of last computed backgrounds that are averaged
+    """
+    def __init__(self, boxsizefilter=10, updateperiod=ROLLINGBACKGROUND_UPDATEPERIOD,
+                                                    nbestimates=ROLLINGBACKGROUND_NBESTIMATES):
+        self.boxsizefilter = boxsizefilter
+        self.updateperiod = max(int(updateperiod), 1)
+        self.estimates = collections.deque(maxlen=max(int(nbestimates), 1))
+        self.background = None
+        self.nbframes = 0
+
+    def getbackground(self, dataimage):
+        r"""
+        returns background (read-only) to be removed from dataimage (next frame of the series)
+        """
+        if (self.background is None or self.background.shape != dataimage.shape
+                                        or self.nbframes % self.updateperiod == 0):
+            if self.background is not None and self.background.shape != dataimage.shape:
+                self.estimates.clear()
+            # float background: pixels of other frames may be lower than background
+            self.estimates.append(compute_autobackground_image(dataimage,
+                                        boxsizefilter=self.boxsizefilter).astype(np.float32))
+            if len(self.estimates) == 1:
+                self.background = self.estimates[0]
+            else:
+                self.background = np.mean(self.estimates, axis=0, dtype=np.float32)
+            self.background.flags.writeable = False
+        self.nbframes += 1
+        return self.background
+
+
 def compute_autobackground_image(dataimage, boxsizefilter=10):
     """
     return 2D array of filtered data array
@@ -4499,7 +5956,7 @@ def filterimage(image_array, framedim, blurredimage=None,
             minivalue = np.amin(image_array)
         else:
             minivalue = 0
-        maskcd = np.where(circularMask(center, radius, framedim), tab, minivalue)
+        maskcd = np.where(getBackgroundCache().getmask(center, radius, framedim), tab, minivalue)
 
     return np.array(maskcd, dtype=imageformat)
 
@@ -4577,7 +6034,8 @@ def write_PurgedPeakListFile(filename1, blacklisted_XY, outputfilename, dist_tol
     write a new .dat file where peaks in blacklist are omitted
     """
     #peakX, peakY, tokeep
-    _, _, tokeep = purgePeaksListFile(filename1, blacklisted_XY, dist_tolerance=0.5, dirname=dirname)
+    _, _, tokeep = purgePeaksListFile(filename1, blacklisted_XY, dist_tolerance=dist_tolerance,
+                                                                            dirname=dirname)
 
     data_peak = IOLT.read_Peaklist(filename1, dirname=dirname)
 
@@ -4609,12 +6067,12 @@ def removePeaks_inPeakList(PeakListfilename,
     """
     data_peak_blacklisted = IOLT.read_Peaklist(BlackListed_PeakListfilename, dirname=dirname)
 
-    XY_blacklisted = data_peak_blacklisted[:, 0:2].T
+    XY_blacklisted = data_peak_blacklisted[:, 0:2]
 
     write_PurgedPeakListFile(PeakListfilename,
                             XY_blacklisted,
                             outputfilename,
-                            dist_tolerance=0.5,
+                            dist_tolerance=dist_tolerance,
                             dirname=dirname)
 
 
@@ -0,0 +1,324 @@
+"""
+benchmark suite of the LaueTools pipeline:
+simulation -> peak search -> detector geometry -> indexation -> refinement
+
+Each benchmark runs on fixed inputs (seeded synthetic data or files of LaueTools/Examples)
+and records best execution time, throughput (items per second) and peak memory
+(numpy and python allocations traced by tracemalloc).
+
+Results are written in a json file and can be compared to a baseline json file
+(previously saved on the same machine) to catch performance regressions.
+
+The LaueTools package is imported from the source tree containing this script
+(the folder containing LaueTools is put first in sys.path): no installation or PYTHONPATH needed.
+A baseline measured on a reference machine is committed in scripts/benchmark_baseline.json
+(see its "metadata"). Timings depend on hardware: comparison to a baseline is opt-in and is
+meaningful only with a baseline saved on the same machine (--save-baseline).
+A regression is flagged only with at least MIN_NBREPEATS_COMPARISON repeats per benchmark.
+
+usage (from any folder, e.g. ~/LaueTools/scripts):
+
+python benchmark_pipeline.py                       # run all benchmarks and print a summary
+python benchmark_pipeline.py -o results.json       # write results
+python benchmark_pipeline.py --save-baseline       # store results as default baseline
+python benchmark_pipeline.py -b                    # compare to default baseline
+python benchmark_pipeline.py -b baseline.json -t 0.3  # compare (exit code 1 if regression)
+python benchmark_pipeline.py --only simulation,calc_uflab -n 5
+"""
+import os
+import sys
+import io
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from collections import OrderedDict
+
+import numpy as np
+
+# LaueTools package of this source tree (rather than any installed one)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import LaueTools
+import LaueTools.lauecore as LAUE
+import LaueTools.readmccd as RMCCD
+import LaueTools.LaueGeometry as LTGeo
+import LaueTools.indexingSpotsSet as ISS
+import LaueTools.FitOrient as FitO
+import LaueTools.CrystalParameters as CP
+import LaueTools.generaltools as GT
+import LaueTools.imagesimulator as IMSIM
+import LaueTools.dict_LaueTools as DictLT
+
+LAUETOOLSFOLDER = os.path.dirname(os.path.abspath(LaueTools.__file__))
+DEFAULT_BASELINE = os.path.join(LAUETOOLSFOLDER, "scripts", "benchmark_baseline.json")
+
+# relative loss of throughput (or gain of peak memory) above which a benchmark is a regression
+DEFAULT_TOLERANCE = 0.2
+# min nb of timed runs (best one is kept) to compare to a baseline
+MIN_NBREPEATS_COMPARISON = 3
+
+# Ge example (see Examples/Ge/Ge0001calib.det)
+GE_CALIB = [69.193, 1050.79, 1116.33, 0.154, -0.255]
+GE_PIXELSIZE = 0.08057
+GE_FRAMEDIM = (2048, 2048)
+GE_ORIENTMATRIX = np.array([[0.9729606, 0.0924311, -0.2116698],
+                            [-0.2247853, 0.5896078, -0.7757798],
+                            [0.0530960, 0.8023834, 0.5944423]])
+GE_CORFILE = os.path.join(LAUETOOLSFOLDER, "Examples", "Ge", "dat_Ge0001.cor")
+
+
+def setup_simulation():
+    """ single grain simulation of Laue pattern (Ge 5-22 keV, top reflection geometry)
+    """
+    grain = [None, None, GE_ORIENTMATRIX, "Ge"]
+
+    def run():
+        Twicetheta = LAUE.SimulateLaue_full_np(grain, 5, 22, GE_CALIB,
+                                                pixelsize=GE_PIXELSIZE,
+                                                dim=GE_FRAMEDIM,
+                                                removeharmonics=1)[0]
+        return len(Twicetheta)
+
+    return run, "spots"
+
+
+def setup_peaksearch():
+    """ peak search (local maxima + gaussian fit) in a seeded synthetic Ge Laue pattern image
+    """
+    image = IMSIM.render_LauePattern([[None, None, GE_ORIENTMATRIX, "Ge"]], 5, 22, GE_CALIB,
+                                                CCDLabel="MARCCD165",
+                                                amplitude=5000.0,
+                                                sigma_x=1.5,
+                                                background=100.0,
+                                                seed=0)
+
+    def run():
+        peaklist = RMCCD.PeakSearch(None,
+                                    CCDLabel="MARCCD165",
+                                    Data_for_localMaxima=image,
+                                    Fit_with_Data_for_localMaxima=True,
+                                    IntensityThreshold=500,
+                                    local_maxima_search_method=1,
+                                    return_histo=0,
+                                    write_execution_time=0)[0]
+        return len(peaklist)
+
+    return run, "peaks"
+
+
+def setup_calc_uflab():
+    """ conversion of 10**6 pixel positions to scattering angles 2theta, chi
+    """
+    randomstate = np.random.RandomState(0)
+    xcam, ycam = randomstate.uniform(0, 2048, size=(2, 1000000))
+
+    def run():
+        twicetheta = LTGeo.calc_uflab(xcam, ycam, GE_CALIB, pixelsize=GE_PIXELSIZE)[0]
+        return len(twicetheta)
+
+    return run, "pixels"
+
+
+def setup_indexation():
+    """ indexation of Examples/Ge/dat_Ge0001.cor (angles LUT, no image matching)
+    """
+    dict_parameters = {"MATCHINGRATE_THRESHOLD_IAL": 60,
+                        "MATCHINGRATE_ANGLE_TOL": 0.2,
+                        "NBMAXPROBED": 10,
+                        "central spots indices": list(range(5)),
+                        "AngleTolLUT": 0.5,
+                        "UseIntensityWeights": False,
+                        "MinimumNumberMatches": 10,
+                        "nbSpotsToIndex": 1000}
+    outputfolder = tempfile.mkdtemp(prefix="lauetools_benchmark_")
+
+    def run():
+        DataSet = ISS.spotsset()
+        DataSet.IndexSpotsSet(GE_CORFILE, "Ge", 5, 22, dict_parameters, None,
+                                IMM=False,
+                                MatchingRate_List=[20, 20, 20],
+                                angletol_list=[0.5, 0.2, 0.1],
+                                nbGrainstoFind=1,
+                                verbose=0,
+                                dirnameout_fitfile=outputfolder)
+        return DataSet.nbspots
+
+    return run, "spots"
+
+
+def setup_refinement():
+    """ refinement of orientation and strain (8 parameters) from simulated Ge spots
+    with a slightly misoriented starting matrix
+    """
+    Twicetheta, Chi, Miller, posx, posy, _ = LAUE.SimulateLaue_full_np(
+                                                [None, None, GE_ORIENTMATRIX, "Ge"], 5, 22, GE_CALIB,
+                                                pixelsize=GE_PIXELSIZE,
+                                                dim=GE_FRAMEDIM,
+                                                removeharmonics=1)
+    initrot = np.dot(GT.matRot([1, 2, 3], 0.1), GE_ORIENTMATRIX)
+    Bmatrix = CP.calc_B_RR(DictLT.dict_Materials["Ge"][1])
+    allparameters = np.array(GE_CALIB + [1, 1, 0, 0, 0] + [0, 0, 0])
+    nbspots = len(Twicetheta)
+
+    def run():
+        FitO.fit_on_demand_strain(np.array([1.0, 1.0, 0.0, 0.0, 0.0, 0, 0.0, 0.0]),
+                                    Miller,
+                                    allparameters,
+                                    FitO.error_function_on_demand_strain,
+                                    np.arange(5, 13),
+                                    np.arange(nbspots),
+                                    posx,
+                                    posy,
+                                    initrot=initrot,
+                                    Bmat=Bmatrix,
+                                    pixelsize=GE_PIXELSIZE,
+                                    dim=GE_FRAMEDIM,
+                                    verbose=0,
+                                    kf_direction="Z>0")
+        return nbspots
+
+    return run, "spots"
+
+
+BENCHMARKS = OrderedDict([("simulation", setup_simulation),
+                        ("peaksearch", setup_peaksearch),
+                        ("calc_uflab", setup_calc_uflab),
+                        ("indexation", setup_indexation),
+                        ("refinement", setup_refinement)])
+
+
+def measure(run, nbrepeats=3, quiet=True):
+    """ return best execution time (s), nb of processed items and peak memory (MB) of run()
+
+    peak memory is measured in an extra call (tracemalloc slows down execution)
+    """
+    output = io.StringIO() if quiet else sys.stdout
+
+    times = []
+    with contextlib.redirect_stdout(output):
+        for _ in list(range(nbrepeats)):
+            t0 = time.perf_counter()
+            nbitems = run()
+            times.append(time.perf_counter() - t0)
+
+        tracemalloc.start()
+        try:
+            run()
+            peakmemory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return min(times), nbitems, peakmemory / 2.0 ** 20
+
+
+def run_benchmarks(names=None, nbrepeats=3, quiet=True, verbose=1):
+    """ run benchmarks (all by default) and return results dict (json serializable)
+    """
+    if names is None:
+        names = list(BENCHMARKS.keys())
+
+    results = OrderedDict()
+    results["metadata"] = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                            "python": platform.python_version(),
+                            "numpy": np.__version__,
+                            "platform": platform.platform(),
+                            "processor": platform.processor(),
+                            "nbrepeats": nbrepeats}
+    results["benchmarks"] = OrderedDict()
+
+    for name in names:
+        if name not in BENCHMARKS:
+            raise KeyError("Unknown benchmark %s. Choose among %s" % (name, list(BENCHMARKS.keys())))
+        with contextlib.redirect_stdout(io.StringIO() if quiet else sys.stdout):
+            run, unit = BENCHMARKS[name]()
+        besttime, nbitems, peakmemory = measure(run, nbrepeats=nbrepeats, quiet=quiet)
+
+        results["benchmarks"][name] = {"time_s": besttime,
+                                        "nbitems": int(nbitems),
+                                        "unit": unit,
+                                        "throughput": nbitems / besttime,
+                                        "peakmemory_MB": peakmemory}
+        if verbose:
+            print("%-12s %10.4f s  %12.1f %s/s  %9.2f MB" % (name, besttime, nbitems / besttime,
+                                                            unit, peakmemory))
+    return results
+
+
+def save_results(results, filename):
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(filename):
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE, verbose=1):
+    """ compare benchmarks results to baseline ones
+
+    a benchmark is a regression if its throughput is lower than (1 - tolerance) * baseline throughput
+    or if its peak memory is larger than (1 + tolerance) * baseline peak memory
+
+    :return: list of (benchmark name, quantity, baseline value, current value) of regressions
+    """
+    regressions = []
+    for name, res in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        ref = baseline["benchmarks"][name]
+        ratio_throughput = res["throughput"] / ref["throughput"]
+        ratio_memory = res["peakmemory_MB"] / max(ref["peakmemory_MB"], 1e-6)
+        if verbose:
+            print("%-12s throughput x%.2f   peak memory x%.2f" % (name, ratio_throughput, ratio_memory))
+        if ratio_throughput < 1.0 - tolerance:
+            regressions.append((name, "throughput", ref["throughput"], res["throughput"]))
+        if ratio_memory > 1.0 + tolerance:
+            regressions.append((name, "peakmemory_MB", ref["peakmemory_MB"], res["peakmemory_MB"]))
+
+    if verbose:
+        for name, quantity, refvalue, value in regressions:
+            print("REGRESSION %s %s: %.3f -> %.3f" % (name, quantity, refvalue, value))
+
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="LaueTools pipeline benchmarks")
+    parser.add_argument("-o", "--output", default=None, help="json file to write results")
+    parser.add_argument("-b", "--baseline", nargs="?", default=None, const=DEFAULT_BASELINE,
+                        help="compare results to json baseline file (default file: %s)"
+                        % DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write results in baseline file (-b file or default file)")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("-n", "--nbrepeats", type=int, default=3)
+    parser.add_argument("--only", default=None, help="comma separated benchmarks names")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show LaueTools outputs")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else None
+    baselinefile = args.baseline if args.baseline is not None else DEFAULT_BASELINE
+    if args.baseline is not None and not args.save_baseline:
+        if args.nbrepeats < MIN_NBREPEATS_COMPARISON:
+            parser.error("comparison to a baseline needs at least %d repeats (-n)"
+                                                                % MIN_NBREPEATS_COMPARISON)
+        if not os.path.isfile(baselinefile):
+            parser.error("baseline file %s not found" % baselinefile)
+
+    res = run_benchmarks(names=names, nbrepeats=args.nbrepeats, quiet=not args.verbose)
+
+    if args.output is not None:
+        save_results(res, args.output)
+
+    if args.save_baseline:
+        save_results(res, baselinefile)
+        print("baseline written in %s" % baselinefile)
+    elif args.baseline is not None:
+        if compare_to_baseline(res, load_results(baselinefile), tolerance=args.tolerance):
+            sys.exit(1)
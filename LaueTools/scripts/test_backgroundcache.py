@@ -0,0 +1,82 @@
+"""
+scripts to check that the background of PeakSearch with Data_for_localMaxima='auto_background'
+is filtered once per image file (see readmccd.BackgroundCache)
+
+run with python
+~/LaueTools/scripts$ python test_backgroundcache.py
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import LaueTools.readmccd as RMCCD
+import LaueTools.imagesimulator as IMSIM
+
+GE_ORIENTMATRIX = np.array([[0.9729606, 0.0924311, -0.2116698],
+                            [-0.2247853, 0.5896078, -0.7757798],
+                            [0.0530960, 0.8023834, 0.5944423]])
+GE_CALIB = [69.193, 1050.79, 1116.33, 0.154, -0.255]
+
+
+def peaksearch_autobackground(filename):
+    return RMCCD.PeakSearch(filename, CCDLabel="MARCCD165",
+                            Data_for_localMaxima="auto_background",
+                            IntensityThreshold=200,
+                            local_maxima_search_method=0,
+                            fit_peaks_gaussian=0,
+                            return_histo=0)[0]
+
+
+def test_autobackground_cache():
+    """ second peak search of the same image is a cache hit: no new minimum filter pass
+    and same peaks
+    """
+    folder = tempfile.mkdtemp(prefix="lauetools_bkgcache_")
+    filename = os.path.join(folder, "Ge_0000.mccd")
+    image = IMSIM.render_LauePattern([[None, None, GE_ORIENTMATRIX, "Ge"]], 5, 22, GE_CALIB,
+                                                CCDLabel="MARCCD165",
+                                                amplitude=5000.0,
+                                                sigma_x=1.5,
+                                                background=100.0,
+                                                seed=0)
+    IMSIM.write_rawimage(filename, image, CCDLabel="MARCCD165")
+
+    # count background filter passes
+    nbfilterpasses = [0]
+    compute_autobackground_image = RMCCD.compute_autobackground_image
+
+    def counted_autobackground_image(dataimage, boxsizefilter=10):
+        nbfilterpasses[0] += 1
+        return compute_autobackground_image(dataimage, boxsizefilter=boxsizefilter)
+
+    RMCCD.compute_autobackground_image = counted_autobackground_image
+    try:
+        RMCCD.getBackgroundCache().clear()
+        firstpeaks = peaksearch_autobackground(filename)
+        assert nbfilterpasses[0] == 1
+        background = RMCCD.getBackgroundCache().getfilteredimage(filename, CCDLabel="MARCCD165")
+
+        secondpeaks = peaksearch_autobackground(filename)
+        assert nbfilterpasses[0] == 1
+        assert RMCCD.getBackgroundCache().getfilteredimage(filename,
+                                                            CCDLabel="MARCCD165") is background
+        assert np.array_equal(firstpeaks, secondpeaks)
+
+        # background of a modified file is filtered again
+        IMSIM.write_rawimage(filename, image // 2, CCDLabel="MARCCD165")
+        os.utime(filename, (0, 0))
+        peaksearch_autobackground(filename)
+        assert nbfilterpasses[0] == 2
+    finally:
+        RMCCD.compute_autobackground_image = compute_autobackground_image
+        RMCCD.getBackgroundCache().clear()
+        shutil.rmtree(folder)
+
+    print("auto_background filtered once for 2 peak searches of the same image: %d peaks  OK"
+                                                                            % len(secondpeaks))
+
+
+if __name__ == "__main__":
+    test_autobackground_cache()
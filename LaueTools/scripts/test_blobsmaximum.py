@@ -0,0 +1,90 @@
+"""
+scripts to check hottest pixel position of blobs found by thresholding (blobs_maximum_position)
+against ndimage.maximum_position, with distinct maxima and with flat top (saturated) blobs
+
+run with python
+~/LaueTools/scripts$ python test_blobsmaximum.py
+"""
+import numpy as np
+import scipy.ndimage as ndimage
+
+import LaueTools.readmccd as RMCCD
+
+
+def blobs_image(shape=(1024, 1024), saturation=None, dtype=np.uint16, seed=0):
+    """ seeded image of small blobs (3x3 pixels) on a noisy background,
+    clipped at saturation (if not None) to create plateaus of equal maxima
+    """
+    randomstate = np.random.RandomState(seed)
+    image = np.zeros(shape, dtype=np.float64)
+    nbblobs = shape[0] * shape[1] // 400
+    rows = randomstate.randint(0, shape[0], nbblobs)
+    columns = randomstate.randint(0, shape[1], nbblobs)
+    image[rows, columns] = randomstate.uniform(100, 1000, nbblobs)
+    image = ndimage.maximum_filter(image, 3) + randomstate.uniform(0, 3, shape)
+    if saturation is not None:
+        image = np.minimum(image, saturation)
+    else:
+        # blobs hottest pixel
+        image[rows, columns] += 10
+    return image.astype(dtype)
+
+
+def stable_maximum_position(Data, labels, nblabels):
+    """ ndimage.maximum_position computed with a stable sort (last maximum in C order) """
+    order = np.argsort(Data.ravel(), kind="stable")
+    maxpos = np.zeros(nblabels + 1, dtype=int)
+    maxpos[labels.ravel()[order]] = order
+    return np.array(np.unravel_index(maxpos[1:], Data.shape)).T
+
+
+def test_distinct_maxima():
+    """ blobs with a single hottest pixel: same positions as ndimage """
+    for dtype in (np.uint16, np.float32):
+        image = blobs_image(dtype=dtype)
+        labels, nblabels = ndimage.label(image > 50)
+        indices = np.arange(1, nblabels + 1)
+        maxima = ndimage.maximum(image, labels, indices)
+        single = ndimage.sum(image == maxima[labels - 1], labels, indices) == 1
+
+        ref = np.array(ndimage.maximum_position(image, labels, indices))
+        res = RMCCD.blobs_maximum_position(image, labels, nblabels)
+        assert np.array_equal(ref[single], res[single])
+        print("distinct maxima %s: %d blobs  OK" % (np.dtype(dtype).name, np.sum(single)))
+
+
+def test_plateaus():
+    """ saturated blobs: hottest pixel has the highest intensity (as for ndimage) and is
+    the last one in C order among equal maxima (ndimage with a stable sort)
+    """
+    for dtype in (np.uint16, np.int32, np.float32):
+        image = blobs_image(saturation=500, dtype=dtype)
+        labels, nblabels = ndimage.label(image > 50)
+        res = RMCCD.blobs_maximum_position(image, labels, nblabels)
+
+        assert np.array_equal(res, stable_maximum_position(image, labels, nblabels))
+
+        maxima = ndimage.maximum(image, labels, np.arange(1, nblabels + 1))
+        assert np.array_equal(image[res[:, 0], res[:, 1]], maxima)
+        assert np.all(labels[res[:, 0], res[:, 1]] == np.arange(1, nblabels + 1))
+
+        nbplateaus = np.sum(ndimage.sum(image == maxima[labels - 1], labels,
+                                                            np.arange(1, nblabels + 1)) > 1)
+        print("plateaus %s: %d blobs (%d with equal maxima)  OK"
+                                            % (np.dtype(dtype).name, nblabels, nbplateaus))
+
+
+def test_thresholdarray_method():
+    """ local maxima search method 0 on saturated blobs """
+    image = blobs_image(saturation=500)
+    peaks = RMCCD.LocalMaxima_from_thresholdarray(image, IntensityThreshold=50)
+    labels, nblabels = ndimage.label(image > 50)
+    ref = np.fliplr(stable_maximum_position(image, labels, nblabels))
+    assert np.array_equal(peaks, ref)
+    print("LocalMaxima_from_thresholdarray: %d peaks  OK" % len(peaks))
+
+
+if __name__ == "__main__":
+    test_distinct_maxima()
+    test_plateaus()
+    test_thresholdarray_method()
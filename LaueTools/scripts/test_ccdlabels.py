@@ -0,0 +1,20 @@
+"""
+scripts to check that CCD labels listed in readmccd module constants are keys of dict_CCD
+
+run with python
+~/LaueTools/scripts$ python test_ccdlabels.py
+"""
+import LaueTools.readmccd as RMCCD
+import LaueTools.dict_LaueTools as DictLT
+
+
+def test_ccdlabels_in_dict_CCD():
+    """ binary format lists only contain labels of dict_CCD """
+    for name in ("CCDLABELS_BIGENDIAN", "CCDLABELS_NOT_MEMMAPABLE", "HDF5STACK_CCDLABELS"):
+        unknown = set(getattr(RMCCD, name)) - set(DictLT.dict_CCD)
+        assert not unknown, "%s not in dict_CCD: %s" % (name, sorted(unknown))
+        print("%s subset of dict_CCD  OK" % name)
+
+
+if __name__ == "__main__":
+    test_ccdlabels_in_dict_CCD()
@@ -0,0 +1,63 @@
+"""
+scripts to check that harmonics filters of theoretical spots lists (FitOrient.remove_harmonic,
+CrystalParameters.FilterHarmonics_2) use the shared engine CrystalParameters.getHarmonicsIndices
+
+run with python
+~/LaueTools/scripts$ python test_harmonics.py
+"""
+import numpy as np
+
+import LaueTools.CrystalParameters as CP
+import LaueTools.FitOrient as FitO
+import LaueTools.LaueGeometry as LTGeo
+import LaueTools.lauecore as LAUE
+
+GE_ORIENTMATRIX = np.array([[0.9729606, 0.0924311, -0.2116698],
+                            [-0.2247853, 0.5896078, -0.7757798],
+                            [0.0530960, 0.8023834, 0.5944423]])
+GE_CALIB = [69.193, 1050.79, 1116.33, 0.154, -0.255]
+
+
+def test_remove_harmonic_rule():
+    """ fundamental kept whatever its position in list, close but distinct reflections kept """
+    hkl = np.array([[2, 2, 2], [1, 1, 1], [3, 3, 3], [1, 1, 0], [-1, -1, -1], [0, 0, 0],
+                    [11, 10, 10]])
+    uflab = hkl / np.maximum(np.sqrt(np.sum(hkl ** 2, axis=1)), 1)[:, np.newaxis]
+    yz = np.arange(2 * len(hkl), dtype=float).reshape((-1, 2))
+
+    hkl2, uflab2, yz2, nspots2, isbadpeak = FitO.remove_harmonic(hkl, uflab, yz)
+
+    assert np.array_equal(isbadpeak, [1, 0, 1, 0, 0, 0, 0])
+    assert nspots2 == 5
+    assert np.array_equal(hkl2, hkl[[1, 3, 4, 5, 6]])
+    assert np.array_equal(uflab2, uflab[[1, 3, 4, 5, 6]])
+    assert np.array_equal(yz2, yz[[1, 3, 4, 5, 6]])
+    print("remove_harmonic rule  OK")
+
+
+def test_simulated_spots():
+    """ same fundamentals as CP.getHarmonicsIndices and CP.FilterHarmonics_2
+    on a simulated Ge pattern (with harmonics)
+    """
+    Twicetheta, Chi, Miller, posx, posy, _ = LAUE.SimulateLaue_full_np(
+                                                [None, None, GE_ORIENTMATRIX, "Ge"], 5, 22, GE_CALIB,
+                                                pixelsize=0.08057,
+                                                dim=(2048, 2048),
+                                                removeharmonics=0)
+    # harmonics share the same unit vectors (q unit vectors are enough here)
+    uflab = LTGeo.from_twchi_to_qunit(np.array([Twicetheta, Chi])).T
+    yz = np.array([posx, posy]).T
+
+    hkl2, _, _, nspots2, isbadpeak = FitO.remove_harmonic(Miller, uflab, yz)
+    tokeep, toremove = CP.getHarmonicsIndices(Miller)
+
+    assert len(toremove) > 0
+    assert np.array_equal(np.where(isbadpeak == 0)[0], tokeep)
+    assert np.array_equal(hkl2, CP.FilterHarmonics_2(Miller))
+    print("simulated Ge spots: %d harmonics removed from %d spots  OK"
+                                                        % (len(Miller) - nspots2, len(Miller)))
+
+
+if __name__ == "__main__":
+    test_remove_harmonic_rule()
+    test_simulated_spots()
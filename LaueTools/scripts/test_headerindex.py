@@ -0,0 +1,66 @@
+"""
+scripts to check metadata read by headerindex in synthetic MarCCD headers
+(acquisition time, frame dimensions, motors positions) and stored in index file
+
+run with python
+~/LaueTools/scripts$ python test_headerindex.py
+"""
+import os
+import time
+import struct
+import shutil
+import tempfile
+
+import numpy as np
+
+import LaueTools.headerindex as HIDX
+import LaueTools.imagesimulator as IMSIM
+
+# mmddHHMMYYYY.SS
+ACQUIRETIMESTAMP = "101812345626.42"
+COMMENTS = "1.5 -2.25 3.125 24923"
+
+
+def write_marccd(filename, acquiretimestamp=ACQUIRETIMESTAMP, comments=COMMENTS):
+    """ blank MARCCD165 image with a header filled as by the MarCCD software:
+    frame dimensions, file parameters section (from byte 2048) and dataset comments
+    """
+    IMSIM.write_rawimage(filename, np.zeros((2048, 2048), dtype=np.uint16), CCDLabel="MARCCD165")
+    with open(filename, "r+b") as f:
+        f.seek(1024 + 80)
+        f.write(struct.pack("I I", 2048, 2048))
+        # filetitle(128), filepath(128), filename(64), acquire_timestamp(32)
+        f.seek(2048)
+        f.write(b"t" * 128 + b"p" * 128 + b"f" * 64)
+        f.write(acquiretimestamp.encode().ljust(32, b"\x00"))
+        f.seek(3072)
+        f.write(comments.encode())
+
+
+def test_marccd_timestamp():
+    """ acquire_timestamp of MarCCD header is stored in index with source 'header' """
+    folder = tempfile.mkdtemp(prefix="lauetools_headerindex_")
+    try:
+        write_marccd(os.path.join(folder, "img_0000.mccd"))
+        write_marccd(os.path.join(folder, "img_0001.mccd"), acquiretimestamp="")
+
+        with HIDX.index_imagesfolder(folder, CCDLabel="MARCCD165", nbthreads=1) as hidx:
+            fromheader, frommtime = hidx.getmany([os.path.join(folder, "img_0000.mccd"),
+                                                os.path.join(folder, "img_0001.mccd")])
+
+        expected = time.mktime(time.strptime(ACQUIRETIMESTAMP, HIDX.MARCCD_TIMESTAMP_FORMAT))
+        assert fromheader["timestampsource"] == HIDX.TIMESTAMP_FROM_HEADER
+        assert fromheader["timestamp"] == expected
+        assert (fromheader["xech"], fromheader["yech"], fromheader["zech"],
+                fromheader["monitor"]) == (1.5, -2.25, 3.125, 24923.)
+        assert (fromheader["framedim_0"], fromheader["framedim_1"]) == (2048, 2048)
+
+        assert frommtime["timestampsource"] == HIDX.TIMESTAMP_FROM_MTIME
+        assert frommtime["timestamp"] == frommtime["mtime"]
+        print("MarCCD acquire_timestamp read from header  OK")
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    test_marccd_timestamp()
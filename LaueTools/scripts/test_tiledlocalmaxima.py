@@ -0,0 +1,90 @@
+"""
+scripts to check that local maxima search by tiles in parallel threads (nbthreads > 1)
+gives exactly the same results as the search on the whole frame
+
+run with python
+~/LaueTools/scripts$ python test_tiledlocalmaxima.py
+"""
+import time
+
+import numpy as np
+
+import LaueTools.readmccd as RMCCD
+import LaueTools.imagesimulator as IMSIM
+
+# Ge crystal seen by a large detector (sCMOS_16M 4036x4032 pixels)
+CCDLABEL = "sCMOS_16M"
+CALIB = [69.193, 1050.79, 1116.33, 0.154, -0.255]
+ORIENTMATRIX = np.array([[0.9729606, 0.0924311, -0.2116698],
+                        [-0.2247853, 0.5896078, -0.7757798],
+                        [0.0530960, 0.8023834, 0.5944423]])
+
+
+def simulated_image(CCDLabel=CCDLABEL, seed=0):
+    """ seeded synthetic Ge Laue pattern image
+    """
+    return IMSIM.render_LauePattern([[None, None, ORIENTMATRIX, "Ge"]], 5, 22, CALIB,
+                                                    CCDLabel=CCDLabel,
+                                                    amplitude=5000.0,
+                                                    sigma_x=1.5,
+                                                    background=100.0,
+                                                    seed=seed)
+
+
+def test_localmaxima_tiled(image=None, nbthreads=4, tilesize=700):
+    """ shift arrays local maxima: tiled search must return the same pixels in the same order
+    """
+    if image is None:
+        image = simulated_image()
+    for n in (3, 10, 25):
+        ref = RMCCD.localmaxima(image, n, diags=1)
+        res = RMCCD.localmaxima(image, n, diags=1, nbthreads=nbthreads, tilesize=tilesize)
+        assert len(ref) == len(res)
+        for refindices, indices in zip(ref, res):
+            assert np.array_equal(refindices, indices)
+        print("localmaxima n=%d: %d maxima  OK" % (n, len(ref[0])))
+
+
+def test_convolve_tiled(image=None, nbthreads=4, tilesize=700):
+    """ mexican hat convolution: tiled convolution must be identical
+    """
+    if image is None:
+        image = simulated_image()
+    for boxsize in (5, 10):
+        ref = RMCCD.ConvolvebyKernel(image, peakVal=4, boxsize=boxsize, central_radius=2)
+        res = RMCCD.ConvolvebyKernel(image, peakVal=4, boxsize=boxsize, central_radius=2,
+                                                nbthreads=nbthreads, tilesize=tilesize)
+        assert res.dtype == ref.dtype
+        assert np.array_equal(ref, res)
+        print("ConvolvebyKernel boxsize=%d  OK" % boxsize)
+
+
+def test_peaksearch_tiled(image=None, nbthreads=4):
+    """ PeakSearch (local maxima methods 1 and 2) must give the same peaks list
+    """
+    if image is None:
+        image = simulated_image()
+    for method in (1, 2):
+        results = []
+        for nb in (1, nbthreads):
+            t0 = time.time()
+            peaks = RMCCD.PeakSearch(None,
+                                    CCDLabel=CCDLABEL,
+                                    Data_for_localMaxima=image,
+                                    Fit_with_Data_for_localMaxima=True,
+                                    IntensityThreshold=300,
+                                    thresholdConvolve=5000,
+                                    local_maxima_search_method=method,
+                                    return_histo=0,
+                                    nbthreads=nb)[0]
+            results.append((peaks, time.time() - t0))
+        assert np.array_equal(results[0][0], results[1][0])
+        print("PeakSearch method %d: %d peaks  OK   (%.2f s untiled, %.2f s with %d threads)"
+                % (method, len(results[0][0]), results[0][1], results[1][1], nbthreads))
+
+
+if __name__ == "__main__":
+    testimage = simulated_image()
+    test_localmaxima_tiled(testimage)
+    test_convolve_tiled(testimage)
+    test_peaksearch_tiled(testimage)
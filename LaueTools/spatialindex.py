@@ -0,0 +1,218 @@
+from __future__ import print_function
+r"""
+module of lauetools project
+
+spatial index of lists of points (peaks, spots, pixels) built on scipy.spatial.cKDTree
+
+radius queries, nearest neighbours, clusters of close points and set difference
+within a distance tolerance without computing tables of all mutual distances.
+
+Points are given as array (n, dim) (e.g. peaks list [[X1,Y1],[X2,Y2],...]).
+As in generaltools, two points are close if their distance is STRICTLY lower than
+the distance tolerance.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+def asPoints(points, dim=2):
+    r"""
+    return points as a float array of shape (n, dim)
+    """
+    return np.asarray(points, dtype=float).reshape((-1, dim))
+
+
+def buildTree(points):
+    r"""
+    return KD-tree of points (array (n, dim))
+    """
+    return cKDTree(np.asarray(points, dtype=float))
+
+
+def closePairs(points, distance, tree=None):
+    r"""
+    radius query of all pairs of close points within the same list
+
+    :param points: array (n, dim)
+    :param distance: (strict) distance tolerance
+    :param tree: KD-tree of points (optional, see buildTree())
+
+    :return: array (m, 2) of pairs of indices [i, j] with i < j
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < 2:
+        return np.zeros((0, 2), dtype=int)
+    if tree is None:
+        tree = cKDTree(points)
+
+    # query_pairs selects distances <= distance
+    pairs = tree.query_pairs(distance, output_type="ndarray").astype(int)
+    dist = np.sqrt(np.sum((points[pairs[:, 0]] - points[pairs[:, 1]]) ** 2, axis=1))
+    pairs = pairs[dist < distance]
+
+    # lexicographic order of (i, j)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def pointsWithinRadius(points, center, distance, tree=None):
+    r"""
+    radius query: return sorted indices of points closer than distance to center
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) == 0:
+        return np.zeros(0, dtype=int)
+    if tree is None:
+        tree = cKDTree(points)
+    center = np.asarray(center, dtype=float)
+
+    indices = np.array(tree.query_ball_point(center, distance), dtype=int)
+    dist = np.sqrt(np.sum((points[indices] - center) ** 2, axis=1))
+
+    return np.sort(indices[dist < distance])
+
+
+def nearestNeighbours(points, querypoints, k=1, tree=None):
+    r"""
+    k nearest neighbours in points of each point of querypoints
+
+    :param points: array (n, dim) of reference points
+    :param querypoints: array (nq, dim)
+    :param k: nb of neighbours
+
+    :return: distances, indices, arrays of shape (nq, k) sorted by increasing distance.
+             When points has less than k elements, missing neighbours have
+             an infinite distance and index n (as in cKDTree.query())
+    """
+    points = np.asarray(points, dtype=float)
+    querypoints = np.asarray(querypoints, dtype=float)
+    nbpoints = len(points)
+    nbquery = len(querypoints)
+
+    distances = np.full((nbquery, k), np.inf)
+    indices = np.full((nbquery, k), nbpoints, dtype=int)
+    if nbpoints == 0 or nbquery == 0:
+        return distances, indices
+    if tree is None:
+        tree = cKDTree(points)
+
+    nbneighbours = min(k, nbpoints)
+    dist, ind = tree.query(querypoints, k=nbneighbours)
+    distances[:, :nbneighbours] = dist.reshape((nbquery, nbneighbours))
+    indices[:, :nbneighbours] = ind.reshape((nbquery, nbneighbours))
+
+    return distances, indices
+
+
+def isCloseToSet(points, reference, distance, tree=None):
+    r"""
+    return boolean array: True for points closer than distance to at least one point of reference
+
+    :param points: array (n, dim)
+    :param reference: array (m, dim)
+    :param tree: KD-tree of reference (optional, see buildTree())
+    """
+    points = np.asarray(points, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    if len(points) == 0 or len(reference) == 0:
+        return np.zeros(len(points), dtype=bool)
+
+    dist, ind = nearestNeighbours(reference, points, k=1, tree=tree)
+    found = np.isfinite(dist[:, 0])
+    # distance recomputed as in the distances tables of generaltools
+    dist = np.sqrt(np.sum((points[found] - reference[ind[found, 0]]) ** 2, axis=1))
+    isclose = np.zeros(len(points), dtype=bool)
+    isclose[found] = dist < distance
+
+    return isclose
+
+
+def setDifference(points, reference, distance, tree=None):
+    r"""
+    set difference within tolerance: indices of points which are NOT closer than distance
+    to any point of reference
+
+    :param points: array (n, dim)
+    :param reference: array (m, dim) (e.g. blacklisted peaks)
+    :param tree: KD-tree of reference (optional, see buildTree())
+
+    :return: sorted array of indices of points to keep
+    """
+    return np.where(~isCloseToSet(points, reference, distance, tree=tree))[0]
+
+
+def clusterClosePoints(points, distance, tree=None):
+    r"""
+    gather points in clusters: two points closer than distance belong to the same cluster
+    (connected components of the graph of close points)
+
+    :param points: array (n, dim)
+    :param distance: (strict) maximum distance between two neighbouring points of a cluster
+
+    :return: labels, nbclusters. labels is an array of n cluster indices. Clusters are numbered
+             by increasing index of their first point in points
+    """
+    points = np.asarray(points, dtype=float)
+    nbpoints = len(points)
+    if nbpoints == 0:
+        return np.zeros(0, dtype=int), 0
+
+    pairs = closePairs(points, distance, tree=tree)
+    adjacency = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])),
+                                                                    shape=(nbpoints, nbpoints))
+    nbclusters, labels = connected_components(adjacency, directed=False)
+
+    return labels, nbclusters
+
+
+def firstOfClusters(points, distance, tree=None):
+    r"""
+    return sorted indices of points to keep such as only the first point (smallest index)
+    of each cluster of close points is kept (see clusterClosePoints())
+
+    Closeness propagates: a chain of points, each closer than distance to the next one,
+    is a single cluster and only its first point is kept (see suppressClosePoints())
+    """
+    labels, nbclusters = clusterClosePoints(points, distance, tree=tree)
+    if nbclusters == 0:
+        return np.zeros(0, dtype=int)
+    # clusters are numbered by increasing index of their first point
+    return np.sort(np.unique(labels, return_index=True)[1])
+
+
+def suppressClosePoints(points, distance, tree=None):
+    r"""
+    greedy suppression of close points in the order of points: a point is kept unless it is
+    closer than distance to an already kept point
+
+    Closeness does not propagate: a point close only to removed points is kept
+    (contrary to firstOfClusters())
+
+    :return: sorted array of indices of kept points
+    """
+    points = np.asarray(points, dtype=float)
+    tokeep = np.ones(len(points), dtype=bool)
+
+    pairs = closePairs(points, distance, tree=tree)
+    if len(pairs):
+        # for each point with close points before it (increasing index), indices of these points
+        pairs = pairs[np.argsort(pairs[:, 1], kind="stable")]
+        laterpoints, firstpairs = np.unique(pairs[:, 1], return_index=True)
+        lastpairs = np.r_[firstpairs[1:], len(pairs)]
+        for point, first, last in zip(laterpoints, firstpairs, lastpairs):
+            if tokeep[pairs[first:last, 0]].any():
+                tokeep[point] = False
+
+    return np.where(tokeep)[0]
+
+
+def duplicatesIndices(points, distance, tree=None):
+    r"""
+    return sorted indices of duplicates: for every pair of points closer than distance,
+    the point with the largest index is a duplicate (whatever the other point is a duplicate or not)
+    """
+    pairs = closePairs(points, distance, tree=tree)
+
+    return np.unique(pairs[:, 1])
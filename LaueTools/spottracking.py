@@ -13,9 +13,11 @@ import numpy as np
 if sys.version_info.major == 3:
     from . import generaltools as GT
     from . import IOLaueTools as IOLT
+    from . import spatialindex as SI
 else:
     import generaltools as GT
     import IOLaueTools as IOLT
+    import spatialindex as SI
 
 
 def getspotindex(XY, spotslist_XY, maxdistancetolerance=5, minimum_seconddistance=10,
@@ -108,6 +110,39 @@ def getSpotsAssociations(spotlist_XY, ref_list_XY, maxdistancetolerance=5,
     return correspondence, nocorrespondence
 
 
+def matchSpots(spotlist_XY, ref_list_XY, maxdistancetolerance=5, minimum_seconddistance=10):
+    """
+    vectorized version of getSpotsAssociations() (without predicted shifts) using a KD-tree
+    (see spatialindex.nearestNeighbours()):
+    same association rules as getspotindex() for every spot of spotlist_XY
+
+    :param spotlist_XY: array (n, 2) of [X,Y]
+    :param ref_list_XY: array (m, 2) of [X,Y]
+
+    :return:
+    list of correspondences
+    [index in spotlist_XY, index in ref_list_XY,pixel distance between associated spots]
+    list of spots index in spotlist_XY without close association or with ambiguous association (two spots in ref list)
+    """
+    spotlist_XY = np.asarray(spotlist_XY, dtype=float).reshape((-1, 2))
+    ref_list_XY = np.asarray(ref_list_XY, dtype=float).reshape((-1, 2))
+
+    if len(ref_list_XY) == 0 or len(spotlist_XY) == 0:
+        return [], list(range(len(spotlist_XY)))
+
+    # second neighbour distance is infinite if ref_list_XY contains a single spot
+    distances, indices = SI.nearestNeighbours(ref_list_XY, spotlist_XY, k=2)
+    first_dist, second_dist = distances.T
+    first = indices[:, 0]
+
+    associated = (first_dist <= maxdistancetolerance) & (second_dist >= minimum_seconddistance)
+
+    correspondence = [[int(kk), int(first[kk]), first_dist[kk]] for kk in np.where(associated)[0]]
+    nocorrespondence = np.where(~associated)[0].tolist()
+
+    return correspondence, nocorrespondence
+
+
 def sortSpotsDataCor(data_theta, Chi, posx, posy, dataintensity, referenceList,
                                                                         thresholddistances=(10,50)):
     """